@@ -0,0 +1,363 @@
+import os
+import json
+import time
+import asyncio
+
+import openai
+
+import cache
+import tokens
+
+DEFAULT_POOL_SIZE = 16
+
+# Synthetic latency of replayed completions
+DEFAULT_REPLAY_LATENCY = 0.0
+DEFAULT_REPLAY_TOKENS_PER_SECOND = None
+
+
+class ReplayMissError(openai.error.OpenAIError):
+    pass
+
+
+def get_request_key(chatgpt_model, messages, temperature, seed):
+    # Same key as the completion cache, so recordings and cache entries agree
+    prompt = messages[0]['content']
+    serialized_model = messages[1]['content']
+
+    return cache.CompletionCache.key(chatgpt_model, temperature, seed, prompt, serialized_model)
+
+
+def get_format_kwargs(response_format):
+    # Endpoints without structured output reject the field, only send it when set
+    if response_format is None:
+        return {}
+
+    return {"response_format": response_format}
+
+
+class OpenAIBackend:
+    """
+    OpenAI-compatible HTTP backend.
+
+    Requests go to `api_base` with `api_key` over keep-alive connections
+    pooled per backend, up to `pool_size` per host, instead of the
+    per-request sessions of the openai module.
+    """
+
+    def __init__(self, api_base=None, api_key=None, pool_size=DEFAULT_POOL_SIZE):
+        self.api_base = api_base or openai.api_base
+        self.api_key = api_key or openai.api_key
+        self.pool_size = pool_size
+
+        self.session = None
+        self.asession = None
+
+    def get_session(self):
+        if self.session is None:
+            import requests
+
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=self.pool_size)
+
+            self.session = requests.Session()
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+
+            openai.requestssession = self.session
+
+        return self.session
+
+    async def astart(self):
+        import aiohttp
+
+        self.asession = aiohttp.ClientSession(connector=aiohttp.TCPConnector(
+            limit_per_host=self.pool_size, keepalive_timeout=30))
+
+        openai.aiosession.set(self.asession)
+
+    async def aclose(self):
+        if self.asession is not None:
+            await self.asession.close()
+
+            self.asession = None
+
+    def complete(self, chatgpt_model, messages, temperature, seed, request_timeout=None, stream=False, response_format=None):
+        self.get_session()
+
+        return openai.ChatCompletion.create(model=chatgpt_model,
+                                            temperature=temperature,
+                                            seed=seed,
+                                            messages=messages,
+                                            request_timeout=request_timeout,
+                                            stream=stream,
+                                            api_base=self.api_base,
+                                            api_key=self.api_key,
+                                            **get_format_kwargs(response_format))
+
+    async def acomplete(self, chatgpt_model, messages, temperature, seed, request_timeout=None, stream=False, response_format=None):
+        return await openai.ChatCompletion.acreate(model=chatgpt_model,
+                                                   temperature=temperature,
+                                                   seed=seed,
+                                                   messages=messages,
+                                                   request_timeout=request_timeout,
+                                                   stream=stream,
+                                                   api_base=self.api_base,
+                                                   api_key=self.api_key,
+                                                   **get_format_kwargs(response_format))
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+
+            self.session = None
+
+
+def read_recordings(path):
+    recordings = {}
+
+    if not os.path.exists(path):
+        return recordings
+
+    with open(path, 'r') as fp:
+        for line in fp:
+            if line.strip():
+                recording = json.loads(line)
+                recordings[recording['key']] = recording['completion']
+
+    return recordings
+
+
+def build_chunks(completion):
+    """
+    Split a recorded completion into streamed chunks, one per word.
+    """
+    content = completion['choices'][0]['message']['content']
+
+    chunk = {
+        "id": completion.get('id'),
+        "object": "chat.completion.chunk",
+        "created": completion.get('created'),
+        "model": completion.get('model')
+    }
+
+    for index, word in enumerate(content.split(' ')):
+        delta = word if index == 0 else ' ' + word
+
+        yield openai.util.convert_to_openai_object({**chunk, "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]})
+
+
+class ReplayBackend:
+    """
+    Serves completions recorded by a RecordingBackend, without network.
+
+    Each reply waits `latency` seconds before its first token and, with
+    `tokens_per_second`, as long as generating its completion tokens would
+    take, so runs can be benchmarked and profiled offline.
+    """
+
+    def __init__(self, path, latency=DEFAULT_REPLAY_LATENCY, tokens_per_second=DEFAULT_REPLAY_TOKENS_PER_SECOND):
+        self.path = path
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+
+        self.recordings = read_recordings(path)
+
+        print(f"Replaying {len(self.recordings)} completions from {path}")
+
+    def lookup(self, chatgpt_model, messages, temperature, seed):
+        key = get_request_key(chatgpt_model, messages, temperature, seed)
+
+        if key not in self.recordings:
+            raise ReplayMissError(
+                f'No recorded completion for this {chatgpt_model} request in {self.path}.')
+
+        return self.recordings[key]
+
+    def get_generation_time(self, completion):
+        if not self.tokens_per_second:
+            return 0.0
+
+        return completion['usage']['completion_tokens'] / self.tokens_per_second
+
+    def get_chunk_delay(self, completion):
+        chunks = len(completion['choices'][0]['message']['content'].split(' '))
+
+        return self.get_generation_time(completion) / chunks
+
+    def iter_chunks(self, completion):
+        time.sleep(self.latency)
+
+        delay = self.get_chunk_delay(completion)
+
+        for chunk in build_chunks(completion):
+            yield chunk
+
+            time.sleep(delay)
+
+    async def aiter_chunks(self, completion):
+        await asyncio.sleep(self.latency)
+
+        delay = self.get_chunk_delay(completion)
+
+        for chunk in build_chunks(completion):
+            yield chunk
+
+            await asyncio.sleep(delay)
+
+    def complete(self, chatgpt_model, messages, temperature, seed, request_timeout=None, stream=False, response_format=None):
+        completion = self.lookup(chatgpt_model, messages, temperature, seed)
+
+        if stream:
+            return self.iter_chunks(completion)
+
+        time.sleep(self.latency + self.get_generation_time(completion))
+
+        return openai.util.convert_to_openai_object(completion)
+
+    async def acomplete(self, chatgpt_model, messages, temperature, seed, request_timeout=None, stream=False, response_format=None):
+        completion = self.lookup(chatgpt_model, messages, temperature, seed)
+
+        if stream:
+            return self.aiter_chunks(completion)
+
+        await asyncio.sleep(self.latency + self.get_generation_time(completion))
+
+        return openai.util.convert_to_openai_object(completion)
+
+    async def astart(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def assemble_streamed_completion(chatgpt_model, messages, chunks):
+    """
+    Rebuild a non-streamed completion from its chunks, with usage counted
+    locally as streamed responses carry none.
+    """
+    content = ''.join(chunk.choices[0].delta.get(
+        'content') or '' for chunk in chunks if chunk.choices)
+
+    prompt_tokens = tokens.count_chat_tokens(messages, chatgpt_model)
+    completion_tokens = tokens.count_tokens(content, chatgpt_model)
+
+    return {
+        "id": chunks[0].get('id') if chunks else None,
+        "object": "chat.completion",
+        "created": chunks[0].get('created') if chunks else None,
+        "model": chatgpt_model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    }
+
+
+class RecordingBackend:
+    """
+    Wraps a backend and appends every completion it returns to a JSONL
+    file that a ReplayBackend can serve later.
+    """
+
+    def __init__(self, backend, path):
+        self.backend = backend
+        self.path = path
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def record(self, chatgpt_model, messages, temperature, seed, completion):
+        recording = {
+            "key": get_request_key(chatgpt_model, messages, temperature, seed),
+            "chatgpt_model": chatgpt_model,
+            "completion": completion
+        }
+
+        with open(self.path, 'a') as fp:
+            fp.write(json.dumps(recording) + '\n')
+
+    def iter_recorded_chunks(self, chatgpt_model, messages, temperature, seed, completion):
+        chunks = []
+
+        for chunk in completion:
+            chunks.append(chunk)
+
+            yield chunk
+
+        self.record(chatgpt_model, messages, temperature, seed,
+                    assemble_streamed_completion(chatgpt_model, messages, chunks))
+
+    async def aiter_recorded_chunks(self, chatgpt_model, messages, temperature, seed, completion):
+        chunks = []
+
+        async for chunk in completion:
+            chunks.append(chunk)
+
+            yield chunk
+
+        self.record(chatgpt_model, messages, temperature, seed,
+                    assemble_streamed_completion(chatgpt_model, messages, chunks))
+
+    def complete(self, chatgpt_model, messages, temperature, seed, request_timeout=None, stream=False, response_format=None):
+        completion = self.backend.complete(
+            chatgpt_model, messages, temperature, seed, request_timeout, stream, response_format)
+
+        if stream:
+            return self.iter_recorded_chunks(chatgpt_model, messages, temperature, seed, completion)
+
+        self.record(chatgpt_model, messages, temperature,
+                    seed, completion.to_dict_recursive())
+
+        return completion
+
+    async def acomplete(self, chatgpt_model, messages, temperature, seed, request_timeout=None, stream=False, response_format=None):
+        completion = await self.backend.acomplete(chatgpt_model, messages, temperature, seed, request_timeout, stream, response_format)
+
+        if stream:
+            return self.aiter_recorded_chunks(chatgpt_model, messages, temperature, seed, completion)
+
+        self.record(chatgpt_model, messages, temperature,
+                    seed, completion.to_dict_recursive())
+
+        return completion
+
+    async def astart(self):
+        await self.backend.astart()
+
+    async def aclose(self):
+        await self.backend.aclose()
+
+    def close(self):
+        self.backend.close()
+
+
+def create_backend(settings):
+    """
+    Build the backend described by the "backend" entry of parameters.json:
+    {"type": "openai", "api_base": ..., "pool_size": ...} or
+    {"type": "replay", "path": ..., "latency": ..., "tokens_per_second": ...},
+    optionally with a "record" path to capture every completion.
+    """
+    backend_type = settings.get('type', 'openai')
+
+    if backend_type == 'openai':
+        backend = OpenAIBackend(settings.get('api_base'), settings.get(
+            'api_key'), settings.get('pool_size', DEFAULT_POOL_SIZE))
+    elif backend_type == 'replay':
+        if not settings.get('path'):
+            raise Exception('The replay backend needs a recordings path.')
+
+        backend = ReplayBackend(settings['path'], settings.get('latency', DEFAULT_REPLAY_LATENCY),
+                                settings.get('tokens_per_second', DEFAULT_REPLAY_TOKENS_PER_SECOND))
+    else:
+        raise Exception(f'Unknown backend {backend_type}.')
+
+    if settings.get('record'):
+        backend = RecordingBackend(backend, settings['record'])
+
+    return backend
@@ -0,0 +1,138 @@
+import os
+import json
+import time
+
+import openai
+import requests
+
+# Batch completions are billed at half the synchronous price
+BATCH_PRICE_FACTOR = 0.5
+
+# Maximum number of requests the provider accepts in one batch
+BATCH_MAX_REQUESTS = 50000
+
+BATCH_FINAL_STATUSES = ['completed', 'failed', 'expired', 'cancelled']
+
+DEFAULT_POLL_INTERVAL = 60
+
+
+class BatchRequestError(Exception):
+    pass
+
+
+def get_headers():
+    return {'Authorization': f'Bearer {openai.api_key}'}
+
+
+def build_batch_request(testcase, seed, messages):
+    return {
+        "custom_id": testcase['testcase_hash'],
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": testcase['chatgpt_model'],
+            "temperature": testcase['temperature'],
+            "seed": seed,
+            "messages": messages
+        }
+    }
+
+
+def write_batch_input(path, batch_requests):
+    with open(path, 'w') as fp:
+        for batch_request in batch_requests:
+            fp.write(json.dumps(batch_request) + '\n')
+
+
+def upload_batch_input(path):
+    with open(path, 'rb') as fp:
+        response = requests.post(f'{openai.api_base}/files', headers=get_headers(),
+                                 data={'purpose': 'batch'}, files={'file': (os.path.basename(path), fp)})
+
+    response.raise_for_status()
+
+    return response.json()['id']
+
+
+def create_batch(input_file_id):
+    response = requests.post(f'{openai.api_base}/batches', headers=get_headers(), json={
+        "input_file_id": input_file_id,
+        "endpoint": "/v1/chat/completions",
+        "completion_window": "24h"
+    })
+
+    response.raise_for_status()
+
+    return response.json()
+
+
+def retrieve_batch(batch_id):
+    response = requests.get(
+        f'{openai.api_base}/batches/{batch_id}', headers=get_headers())
+
+    response.raise_for_status()
+
+    return response.json()
+
+
+def download_file(file_id):
+    response = requests.get(
+        f'{openai.api_base}/files/{file_id}/content', headers=get_headers())
+
+    response.raise_for_status()
+
+    return response.text
+
+
+def wait_for_batch(batch_id, poll_interval=DEFAULT_POLL_INTERVAL):
+    while True:
+        batch = retrieve_batch(batch_id)
+
+        if batch['status'] in BATCH_FINAL_STATUSES:
+            return batch
+
+        counts = batch.get('request_counts') or {}
+
+        print(
+            f"Batch {batch_id} is {batch['status']} ({counts.get('completed', 0)}/{counts.get('total', '?')} completed), polling again in {poll_interval}s")
+
+        time.sleep(poll_interval)
+
+
+def read_batch_results(batch):
+    """
+    Download the output and error files of a finished batch, returning the
+    result lines keyed by custom_id.
+    """
+    results = {}
+
+    for file_key in ['output_file_id', 'error_file_id']:
+        file_id = batch.get(file_key)
+
+        if not file_id:
+            continue
+
+        for line in download_file(file_id).splitlines():
+            if not line.strip():
+                continue
+
+            result = json.loads(line)
+
+            results[result['custom_id']] = result
+
+    return results
+
+
+def read_batch_state(path):
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'r') as fp:
+        return json.load(fp)
+
+
+def write_batch_state(path, state):
+    with open(path, 'w') as fp:
+        serialized_json = json.dumps(state, indent=4)
+
+        fp.write(serialized_json)
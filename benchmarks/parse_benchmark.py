@@ -0,0 +1,167 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bpmn_model  # noqa: E402
+
+
+def make_collaboration(pools, tasks_per_pool):
+    """
+    Build a large collaboration diagram: one process per pool, each a chain
+    of tasks split by exclusive gateways, with BPMNDI shapes for every node.
+    """
+    participants = []
+    processes = []
+    shapes = []
+
+    for pool in range(pools):
+        nodes = [('startEvent', f'start_{pool}')]
+
+        for task in range(tasks_per_pool):
+            nodes.append(('userTask', f'task_{pool}_{task}'))
+
+            if task % 5 == 4:
+                nodes.append(('exclusiveGateway', f'gateway_{pool}_{task}'))
+
+        nodes.append(('endEvent', f'end_{pool}'))
+
+        elements = []
+
+        for index, (type, id) in enumerate(nodes):
+            elements.append(
+                f'<bpmn:{type} id="{id}" name="Step {index} of pool {pool}" />')
+            shapes.append(
+                f'<bpmndi:BPMNShape id="{id}_di" bpmnElement="{id}"><dc:Bounds x="{index * 150}" y="{pool * 300}" width="100" height="80" /></bpmndi:BPMNShape>')
+
+        for index in range(len(nodes) - 1):
+            flow_id = f'flow_{pool}_{index}'
+
+            elements.append(
+                f'<bpmn:sequenceFlow id="{flow_id}" sourceRef="{nodes[index][1]}" targetRef="{nodes[index + 1][1]}" />')
+            shapes.append(
+                f'<bpmndi:BPMNEdge id="{flow_id}_di" bpmnElement="{flow_id}"><di:waypoint x="{index * 150 + 100}" y="{pool * 300 + 40}" /><di:waypoint x="{index * 150 + 150}" y="{pool * 300 + 40}" /></bpmndi:BPMNEdge>')
+
+        lane_refs = ''.join(
+            f'<bpmn:flowNodeRef>{id}</bpmn:flowNodeRef>' for _, id in nodes)
+
+        participants.append(
+            f'<bpmn:participant id="participant_{pool}" name="Pool {pool}" processRef="process_{pool}" />')
+        processes.append(
+            f'<bpmn:process id="process_{pool}" isExecutable="false"><bpmn:laneSet id="laneset_{pool}"><bpmn:lane id="lane_{pool}" name="Lane {pool}">{lane_refs}</bpmn:lane></bpmn:laneSet>{"".join(elements)}</bpmn:process>')
+
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<bpmn:definitions xmlns:bpmn="http://www.omg.org/spec/BPMN/20100524/MODEL" '
+        'xmlns:bpmndi="http://www.omg.org/spec/BPMN/20100524/DI" '
+        'xmlns:dc="http://www.omg.org/spec/DD/20100524/DC" '
+        'xmlns:di="http://www.omg.org/spec/DD/20100524/DI" '
+        'id="Definitions_benchmark" targetNamespace="http://bpmn.io/schema/bpmn">'
+        f'<bpmn:collaboration id="collaboration">{"".join(participants)}</bpmn:collaboration>'
+        f'{"".join(processes)}'
+        '<bpmndi:BPMNDiagram id="diagram"><bpmndi:BPMNPlane id="plane" bpmnElement="collaboration">'
+        f'{"".join(shapes)}'
+        '</bpmndi:BPMNPlane></bpmndi:BPMNDiagram>'
+        '</bpmn:definitions>'
+    )
+
+
+def annotate_previously(path):
+    """
+    The previous pipeline: read the text, let bpmn_python re-read and parse
+    the file, then parse it once more for pools, lanes and the model id.
+    """
+    import bpmn_python.bpmn_diagram_metrics as metrics
+    import bpmn_python.bpmn_diagram_rep as diagram
+    from xml.etree import ElementTree as ET
+
+    serialized_model = open(path, 'r').read()
+
+    bpmn_graph = diagram.BpmnDiagramGraph()
+    bpmn_graph.load_diagram_from_xml_file(path)
+
+    metrics.all_activities_count(bpmn_graph)
+    metrics.all_events_count(bpmn_graph)
+    metrics.all_gateways_count(bpmn_graph)
+    metrics.get_activities_counts(bpmn_graph)
+    metrics.get_events_counts(bpmn_graph)
+    metrics.get_gateway_counts(bpmn_graph)
+    metrics.CoefficientOfNetworkComplexity_metric(bpmn_graph)
+    metrics.DurfeeSquare_metric(bpmn_graph)
+    metrics.all_control_flow_elements_count(bpmn_graph)
+
+    root = ET.fromstring(serialized_model)
+    namespaces = {'bpmn': bpmn_model.BPMN_NAMESPACE}
+    root.findall('.//bpmn:participant', namespaces)
+    root.findall('.//bpmn:lane', namespaces)
+
+
+def annotate_single_pass(path):
+    with open(path, 'rb') as f:
+        source = f.read()
+
+    bpmn_model.compute_metrics(bpmn_model.parse(source))
+
+
+def run(name, function, paths, repeat):
+    start = time.perf_counter()
+
+    for _ in range(repeat):
+        for path in paths:
+            function(path)
+
+    elapsed = (time.perf_counter() - start) / (repeat * len(paths))
+
+    print(f"{name:<16} {elapsed * 1000:>10.2f}ms/model")
+
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare the previous and the single-pass metrics pipeline.')
+
+    parser.add_argument('dataset_dir', nargs='?',
+                        help='Dataset to benchmark, a synthetic collaboration diagram is used otherwise')
+    parser.add_argument('--pools', type=int, default=20)
+    parser.add_argument('--tasks', type=int, default=200,
+                        help='Tasks per pool of the synthetic diagram')
+    parser.add_argument('--repeat', type=int, default=5)
+
+    args = parser.parse_args()
+
+    if args.dataset_dir is not None:
+        paths = [os.path.join(root, file) for root, _, files in os.walk(
+            args.dataset_dir) for file in sorted(files) if file.endswith('.bpmn')]
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'collaboration.bpmn')
+
+        with open(path, 'w') as f:
+            f.write(make_collaboration(args.pools, args.tasks))
+
+        paths = [path]
+
+    if len(paths) == 0:
+        raise Exception('No bpmn files found in dataset directory.')
+
+    print(
+        f"Benchmarking {len(paths)} models ({sum(os.path.getsize(p) for p in paths) / 1024:.0f} KB) using {bpmn_model.etree.__name__}")
+
+    baseline = None
+
+    try:
+        baseline = run('previous', annotate_previously, paths, args.repeat)
+    except ImportError:
+        print('bpmn_python is not installed, skipping the previous pipeline.')
+
+    single_pass = run('single pass', annotate_single_pass, paths, args.repeat)
+
+    if baseline is not None:
+        print(f"Speedup: {baseline / single_pass:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
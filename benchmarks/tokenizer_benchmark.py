@@ -0,0 +1,92 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tokens  # noqa: E402
+
+
+def read_serialized_models(dataset_dir):
+    serialized_models = []
+
+    for root, _, files in os.walk(dataset_dir):
+        for file in sorted(files):
+            if file.endswith('.bpmn'):
+                with open(os.path.join(root, file), 'r') as f:
+                    serialized_models.append(f.read())
+
+    return serialized_models
+
+
+def benchmark_gpt2(serialized_models):
+    """
+    The previous approach: load the slow GPT-2 tokenizer for every model.
+    """
+    from transformers import GPT2Tokenizer
+
+    counts = []
+
+    for serialized_model in serialized_models:
+        tokenizer = GPT2Tokenizer.from_pretrained('gpt2')
+
+        counts.append(len(tokenizer.encode(serialized_model)))
+
+    return counts
+
+
+def benchmark_tiktoken(serialized_models):
+    return [tokens.count_tokens(serialized_model) for serialized_model in serialized_models]
+
+
+def benchmark_tiktoken_batch(serialized_models):
+    return tokens.count_tokens_batch(serialized_models)
+
+
+def run(name, function, serialized_models):
+    start = time.perf_counter()
+    counts = function(serialized_models)
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{name:<24} {elapsed:>9.3f}s {elapsed / len(serialized_models) * 1000:>9.2f}ms/model {sum(counts):>12} tokens")
+
+    return elapsed
+
+
+def main():
+    if len(sys.argv) < 2:
+        raise Exception('Dataset directory not specified.')
+
+    dataset_dir = sys.argv[1]
+
+    serialized_models = read_serialized_models(dataset_dir)
+
+    if len(serialized_models) == 0:
+        raise Exception('No bpmn files found in dataset directory.')
+
+    print(
+        f"Tokenizing {len(serialized_models)} models ({sum(len(m) for m in serialized_models)} characters)")
+
+    # Load the encoding before timing, as preprocess does once per process
+    tokens.get_encoding()
+
+    baseline = None
+
+    try:
+        baseline = run('gpt2 (per model load)', benchmark_gpt2,
+                       serialized_models)
+    except ImportError:
+        print('transformers is not installed, skipping the GPT-2 baseline.')
+
+    single = run('tiktoken', benchmark_tiktoken, serialized_models)
+    batch = run('tiktoken (batch)', benchmark_tiktoken_batch,
+                serialized_models)
+
+    if baseline is not None:
+        print(
+            f"Speedup: {baseline / single:.1f}x single, {baseline / batch:.1f}x batch")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+from collections import Counter
+
+try:
+    from lxml import etree
+except ImportError:
+    from xml.etree import ElementTree as etree
+
+BPMN_NAMESPACE = 'http://www.omg.org/spec/BPMN/20100524/MODEL'
+
+# Every BPMN activity, event and gateway type, for serializing models and
+# reading their labels. The metrics count narrower sets, see below.
+ACTIVITY_TYPES = [
+    'task',
+    'userTask',
+    'serviceTask',
+    'manualTask',
+    'scriptTask',
+    'sendTask',
+    'receiveTask',
+    'businessRuleTask',
+    'subProcess',
+    'adHocSubProcess',
+    'transaction',
+    'callActivity'
+]
+
+EVENT_TYPES = [
+    'startEvent',
+    'intermediateCatchEvent',
+    'intermediateThrowEvent',
+    'endEvent',
+    'boundaryEvent'
+]
+
+GATEWAY_TYPES = [
+    'inclusiveGateway',
+    'exclusiveGateway',
+    'parallelGateway',
+    'eventBasedGateway',
+    'complexGateway'
+]
+
+
+def parse(source: bytes):
+    """
+    Parse a serialized BPMN model once, with lxml when it is available.
+    """
+    return etree.fromstring(source)
+
+
+def split_tag(element):
+    """
+    Return the (namespace, local name) of an element, or (None, None) for
+    comments and processing instructions.
+    """
+    tag = element.tag
+
+    if not isinstance(tag, str):
+        return None, None
+
+    if tag.startswith('{'):
+        namespace, local_name = tag[1:].split('}', 1)
+
+        return namespace, local_name
+
+    return None, tag
+
+
+def iter_bpmn_elements(root):
+    for element in root.iter():
+        namespace, local_name = split_tag(element)
+
+        if namespace == BPMN_NAMESPACE:
+            yield local_name, element
+
+
+def get_element_counts(root):
+    return Counter(local_name for local_name, _ in iter_bpmn_elements(root))
+
+
+def get_labels(root, types):
+    """
+    Whitespace-normalized names of the labelled elements of the given types.
+    """
+    labels = []
+
+    for local_name, element in iter_bpmn_elements(root):
+        if local_name not in types:
+            continue
+
+        name = element.attrib.get('name')
+
+        if name is not None and name.strip():
+            labels.append(' '.join(name.split()))
+
+    return labels
+
+
+# Element types the metrics count, as bpmn_python.bpmn_diagram_metrics
+# defines them: A counts plain tasks and subprocesses only, E leaves
+# boundary events out
+METRIC_ACTIVITY_TYPES = ['task', 'subProcess']
+
+METRIC_EVENT_TYPES = [
+    'startEvent',
+    'endEvent',
+    'intermediateCatchEvent',
+    'intermediateThrowEvent'
+]
+
+METRIC_GATEWAY_TYPES = GATEWAY_TYPES
+
+# Flow elements bpmn_python imports as graph nodes, every other type is
+# left out of the graph
+GRAPH_NODE_TYPES = ['task', 'userTask', 'serviceTask', 'manualTask', 'subProcess',
+                    'dataObject', 'boundaryEvent'] + METRIC_EVENT_TYPES + GATEWAY_TYPES
+
+
+def import_graph_elements(container, node_types, edges):
+    """
+    Add the nodes and sequence flows of a process or subprocess, and those of
+    its subprocesses, the way bpmn_python imports them.
+    """
+    for element in container:
+        _, local_name = split_tag(element)
+
+        if local_name in GRAPH_NODE_TYPES:
+            node_types[element.attrib.get('id', '')] = local_name
+
+            if local_name == 'subProcess':
+                import_graph_elements(element, node_types, edges)
+
+    for element in container:
+        if split_tag(element)[1] == 'sequenceFlow':
+            edges.add(frozenset(
+                [element.attrib.get('sourceRef', ''), element.attrib.get('targetRef', '')]))
+
+
+def build_graph(root):
+    """
+    Node types by id and edges of the undirected graph bpmn_python builds
+    from a model: the nodes of every process, participants without a
+    process, and sequence and message flows deduplicated by their ends.
+    Flow ends bpmn_python does not import become nodes without a type.
+    """
+    node_types = {}
+    edges = set()
+
+    for local_name, element in iter_bpmn_elements(root):
+        if local_name == 'process':
+            import_graph_elements(element, node_types, edges)
+
+    collaboration = next((element for local_name, element in iter_bpmn_elements(
+        root) if local_name == 'collaboration'), None)
+
+    if collaboration is not None:
+        for element in collaboration:
+            _, local_name = split_tag(element)
+
+            if local_name == 'participant' and not element.attrib.get('processRef'):
+                node_types[element.attrib.get('id', '')] = 'participant'
+            elif local_name == 'messageFlow':
+                edges.add(frozenset(
+                    [element.attrib.get('sourceRef', ''), element.attrib.get('targetRef', '')]))
+
+    for edge in edges:
+        for node_id in edge:
+            node_types.setdefault(node_id, None)
+
+    return node_types, edges
+
+
+def get_durfee_square(type_counts):
+    """
+    Largest d such that d node types occur at least d times each, computed
+    with the histogram of bpmn_python's DurfeeSquare_metric.
+    """
+    length = len(type_counts)
+
+    histogram = [0] * (length + 1)
+
+    for count in type_counts.values():
+        histogram[min(count, length)] += 1
+
+    total = 0
+
+    for d, count in reversed(list(enumerate(histogram))):
+        total += count
+
+        if total >= d:
+            return d
+
+    return 0
+
+
+def compute_metrics(root):
+    """
+    Derive every model metric from a single parsed tree.
+
+    The metrics port bpmn_python.bpmn_diagram_metrics and its graph import,
+    that earlier annotations were computed with: TA counts tasks and
+    subprocesses, TE the start, end and intermediate events, CNC divides the
+    flows by every node of the graph and Durfee counts every node type.
+    Like the original pipeline, N is A + E + G and `sequence_flows_count`
+    (F) is bpmn_python's control flow element count, i.e. E + G.
+
+    Models with flows between elements bpmn_python does not import made it
+    fail, here those ends count as untyped nodes in CNC and not in Durfee.
+    """
+    element_counts = get_element_counts(root)
+    node_types, edges = build_graph(root)
+
+    graph_type_counts = Counter(
+        type for type in node_types.values() if type is not None)
+
+    type_activities_count = {
+        type: graph_type_counts[type] for type in METRIC_ACTIVITY_TYPES}           # TA
+    type_events_count = {
+        type: graph_type_counts[type] for type in METRIC_EVENT_TYPES}              # TE
+    type_gateways_count = {
+        type: graph_type_counts[type] for type in METRIC_GATEWAY_TYPES}            # TG
+
+    activities_count = sum(type_activities_count.values())                     # A
+    events_count = sum(type_events_count.values())                             # E
+    gateways_count = sum(type_gateways_count.values())                         # G
+
+    nodes_count = activities_count + events_count + gateways_count              # N
+
+    sequence_flows_count = events_count + gateways_count                       # F
+
+    cnc = len(edges) / \
+        len(node_types) if len(node_types) > 0 else 0                           # CNC
+    durfee = get_durfee_square(graph_type_counts)                               # D
+
+    pools_count = element_counts['participant']                                # P
+    lanes_count = element_counts['lane']                                       # L
+
+    return {
+        "model_id": root.attrib['id'],
+        "activities_count": activities_count,
+        "events_count": events_count,
+        "gateways_count": gateways_count,
+        "type_activities_count": type_activities_count,
+        "type_events_count": type_events_count,
+        "type_gateways_count": type_gateways_count,
+        "cnc": cnc,
+        "durfee": durfee,
+        "nodes_count": nodes_count,
+        "sequence_flows_count": sequence_flows_count,
+        "pools_count": pools_count,
+        "lanes_count": lanes_count
+    }
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+DEFAULT_CACHE_DIR = '.cache'
+DEFAULT_MAX_SIZE_MB = 512
+
+
+class CompletionCache:
+    """
+    Content-addressed cache of chat completions stored in SQLite.
+
+    Entries are keyed on everything that determines a completion (model,
+    temperature, seed, system prompt and serialized model) and evicted least
+    recently used first once the cache grows past `max_size_mb`. With
+    `refresh`, lookups always miss but fresh completions are still stored.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size_mb=DEFAULT_MAX_SIZE_MB, refresh=False):
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.path = os.path.join(cache_dir, 'completions.sqlite')
+        self.max_size = max_size_mb * 1024 * 1024
+        self.refresh = refresh
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.connection = sqlite3.connect(self.path, timeout=30)
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                chatgpt_model TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS completions_last_access ON completions (last_access)')
+        self.connection.commit()
+
+    @classmethod
+    def from_metadata(cls, metadata, refresh=False):
+        settings = metadata.get('cache', {})
+
+        return cls(settings.get('dir', DEFAULT_CACHE_DIR), settings.get('max_size_mb', DEFAULT_MAX_SIZE_MB), refresh)
+
+    @staticmethod
+    def key(chatgpt_model, temperature, seed, prompt, serialized_model):
+        serialized_key = json.dumps(
+            [chatgpt_model, float(temperature), seed, prompt, serialized_model], ensure_ascii=False)
+
+        return hashlib.sha256(serialized_key.encode('utf-8')).hexdigest()
+
+    def get(self, chatgpt_model, temperature, seed, prompt, serialized_model):
+        if self.refresh:
+            self.misses += 1
+            return None
+
+        key = self.key(chatgpt_model, temperature,
+                       seed, prompt, serialized_model)
+
+        row = self.connection.execute(
+            'SELECT value FROM completions WHERE key = ?', (key,)).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.connection.execute(
+            'UPDATE completions SET last_access = ? WHERE key = ?', (time.time(), key))
+        self.connection.commit()
+
+        self.hits += 1
+
+        return json.loads(row[0])
+
+    def put(self, chatgpt_model, temperature, seed, prompt, serialized_model, completion):
+        key = self.key(chatgpt_model, temperature,
+                       seed, prompt, serialized_model)
+
+        value = json.dumps(completion)
+        now = time.time()
+
+        self.connection.execute(
+            'INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?, ?)',
+            (key, chatgpt_model, value, len(value), now, now))
+        self.connection.commit()
+
+        self.evict()
+
+    def size(self):
+        return self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM completions').fetchone()[0]
+
+    def evict(self):
+        excess = self.size() - self.max_size
+
+        if excess <= 0:
+            return
+
+        evicted_keys = []
+
+        for key, size in self.connection.execute('SELECT key, size FROM completions ORDER BY last_access'):
+            evicted_keys.append((key,))
+            excess -= size
+
+            if excess <= 0:
+                break
+
+        self.connection.executemany(
+            'DELETE FROM completions WHERE key = ?', evicted_keys)
+        self.connection.commit()
+
+        self.evictions += len(evicted_keys)
+
+    def print_statistics(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups * 100 if lookups > 0 else 0
+
+        entries = self.connection.execute(
+            'SELECT COUNT(*) FROM completions').fetchone()[0]
+
+        print(
+            f"Completion cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), {self.evictions} evictions, {entries} entries, {self.size() / 1024 / 1024:.1f} MB in {self.path}")
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,395 @@
+import copy
+import functools
+
+import bpmn_model
+import openai_models
+import planner
+import serializers
+import tokens
+
+from bpmn_model import etree, BPMN_NAMESPACE
+
+# Fraction of the context window of the chatgpt_model a chunk or merge
+# request may fill, expected completion included
+DEFAULT_MAX_CHUNK_FRACTION = 0.5
+
+# Chunk calls of one testcase in flight at once
+DEFAULT_MAX_PARALLEL = 4
+
+CHUNK_INSTRUCTIONS = 'This message contains part {index} of {count} of a larger BPMN model: the {kind} "{label}". Follow the instructions for this part only. Elements of other parts may be referenced by id, do not describe them.'
+
+MERGE_INSTRUCTIONS = 'This message contains descriptions of {count} parts of one BPMN model, each part being a pool, lane or subprocess. Merge them into a single description of the whole model that follows the instructions, keeping every activity and the order in which they happen, without mentioning the parts.'
+
+
+class ChunkingError(Exception):
+    pass
+
+
+class ChunkingPolicy:
+    """
+    When and how models are split for chunked generation, as configured by
+    the "chunking" entry of parameters.json. Models that do not fit the
+    context window of their chatgpt_model are always chunked, those of at
+    least `min_tokens` tokens too.
+    """
+
+    def __init__(self, max_chunk_fraction=DEFAULT_MAX_CHUNK_FRACTION, max_parallel=DEFAULT_MAX_PARALLEL, min_tokens=None):
+        self.max_chunk_fraction = max_chunk_fraction
+        self.max_parallel = max_parallel
+        self.min_tokens = min_tokens
+
+    @classmethod
+    def from_metadata(cls, metadata):
+        return cls(**metadata.get('chunking', {}))
+
+    def get_capacity(self, chatgpt_model):
+        return int(openai_models.openai_token_limits.get(chatgpt_model, 0) * self.max_chunk_fraction)
+
+
+def bpmn_tag(local_name):
+    return f'{{{BPMN_NAMESPACE}}}{local_name}'
+
+
+def iter_process_units(root):
+    """
+    Yield the (kind, label, process) of every pool, and of every process
+    without a pool.
+    """
+    processes = {process.attrib.get('id'): process for process in root.iter(
+        bpmn_tag('process'))}
+
+    pooled = set()
+
+    for participant in root.iter(bpmn_tag('participant')):
+        process_ref = participant.attrib.get('processRef')
+
+        if process_ref in processes:
+            pooled.add(process_ref)
+
+            yield 'pool', serializers.get_label(participant) or process_ref, processes[process_ref]
+
+    for process_id, process in processes.items():
+        if process_id not in pooled:
+            yield 'process', serializers.get_label(process) or process_id, process
+
+
+def get_leaf_lanes(process):
+    return [lane for lane in process.iter(bpmn_tag('lane')) if lane.find(bpmn_tag('childLaneSet')) is None]
+
+
+def restrict_to_lane(process, lane):
+    """
+    Copy of a process keeping only the flow nodes of a lane, the sequence
+    flows touching them and the lane itself.
+    """
+    node_ids = set(ref.text.strip() for ref in lane.iter(
+        bpmn_tag('flowNodeRef')) if ref.text)
+
+    restricted = copy.deepcopy(process)
+
+    for element in list(restricted):
+        _, local_name = bpmn_model.split_tag(element)
+
+        if local_name in serializers.FLOW_NODE_TYPES and element.attrib.get('id') not in node_ids:
+            restricted.remove(element)
+        elif local_name == 'sequenceFlow' and element.attrib.get('sourceRef') not in node_ids and element.attrib.get('targetRef') not in node_ids:
+            restricted.remove(element)
+        elif local_name == 'laneSet':
+            restricted.remove(element)
+
+    lane_set = etree.SubElement(restricted, bpmn_tag('laneSet'))
+    lane_set.append(copy.deepcopy(lane))
+
+    return restricted
+
+
+def is_expanded_subprocess(element):
+    _, local_name = bpmn_model.split_tag(element)
+
+    return local_name in serializers.SUBPROCESS_TYPES and any(
+        bpmn_model.split_tag(child)[1] in serializers.FLOW_NODE_TYPES for child in element)
+
+
+def collapse_subprocesses(process):
+    """
+    Copy of a process with the content of its subprocesses removed, and the
+    subprocesses as processes of their own.
+    """
+    collapsed = copy.deepcopy(process)
+    subprocesses = []
+
+    for element in collapsed:
+        if not is_expanded_subprocess(element):
+            continue
+
+        subprocess = etree.Element(bpmn_tag('process'), {
+            "id": element.attrib.get('id', ''), "name": serializers.get_label(element) or ''})
+
+        for child in list(element):
+            if bpmn_model.split_tag(child)[1] not in ['incoming', 'outgoing']:
+                element.remove(child)
+                subprocess.append(child)
+
+        subprocesses.append(subprocess)
+
+    return collapsed, subprocesses
+
+
+def serialize_process(process, serialization):
+    definitions = etree.Element(bpmn_tag('definitions'))
+    definitions.append(copy.deepcopy(process))
+
+    return serializers.serialize(etree.tostring(definitions, encoding='unicode'), serialization)
+
+
+def split_unit(kind, label, process, serialization, chatgpt_model, capacity):
+    """
+    Split a process into chunks of at most `capacity` tokens: by lane first,
+    then by expanded subprocess.
+    """
+    serialized_chunk = serialize_process(process, serialization)
+
+    if tokens.count_tokens(serialized_chunk, chatgpt_model) <= capacity:
+        return [{"kind": kind, "label": label, "serialized_model": serialized_chunk}]
+
+    lanes = get_leaf_lanes(process)
+
+    if len(lanes) > 1:
+        chunks = []
+
+        for lane in lanes:
+            chunks += split_unit('lane', f"{label} / {serializers.get_label(lane) or lane.attrib.get('id')}",
+                                 restrict_to_lane(process, lane), serialization, chatgpt_model, capacity)
+
+        return chunks
+
+    collapsed, subprocesses = collapse_subprocesses(process)
+
+    if len(subprocesses) == 0:
+        raise ChunkingError(
+            f'The {kind} "{label}" exceeds {capacity} tokens and has no lanes or subprocesses to split it by.')
+
+    chunks = split_unit(kind, label, collapsed, serialization,
+                        chatgpt_model, capacity)
+
+    for subprocess in subprocesses:
+        chunks += split_unit('subprocess', serializers.get_label(subprocess) or subprocess.attrib['id'],
+                             subprocess, serialization, chatgpt_model, capacity)
+
+    return chunks
+
+
+def get_message_flows(root):
+    """
+    The message flows between pools, which no chunk sees whole, as lines
+    for the merge request.
+    """
+    names = {}
+
+    for participant in root.iter(bpmn_tag('participant')):
+        label = serializers.get_label(participant) or participant.attrib.get('id')
+
+        names[participant.attrib.get('id')] = label
+        names[participant.attrib.get('processRef')] = label
+
+    for process in root.iter(bpmn_tag('process')):
+        owner = names.get(process.attrib.get('id'))
+
+        for element in process.iter():
+            if owner is not None and element.attrib.get('id') is not None:
+                names.setdefault(element.attrib['id'], owner)
+
+    lines = []
+
+    for message_flow in root.iter(bpmn_tag('messageFlow')):
+        source = names.get(message_flow.attrib.get('sourceRef'), 'unknown')
+        target = names.get(message_flow.attrib.get('targetRef'), 'unknown')
+        label = serializers.get_label(message_flow)
+
+        lines.append(
+            f'{source} sends a message to {target}' + (f': "{label}"' if label else ''))
+
+    return tuple(lines)
+
+
+@functools.lru_cache(maxsize=256)
+def split_model(serialized_model, serialization, chatgpt_model, capacity):
+    """
+    Chunks and message flows of a model, memoized as every prompt and
+    temperature of a sweep splits the same models.
+    """
+    root = bpmn_model.parse(serialized_model.encode('utf-8'))
+
+    chunks = []
+
+    for kind, label, process in iter_process_units(root):
+        chunks += split_unit(kind, label, process,
+                             serialization, chatgpt_model, capacity)
+
+    return tuple(chunks), get_message_flows(root)
+
+
+def get_chunk_capacity(testcase, policy, expected_completion_tokens):
+    """
+    Tokens left for the serialized chunk once the prompt, the chunk
+    instructions and the expected completion are accounted for.
+    """
+    chatgpt_model = testcase['chatgpt_model']
+
+    return policy.get_capacity(chatgpt_model) - expected_completion_tokens - \
+        planner.count_prompt_tokens(testcase['prompt_data'], chatgpt_model) - \
+        tokens.count_tokens(CHUNK_INSTRUCTIONS, chatgpt_model)
+
+
+def needs_chunking(testcase, policy, expected_completion_tokens):
+    if not planner.estimate_testcase(testcase, expected_completion_tokens)['supported']:
+        return True
+
+    return policy.min_tokens is not None and testcase['tokens_count'] >= policy.min_tokens
+
+
+def iter_planned_testcases(testcases, policy, expected_completion_tokens, unsupported):
+    """
+    Attach the chunks of the testcases needing chunked generation, dropping
+    those no split fits, counting them in `unsupported`.
+    """
+    for testcase in testcases:
+        if needs_chunking(testcase, policy, expected_completion_tokens):
+            if testcase['chatgpt_model'] not in openai_models.openai_token_limits:
+                unsupported['count'] += 1
+                continue
+
+            capacity = get_chunk_capacity(
+                testcase, policy, expected_completion_tokens)
+
+            try:
+                testcase['chunks'], testcase['message_flows'] = split_model(
+                    testcase['model']['serialized_model'], testcase['serialization'], testcase['chatgpt_model'], capacity)
+            except ChunkingError as error:
+                print(f"Skipping testcase {testcase['model_id']}: {error}")
+                unsupported['count'] += 1
+                continue
+
+        yield testcase
+
+
+def build_chunk_message(chunks, index):
+    chunk = chunks[index]
+
+    instructions = CHUNK_INSTRUCTIONS.format(
+        index=index + 1, count=len(chunks), kind=chunk['kind'], label=chunk['label'])
+
+    return f"{instructions}\n\n{chunk['serialized_model']}"
+
+
+def build_merge_message(parts, message_flows):
+    """
+    The user message of a merge request: the instructions, the message flows
+    between pools and every partial description.
+    """
+    sections = [MERGE_INSTRUCTIONS.format(count=len(parts))]
+
+    if message_flows:
+        sections.append('Messages exchanged between pools:\n' +
+                        '\n'.join(message_flows))
+
+    for index, (label, description) in enumerate(parts):
+        sections.append(f'### Part {index + 1}: {label}\n{description}')
+
+    return '\n\n'.join(sections)
+
+
+def group_parts(parts, testcase, policy, expected_completion_tokens):
+    """
+    Group the partial descriptions into merge requests that fit the
+    context budget. A single group is the final merge, more groups are
+    merged again one level up.
+    """
+    chatgpt_model = testcase['chatgpt_model']
+
+    capacity = policy.get_capacity(chatgpt_model) - expected_completion_tokens - \
+        planner.count_prompt_tokens(testcase['prompt_data'], chatgpt_model) - \
+        tokens.count_tokens(build_merge_message(
+            [], testcase.get('message_flows')), chatgpt_model)
+
+    groups = [[]]
+    group_tokens = 0
+
+    for part in parts:
+        part_tokens = tokens.count_tokens(part[1], chatgpt_model) + 8
+
+        if len(groups[-1]) > 0 and group_tokens + part_tokens > capacity:
+            groups.append([])
+            group_tokens = 0
+
+        groups[-1].append(part)
+        group_tokens += part_tokens
+
+    return groups
+
+
+def estimate_chunked_tokens(testcase, expected_completion_tokens):
+    """
+    Estimated input and output tokens of every chunk request and a single
+    merge request.
+    """
+    chatgpt_model = testcase['chatgpt_model']
+    chunks = testcase['chunks']
+
+    prompt_tokens = planner.count_prompt_tokens(
+        testcase['prompt_data'], chatgpt_model)
+    instructions_tokens = tokens.count_tokens(CHUNK_INSTRUCTIONS, chatgpt_model)
+
+    input_tokens = sum(prompt_tokens + instructions_tokens + tokens.count_tokens(
+        chunk['serialized_model'], chatgpt_model) for chunk in chunks)
+    input_tokens += prompt_tokens + expected_completion_tokens * len(chunks)
+
+    output_tokens = expected_completion_tokens * (len(chunks) + 1)
+
+    return input_tokens, output_tokens
+
+
+def estimate_request_tokens(testcase, message, expected_completion_tokens):
+    """
+    Tokens a single chunk or merge request reserves from the rate limits:
+    the prompt, its message and the expected completion.
+    """
+    chatgpt_model = testcase['chatgpt_model']
+
+    return planner.count_prompt_tokens(testcase['prompt_data'], chatgpt_model) + \
+        tokens.count_tokens(message, chatgpt_model) + \
+        expected_completion_tokens
+
+
+def estimate_chunked_testcase(testcase, expected_completion_tokens):
+    """
+    Estimate of a testcase shaped like planner.estimate_testcase, counting
+    a request per chunk and a single merge request when it is chunked.
+    """
+    if not testcase.get('chunks'):
+        return planner.estimate_testcase(testcase, expected_completion_tokens)
+
+    input_tokens, output_tokens = estimate_chunked_tokens(
+        testcase, expected_completion_tokens)
+
+    cost = None
+
+    if openai_models.is_priced(testcase['chatgpt_model']):
+        cost = estimate_chunked_cost(testcase, expected_completion_tokens)
+
+    return {
+        "requests": len(testcase['chunks']) + 1,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "supported": True,
+        "cost": cost
+    }
+
+
+def estimate_chunked_cost(testcase, expected_completion_tokens):
+    chatgpt_model = testcase['chatgpt_model']
+
+    if not openai_models.is_priced(chatgpt_model):
+        return 0.0
+
+    return openai_models.estimate_billing(chatgpt_model, *estimate_chunked_tokens(testcase, expected_completion_tokens))
@@ -1,65 +1,185 @@
-
-import sys
+import re
 import json
 import os
-import csv
+import argparse
+import hashlib
 import nltk
 
 from nltk.tokenize import sent_tokenize, word_tokenize
-from nltk.tag import pos_tag
 
-nltk.download('punkt')
+import label_coverage
+import results_store
+import tracing
+
+# Bump whenever the basic_eval fields or how they are computed change, so
+# incremental runs re-evaluate every description
+EVAL_SCHEMA_VERSION = 3
+
+WORD_PATTERN = re.compile(r"[A-Za-z]+(?:'[A-Za-z]+)?")
+VOWEL_GROUPS_PATTERN = re.compile(r'[aeiouy]+')
+
+
+def load_nltk_resources(nltk_data_dir=None):
+    """
+    Load the NLTK tokenizers from a local data directory (or the NLTK_DATA
+    locations) once per process, without touching the network.
+    """
+    tracing.init_worker()
+
+    if nltk_data_dir is not None and nltk_data_dir not in nltk.data.path:
+        nltk.data.path.insert(0, nltk_data_dir)
+
+    try:
+        sent_tokenize('Load the sentence tokenizer.')
+    except LookupError:
+        raise Exception(
+            'NLTK punkt tokenizer not found. Download it once with `python -m nltk.downloader -d <dir> punkt punkt_tab` and pass --nltk-data <dir>.')
+
+
+def count_syllables(word):
+    word = word.lower()
+
+    syllables = len(VOWEL_GROUPS_PATTERN.findall(word))
+
+    # silent trailing e, as in "create" but not "table"
+    if syllables > 1 and word.endswith('e') and not word.endswith(('le', 'ee')):
+        syllables -= 1
+
+    return max(1, syllables)
+
+
+def evaluate_description(item):
+    """
+    Compute every text metric of a description in a single pass over its
+    tokens.
+    """
+    uid, description, activity_elements, input_hash = item
+
+    with tracing.span('nltk_tokenize'):
+        sentences = sent_tokenize(description)
+        words = word_tokenize(description)
+
+    sent_count = len(sentences)
+    word_count = len(words)
+
+    lexical_words = [word.lower()
+                     for word in words if WORD_PATTERN.fullmatch(word)]
+    vocabulary = set(lexical_words)
 
+    lexical_count = len(lexical_words)
+    syllables_count = sum(count_syllables(word) for word in lexical_words)
 
-def evaluate(base_results_dir):
+    # matched like the label coverage stage, so both report the same recall
+    label_hits = label_coverage.get_index(
+        activity_elements, label_coverage.DEFAULT_FUZZY_THRESHOLD).match(description)
 
-    # read all folders
-    folders = [f for f in os.listdir(base_results_dir) if os.path.isdir(
-        os.path.join(base_results_dir, f))]
+    type_token_ratio = None
+    avg_sentence_length = None
+    flesch_reading_ease = None
+    flesch_kincaid_grade = None
 
-    # exclude "descriptiosn"
-    folders = [f for f in folders if f != 'descriptions']
+    if lexical_count > 0 and sent_count > 0:
+        words_per_sentence = lexical_count / sent_count
+        syllables_per_word = syllables_count / lexical_count
 
-    results = []
+        type_token_ratio = len(vocabulary) / lexical_count
+        avg_sentence_length = words_per_sentence
+        flesch_reading_ease = 206.835 - 1.015 * \
+            words_per_sentence - 84.6 * syllables_per_word
+        flesch_kincaid_grade = 0.39 * words_per_sentence + \
+            11.8 * syllables_per_word - 15.59
 
-    for uid in folders:
-        results_dir = os.path.join(base_results_dir, uid)
+    return uid, {
+        'sent_count': sent_count,
+        'word_count': word_count,
+        'type_token_ratio': type_token_ratio,
+        'avg_sentence_length': avg_sentence_length,
+        'flesch_reading_ease': flesch_reading_ease,
+        'flesch_kincaid_grade': flesch_kincaid_grade,
+        'activity_label_coverage': label_coverage.get_recall(label_hits, 'activity'),
+        'input_hash': input_hash,
+        'eval_schema_version': EVAL_SCHEMA_VERSION
+    }
 
-        # read the generate description
-        description_file = os.path.join(
-            results_dir, 'generated_description.txt')
 
-        if not os.path.exists(description_file):
-            raise Exception('description file does not exist.')
+def get_activity_elements(store, model_id, source_hash):
+    return tuple(element for element in label_coverage.get_model_elements(store, model_id, source_hash) if element[1] == 'activity')
 
-        with open(description_file, 'r') as f:
-            description = f.read()
 
-            sentences = sent_tokenize(description)
-            words = word_tokenize(description)
+def get_input_hash(description, activity_elements):
+    serialized_input = json.dumps(
+        [description, activity_elements, label_coverage.DEFAULT_FUZZY_THRESHOLD], ensure_ascii=False)
 
-            sent_count = len(sentences)
-            word_count = len(words)
+    return hashlib.sha256(serialized_input.encode('utf-8')).hexdigest()
 
-            # save to basic
 
-            save_path = os.path.join(results_dir, 'basic_eval.json')
+def iter_descriptions(store):
+    """
+    Yield the (uid, input hash, item) of every generated description, its
+    item holding the activity elements of its model.
+    """
+    generation_results = dict(store.iter_records('generation_result'))
 
-            with open(save_path, 'w') as f:
-                json.dump({
-                    'sent_count': sent_count,
-                    'word_count': word_count
-                }, f)
+    # Read the testcases up front, evaluations are written while iterating
+    testcases = list(store.iter_testcases())
+
+    for uid, model_id, source_hash, _ in testcases:
+        if uid not in generation_results:
+            continue
+
+        description = generation_results[uid]['generated_description']
+        activity_elements = get_activity_elements(
+            store, model_id, source_hash)
+
+        input_hash = get_input_hash(description, activity_elements)
+
+        yield uid, input_hash, (uid, description, activity_elements, input_hash)
+
+
+def evaluate(base_results_dir, workers=1, nltk_data_dir=None, force=False):
+    """
+    Evaluate every generated description of a dataset, skipping those whose
+    description and model labels did not change since their last evaluation.
+    """
+    load_nltk_resources(nltk_data_dir)
+
+    store = results_store.ResultsStore.open_existing(base_results_dir)
+
+    skipped = {'count': 0}
+    items = results_store.iter_stale_items(store, 'basic_eval', 'eval_schema_version', EVAL_SCHEMA_VERSION,
+                                           iter_descriptions(store), skipped, force)
+
+    evaluated = results_store.compute_records(store, ['basic_eval'], evaluate_description, items, workers,
+                                              load_nltk_resources, (nltk_data_dir,))
+
+    print(
+        f"Evaluated {evaluated} descriptions, skipped {skipped['count']} unchanged ones in {store.path}")
+
+    label_coverage.get_model_elements.cache_clear()
+    store.close()
 
 
 def main():
     print('Basic evaluation phase of the experiment.')
 
-    if len(sys.argv) < 2:
-        raise Exception('directory not specified.')
+    parser = argparse.ArgumentParser(
+        description='Basic evaluation phase of the experiment.')
+
+    parser.add_argument('results_dir', nargs='?',
+                        help='Results directory of a dataset, e.g. results/covid19')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes, 0 uses every core')
+    parser.add_argument('--nltk-data', default=None,
+                        help='Local directory with the NLTK punkt tokenizer')
+    parser.add_argument('--force', action='store_true',
+                        help='Re-evaluate every description, even unchanged ones')
+
+    tracing.add_arguments(parser)
+
+    args = parser.parse_args()
 
     # Get dataset dir from command line
-    dataset_dir = sys.argv[1]
+    dataset_dir = args.results_dir
 
     if dataset_dir is None:
         raise Exception('directory not specified.')
@@ -67,7 +187,14 @@ def main():
     if not os.path.exists(dataset_dir):
         raise Exception('directory does not exist.')
 
-    evaluate(dataset_dir)
+    workers = args.workers or os.cpu_count()
+
+    tracing.start('evaluate', args.trace, args.profile)
+
+    try:
+        evaluate(dataset_dir, workers, args.nltk_data, args.force)
+    finally:
+        tracing.stop()
 
 
 if __name__ == '__main__':
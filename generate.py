@@ -1,160 +1,167 @@
-import sys
 import re
-from uuid import uuid1
 import json
 import os
+import time
+import asyncio
+import argparse
 
 import dotenv
 import os
 import openai
 
+import backends
+import batch
+import cache
+import chunking
+import manifest
+import openai_models
+import packing
+import planner
+import ratelimit
+import results_store
+import retries
+import serializers
+import tokens
+import tracing
+
 dotenv.load_dotenv()
 
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
-# as of 12/01/2024, in USD
-openai_pricing_per_1k_input_tokens = {
-    "gpt-4-1106-preview": 0.01,
-    "gpt-4-vision-preview": 0.01,
-    "gpt-4": 0.03,
-    "gpt-3-32k": 0.06,
-    "gpt-3.5-turbo-1106": 0.001,
-    "gpt-3.5-turbo-instruct": 0.0015
-}
 
+def read_prompts(prompts_dir):
+    prompts = []
 
-# as of 12/01/2024, in USD
-openai_pricing_per_1k_output_tokens = {
-    "gpt-4-1106-preview": 0.03,
-    "gpt-4-vision-preview": 0.03,
-    "gpt-4": 0.06,
-    "gpt-3-32k": 0.12,
-    "gpt-3.5-turbo-1106": 0.0020,
-    "gpt-3.5-turbo-instruct": 0.0020
-}
+    # List all txt files in prompts dir
+    prompt_txt_files = sorted(file for file in os.listdir(
+        prompts_dir) if file.endswith('.txt'))
 
+    for prompt_name in prompt_txt_files:
+        prompt_data = open(os.path.join(
+            prompts_dir, prompt_name), 'r').read()
 
-def read_experiment_parameters(metadata_path):
+        item = (prompt_name, prompt_data)
 
-    if not os.path.exists(metadata_path):
-        raise Exception('Metadata file not found.')
+        prompts.append(item)
 
-    testcases = []
+    return prompts
 
-    with open(metadata_path, 'r') as f:
-        metadata = json.load(f)
 
-        chatgpt_models = metadata['chatgpt_models']
-        temperatures = metadata['temperatures']
-        annotated_dataset_dir = metadata['annotated_dataset_dir']
-        prompts_dir = metadata['prompts_dir']
+def iter_annotated_models(annotated_dataset_dir):
+    """
+    Load the annotated models one at a time, in a stable order.
+    """
+    # List all folders within dataset dir
+    dirs = sorted(os.listdir(annotated_dataset_dir))
 
-        dataset_name = annotated_dataset_dir.split('/')[-1]
+    for dir in dirs:
+        test_path = os.path.join(annotated_dataset_dir, dir)
 
-        # Read annotated models
-        annotated_models = []
+        annotated_model_path = os.path.join(test_path, 'annotated_model.json')
 
-        # List all folders within dataset dir
-        dirs = os.listdir(annotated_dataset_dir)
+        if not os.path.exists(annotated_model_path):
+            continue
 
-        for dir in dirs:
-            test_path = os.path.join(annotated_dataset_dir, dir)
+        with open(annotated_model_path, 'r') as f:
+            yield json.load(f)
 
-            annotated_model_path = os.path.join(
-                test_path, 'annotated_model.json')
 
-            data = json.load(open(annotated_model_path, 'r'))
+def iter_testcases(metadata, filters=None):
+    """
+    Lazily expand the models x prompts x temperatures x chatgpt_models x
+    serializations cross-product described by the experiment parameters.
 
-            annotated_models.append(data)
+    Each annotated model is loaded and serialized once, and the yielded
+    testcases only reference the shared model, prompt and serialized strings,
+    so memory does not grow with the size of the sweep. `filters` may
+    restrict "model_ids", "prompts", "chatgpt_models" and "max_tokens".
+    """
+    filters = filters or {}
 
-        # Read prompts
-        prompts = []
+    chatgpt_models = metadata['chatgpt_models']
+    temperatures = metadata['temperatures']
+    annotated_dataset_dir = metadata['annotated_dataset_dir']
+    prompts_dir = metadata['prompts_dir']
+    serializations = metadata.get('serializations', ['raw'])
 
-        # List all txt files in prompts dir
-        prompt_txt_files = [file for file in os.listdir(
-            prompts_dir) if file.endswith('.txt')]
+    dataset_name = annotated_dataset_dir.split('/')[-1]
 
-        for prompt_name in prompt_txt_files:
-            prompt_data = open(os.path.join(
-                prompts_dir, prompt_name), 'r').read()
+    if filters.get('chatgpt_models'):
+        chatgpt_models = [
+            chatgpt_model for chatgpt_model in chatgpt_models if chatgpt_model in filters['chatgpt_models']]
 
-            item = (prompt_name, prompt_data)
+    prompts = read_prompts(prompts_dir)
 
-            prompts.append(item)
+    if filters.get('prompts'):
+        prompts = [(prompt_name, prompt_data) for (
+            prompt_name, prompt_data) in prompts if prompt_name in filters['prompts']]
 
-        # Prepare testcases
-        for model in annotated_models:
-            model_id = model['model_id']
-            serialized_model = model['serialized_model']
-            activities_count = model['activities_count']
-            gateways_count = model['gateways_count']
-            events_count = model['events_count']
-            type_activities_count = model['type_activities_count']
-            type_gateways_count = model['type_gateways_count']
-            type_events_count = model['type_events_count']
-            cnc = model['cnc']
-            durfee = model['durfee']
-            nodes_count = model['nodes_count']
-            sequence_flows_count = model['sequence_flows_count']
-            pools_count = model['pools_count']
-            lanes_count = model['lanes_count']
-            tokens_count = model['tokens_count']
-            characters_count = model['characters_count']
-            supported_chatgpt_models = model['supported_chatgpt_models']
-            chatgpt_model_pricings_usd = model['chatgpt_model_pricings_usd']
+    max_tokens = filters.get('max_tokens')
 
-            directory = model['dir']
+    for model in iter_annotated_models(annotated_dataset_dir):
+        model_id = model['model_id']
 
-            for (prompt_name, prompt_data) in prompts:
+        if filters.get('model_ids') and model_id not in filters['model_ids']:
+            continue
+
+        serialization_counts = model.get('serializations', {})
+
+        for serialization in serializations:
+            counts = serialization_counts.get(serialization, {
+                "tokens_count": model['tokens_count'],
+                "supported_chatgpt_models": model['supported_chatgpt_models']
+            })
 
+            if max_tokens is not None and counts['tokens_count'] > max_tokens:
+                continue
+
+            # Serialize each form once per model, token counts come from preprocess
+            serialized_model = serializers.serialize(
+                model['serialized_model'], serialization)
+
+            for (prompt_name, prompt_data) in prompts:
                 for temperature in temperatures:
                     for chatgpt_model in chatgpt_models:
-                        testcase = {
+                        yield {
+                            "model": model,
                             "model_id": model_id,
                             "dataset_name": dataset_name,
+                            "dir": model['dir'],
                             "serialized_model": serialized_model,
-                            "activities_count": activities_count,
-                            "events_count": events_count,
-                            "gateways_count": gateways_count,
-                            "type_activities_count": type_activities_count,
-                            "type_events_count": type_events_count,
-                            "type_gateways_count": type_gateways_count,
-                            "cnc": cnc,
-                            "durfee": durfee,
-                            "nodes_count": nodes_count,
-                            "sequence_flows_count": sequence_flows_count,
-                            "pools_count": pools_count,
-                            "lanes_count": lanes_count,
-                            "tokens_count": tokens_count,
-                            "characters_count": characters_count,
+                            "serialization": serialization,
+                            "tokens_count": counts['tokens_count'],
+                            "supported_chatgpt_models": counts['supported_chatgpt_models'],
                             "prompt_name": prompt_name,
                             "prompt_data": prompt_data,
                             "temperature": temperature,
-                            "chatgpt_model": chatgpt_model,
-                            "supported_chatgpt_models": supported_chatgpt_models,
-                            "chatgpt_model_pricings_usd": chatgpt_model_pricings_usd,
-                            "dir": directory
+                            "chatgpt_model": chatgpt_model
                         }
 
-                        testcases.append(testcase)
-    return testcases
 
+def read_experiment_parameters(metadata_path, filters=None):
+
+    if not os.path.exists(metadata_path):
+        raise Exception('Metadata file not found.')
+
+    with open(metadata_path, 'r') as f:
+        metadata = json.load(f)
+
+    return list(iter_testcases(metadata, filters))
+
+
+def build_messages(prompt, serialized_model):
+    return [
+        {
+            "role": "system",
+            "content": prompt
+        }, {
+            "role": "user",
+            "content": serialized_model
+        }
+    ]
 
-def generate(serialized_model, prompt, temperature, seed, chatgpt_model):
-    print(f"Generating with chatgpt_model {chatgpt_model}")
-    completion = openai.ChatCompletion.create(model=chatgpt_model,
-                                              temperature=temperature,
-                                              seed=seed,
-                                              messages=[
-                                                  {
-                                                      "role": "system",
-                                                      "content": prompt
-                                                  }, {
-                                                      "role": "user",
-                                                      "content": serialized_model
-                                                  }
-                                              ])
 
+def parse_completion(completion, chatgpt_model):
     description = completion.choices[0].message.content
     usage = completion.usage
 
@@ -163,25 +170,833 @@ def generate(serialized_model, prompt, temperature, seed, chatgpt_model):
     total_tokens = usage.total_tokens
 
     # Estimate billing
+    billed_estimate = openai_models.estimate_billing(
+        chatgpt_model, prompt_tokens, completion_tokens)
+
+    return description, prompt_tokens, completion_tokens, total_tokens, billed_estimate
 
-    billed_prompt_tokens = prompt_tokens * \
-        openai_pricing_per_1k_input_tokens[chatgpt_model] / 1000
-    billed_completion_tokens = completion_tokens * \
-        openai_pricing_per_1k_output_tokens[chatgpt_model] / 1000
 
-    billed_estimate = billed_prompt_tokens + billed_completion_tokens
+def get_timings(start, first_token_at, end, completion_tokens):
+    """
+    Latency metrics of one call, in seconds. Output throughput is measured
+    from the first token when streaming, and over the whole call otherwise.
+    """
+    latency = end - start
+    time_to_first_token = None
+    generation_time = latency
+
+    if first_token_at is not None:
+        time_to_first_token = first_token_at - start
+        generation_time = end - first_token_at
+
+    output_tokens_per_second = completion_tokens / \
+        generation_time if generation_time > 0 else None
+
+    return {
+        "time_to_first_token": time_to_first_token,
+        "latency": latency,
+        "output_tokens_per_second": output_tokens_per_second
+    }
+
+
+def parse_streamed_completion(content_parts, messages, chatgpt_model):
+    """
+    Streamed responses carry no usage, so token counts are computed locally.
+    """
+    description = ''.join(content_parts)
+
+    with tracing.span('tokenize'):
+        prompt_tokens = tokens.count_chat_tokens(messages, chatgpt_model)
+        completion_tokens = tokens.count_tokens(description, chatgpt_model)
+    total_tokens = prompt_tokens + completion_tokens
+
+    billed_estimate = openai_models.estimate_billing(
+        chatgpt_model, prompt_tokens, completion_tokens)
 
     return description, prompt_tokens, completion_tokens, total_tokens, billed_estimate
 
 
+async def generate(backend, serialized_model, prompt, temperature, seed, chatgpt_model, request_timeout=None, stream=False, response_format=None):
+    print(f"Generating with chatgpt_model {chatgpt_model}")
+
+    messages = build_messages(prompt, serialized_model)
+
+    start = time.perf_counter()
+    first_token_at = None
+
+    with tracing.span('llm_call', chatgpt_model=chatgpt_model, stream=stream):
+        completion = await backend.acomplete(chatgpt_model, messages, temperature, seed, request_timeout, stream, response_format)
+
+        content_parts = []
+
+        if stream:
+            async for chunk in completion:
+                content = chunk.choices[0].delta.get('content') if chunk.choices else None
+
+                if content:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+
+                    content_parts.append(content)
+
+    if stream:
+        generation = parse_streamed_completion(
+            content_parts, messages, chatgpt_model)
+    else:
+        generation = parse_completion(completion, chatgpt_model)
+
+    end = time.perf_counter()
+
+    return (*generation, get_timings(start, first_token_at, end, generation[2]))
+
+
+def lookup_cached_generation(completion_cache, testcase, seed):
+    if completion_cache is None:
+        return None
+
+    with tracing.span('cache_lookup'):
+        completion = completion_cache.get(testcase['chatgpt_model'], testcase['temperature'], seed,
+                                          testcase['prompt_data'], testcase['serialized_model'])
+
+    if completion is None:
+        return None
+
+    billed_estimate = openai_models.estimate_billing(
+        testcase['chatgpt_model'], completion['prompt_tokens'], completion['completion_tokens'])
+
+    return completion['description'], completion['prompt_tokens'], completion['completion_tokens'], completion['total_tokens'], billed_estimate, None
+
+
+def store_cached_generation(completion_cache, testcase, seed, description, prompt_tokens, completion_tokens, total_tokens, billed_estimate, timings=None):
+    if completion_cache is None:
+        return
+
+    completion_cache.put(testcase['chatgpt_model'], testcase['temperature'], seed,
+                         testcase['prompt_data'], testcase['serialized_model'], {
+                             "description": description,
+                             "prompt_tokens": prompt_tokens,
+                             "completion_tokens": completion_tokens,
+                             "total_tokens": total_tokens
+                         })
+
+
+def save_generation_result(store, testcase, seed, description, prompt_tokens, completion_tokens, total_tokens, billed_estimate, timings=None, cached=False, pack_size=1, pack_share=1.0, chunks=None):
+    parameters = {
+        "model_id": testcase['model_id'],
+        "dataset_name": testcase['dataset_name'],
+        "prompt": testcase['prompt_data'],
+        "temperature": testcase['temperature'],
+        "chatgpt_model": testcase['chatgpt_model'],
+        "seed": seed,
+        "prompt_name": testcase['prompt_name'],
+        "serialization": testcase['serialization']
+    }
+
+    result = {}
+
+    result['generated_description'] = description
+    result['real_prompt_tokens'] = prompt_tokens
+    result['real_completion_tokens'] = completion_tokens
+    result['real_total_tokens'] = total_tokens
+    result['billed_estimate'] = billed_estimate
+    result['cached'] = cached
+
+    # Usage of packed testcases is their share of the pack request
+    result['pack_size'] = pack_size
+    result['pack_share'] = pack_share
+
+    # Chunked testcases keep the usage of every chunk and merge request
+    result['chunk_count'] = len(
+        [call for call in chunks if call['level'] == 0]) if chunks else 0
+
+    if chunks:
+        result['chunks'] = chunks
+
+    # Timings are unknown for cached and batched completions
+    timings = timings or {}
+
+    result['time_to_first_token'] = timings.get('time_to_first_token')
+    result['latency'] = timings.get('latency')
+    result['output_tokens_per_second'] = timings.get(
+        'output_tokens_per_second')
+
+    testcase_uid = testcase['testcase_hash']
+
+    parameters['uid'] = testcase_uid
+
+    with tracing.span('store_result'):
+        store.put_generation(
+            testcase_uid, testcase['model'], parameters, result)
+
+    print(f"Stored result {testcase_uid} in {store.path}")
+
+    manifest.record_completed(manifest.get_manifest_path(
+        testcase['dataset_name']), testcase, seed)
+
+
+def get_call_record(kind, label, level, generation):
+    return {
+        "kind": kind,
+        "label": label,
+        "level": level,
+        "prompt_tokens": generation[1],
+        "completion_tokens": generation[2],
+        "billed_estimate": generation[4],
+        "latency": generation[5]['latency']
+    }
+
+
+def get_chunk_parts(testcase, chunk_generations):
+    parts = [(f"{chunk['kind']} \"{chunk['label']}\"", generation[0])
+             for chunk, generation in zip(testcase['chunks'], chunk_generations)]
+
+    calls = [get_call_record(chunk['kind'], chunk['label'], 0, generation)
+             for chunk, generation in zip(testcase['chunks'], chunk_generations)]
+
+    return parts, calls
+
+
+def get_merge_groups(parts, testcase, chunking_policy, expected_completion_tokens):
+    groups = chunking.group_parts(
+        parts, testcase, chunking_policy, expected_completion_tokens)
+
+    if len(groups) == len(parts):
+        raise chunking.ChunkingError(
+            f'Partial descriptions of {testcase["model_id"]} are too long to be merged.')
+
+    return groups
+
+
+def sum_chunked_generation(description, generations, timings):
+    """
+    Generation of a chunked testcase: its merged description, with the
+    usage and billing of every chunk and merge request.
+    """
+    prompt_tokens = sum(generation[1] for generation in generations)
+    completion_tokens = sum(generation[2] for generation in generations)
+    billed_estimate = sum(generation[4] for generation in generations)
+
+    return description, prompt_tokens, completion_tokens, prompt_tokens + completion_tokens, billed_estimate, timings
+
+
+def get_chunked_timings(start, final_start, final_generation, end):
+    first_token_at = None
+
+    if final_generation[5]['time_to_first_token'] is not None:
+        first_token_at = final_start + \
+            final_generation[5]['time_to_first_token']
+
+    return get_timings(start, first_token_at, end, final_generation[2])
+
+
+async def generate_chunked(backend, testcase, seed, rate_limiter, chunking_policy, retry_policy, expected_completion_tokens, stream=False):
+    """
+    Describe a model too large for one request: describe its chunks in
+    parallel, then merge the partial descriptions, level by level while they
+    do not fit one merge request. Every request waits for its own share of
+    the rate limits. Returns the generation and a record of every request.
+    """
+    start = time.perf_counter()
+
+    semaphore = asyncio.Semaphore(chunking_policy.max_parallel)
+
+    async def call(serialized_model, final=False):
+        async with semaphore:
+            await rate_limiter.await_capacity(testcase['chatgpt_model'], chunking.estimate_request_tokens(
+                testcase, serialized_model, expected_completion_tokens))
+
+            return await retries.call_with_retries(generate, retry_policy, backend, serialized_model, testcase['prompt_data'],
+                                                   testcase['temperature'], seed, testcase['chatgpt_model'], stream=stream and final)
+
+    chunks = testcase['chunks']
+
+    generations = list(await asyncio.gather(*[call(chunking.build_chunk_message(
+        chunks, index)) for index in range(len(chunks))]))
+
+    parts, calls = get_chunk_parts(testcase, generations)
+
+    final_start = start
+    final_generation = generations[0]
+    level = 0
+
+    while len(parts) > 1:
+        level += 1
+
+        groups = get_merge_groups(
+            parts, testcase, chunking_policy, expected_completion_tokens)
+        final = len(groups) == 1
+
+        final_start = time.perf_counter()
+
+        merged = list(await asyncio.gather(*[call(chunking.build_merge_message(
+            group, testcase['message_flows']), final) for group in groups]))
+
+        for index, generation in enumerate(merged):
+            calls.append(get_call_record(
+                'merge', f'level {level} group {index + 1}', level, generation))
+
+        generations += merged
+        final_generation = merged[-1]
+        parts = [(f'merged part {index + 1}', generation[0])
+                 for index, generation in enumerate(merged)]
+
+    end = time.perf_counter()
+
+    return sum_chunked_generation(parts[0][1], generations, get_chunked_timings(start, final_start, final_generation, end)), calls
+
+
+def reserve_budget(budget, testcase, expected_completion_tokens, price_factor=1.0):
+    """
+    Reserve the estimated cost of a testcase, returning it, or None when the
+    budget cannot cover it.
+    """
+    if testcase.get('chunks'):
+        estimated_cost = chunking.estimate_chunked_cost(
+            testcase, expected_completion_tokens)
+    else:
+        estimated_cost = (planner.estimate_testcase(
+            testcase, expected_completion_tokens)['cost'] or 0.0) * price_factor
+
+    if not budget.reserve(estimated_cost, testcase.get('testcase_hash')):
+        return None
+
+    return estimated_cost
+
+
+async def run_workers(backend, worker, concurrency):
+    # Open the pooled connections inside the event loop that uses them
+    await backend.astart()
+
+    try:
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+    finally:
+        await backend.aclose()
+
+
+async def generate_testcase(backend, testcase, seed, rate_limiter, expected_completion_tokens, retry_policy, dead_letter_path, completion_cache, store, budget, counts, stream=False, chunking_policy=None):
+    """
+    Generate and store one testcase, counting it in `counts` unless the
+    budget cannot cover it. Cached testcases are stored without a request,
+    failed ones are dead-lettered.
+    """
+    generation = lookup_cached_generation(
+        completion_cache, testcase, seed)
+    cached = generation is not None
+    chunk_calls = None
+
+    if not cached:
+        estimated_cost = reserve_budget(
+            budget, testcase, expected_completion_tokens)
+
+        if estimated_cost is None:
+            return
+
+    counts['processed'] += 1
+
+    print(f"Generating testcase {testcase['model_id']}")
+    print(
+        f"Parameters: chatgpt_model={testcase['chatgpt_model']}, temperature={testcase['temperature']}")
+
+    if not cached:
+        try:
+            if testcase.get('chunks'):
+                generation, chunk_calls = await generate_chunked(
+                    backend, testcase, seed, rate_limiter, chunking_policy, retry_policy, expected_completion_tokens, stream)
+            else:
+                await rate_limiter.await_capacity(testcase['chatgpt_model'], ratelimit.estimate_request_tokens(
+                    testcase, expected_completion_tokens))
+
+                generation = await retries.call_with_retries(generate, retry_policy, backend, testcase['serialized_model'], testcase['prompt_data'],
+                                                             testcase['temperature'], seed, testcase['chatgpt_model'], stream=stream)
+        except (retries.RetriesExhausted, openai.error.OpenAIError, chunking.ChunkingError) as error:
+            print(f"Failed testcase {testcase['model_id']}: {error}")
+            retries.write_dead_letter(
+                dead_letter_path, testcase, seed, error)
+            budget.settle(estimated_cost, 0.0)
+            counts['failed'] += 1
+            return
+
+        budget.settle(estimated_cost, generation[4])
+
+        # Merged descriptions are not cached, they differ from unchunked ones
+        if chunk_calls is None:
+            store_cached_generation(
+                completion_cache, testcase, seed, *generation)
+
+    save_generation_result(store, testcase, seed, *generation, cached=cached, chunks=chunk_calls)
+
+
+async def generate_testcases(backend, testcases, seed, concurrency, rate_limiter, expected_completion_tokens, retry_policy, dead_letter_path, completion_cache, store, budget, stream=False, chunking_policy=None):
+    """
+    Generate the testcases with at most `concurrency` requests in flight,
+    one at a time with a concurrency of 1.
+
+    Each worker pulls the next testcase from a shared iterator, so results
+    are written as soon as their completion returns.
+    """
+    pending = iter(testcases)
+    counts = {'processed': 0, 'failed': 0}
+
+    async def worker():
+        for testcase in pending:
+            await generate_testcase(backend, testcase, seed, rate_limiter, expected_completion_tokens, retry_policy,
+                                    dead_letter_path, completion_cache, store, budget, counts, stream, chunking_policy)
+
+    await run_workers(backend, worker, concurrency)
+
+    return counts['processed'], counts['failed']
+
+
+def iter_uncached_testcases(testcases, seed, completion_cache, store, cached):
+    """
+    Store the cached testcases right away and yield the others, so only
+    those needing a request are packed.
+    """
+    for testcase in testcases:
+        generation = lookup_cached_generation(
+            completion_cache, testcase, seed)
+
+        if generation is None:
+            yield testcase
+            continue
+
+        cached['count'] += 1
+
+        save_generation_result(store, testcase, seed, *generation, cached=True)
+
+
+def get_pack_request(pack):
+    """
+    The user message and response format of a pack request. A pack of one
+    is sent as a plain testcase.
+    """
+    if len(pack) == 1:
+        return pack[0]['serialized_model'], None
+
+    return packing.build_pack_message(pack), packing.get_response_format(pack[0]['chatgpt_model'])
+
+
+def save_pack_generation(pack, generation, seed, dead_letter_path, completion_cache, store):
+    """
+    Split a pack generation back into its testcases and store each one,
+    dead-lettering those missing from the response. Returns the number of
+    failed testcases.
+    """
+    if len(pack) == 1:
+        store_cached_generation(completion_cache, pack[0], seed, *generation)
+        save_generation_result(store, pack[0], seed, *generation)
+        return 0
+
+    failed = 0
+
+    try:
+        generations, shares = packing.split_pack_generation(pack, generation)
+    except packing.PackingError as error:
+        generations, shares = {}, None
+        pack_error = error
+    else:
+        pack_error = packing.PackingError(
+            'Pack response has no description for this model.')
+
+    for index, testcase in enumerate(pack):
+        if testcase['testcase_hash'] not in generations:
+            print(f"Failed testcase {testcase['model_id']}: {pack_error}")
+            retries.write_dead_letter(
+                dead_letter_path, testcase, seed, pack_error)
+            failed += 1
+            continue
+
+        # Packed descriptions are not cached, they differ from unpacked ones
+        save_generation_result(store, testcase, seed, *generations[testcase['testcase_hash']],
+                               pack_size=len(pack), pack_share=shares[index])
+
+    return failed
+
+
+def reserve_pack_budget(budget, pack, expected_completion_tokens):
+    estimated_cost = packing.estimate_pack_cost(
+        pack, expected_completion_tokens)
+
+    if not budget.reserve(estimated_cost):
+        return None
+
+    return estimated_cost
+
+
+async def generate_pack(backend, pack, seed, rate_limiter, expected_completion_tokens, retry_policy, dead_letter_path, completion_cache, store, budget, counts, stream=False):
+    """
+    Generate and store the testcases of one pack request, counting them and
+    the request in `counts` unless the budget cannot cover the pack.
+    """
+    estimated_cost = reserve_pack_budget(
+        budget, pack, expected_completion_tokens)
+
+    if estimated_cost is None:
+        return
+
+    counts['processed'] += len(pack)
+    counts['requests'] += 1
+
+    print(
+        f"Generating pack of {len(pack)} testcases: {', '.join(testcase['model_id'] for testcase in pack)}")
+    print(
+        f"Parameters: chatgpt_model={pack[0]['chatgpt_model']}, temperature={pack[0]['temperature']}")
+
+    await rate_limiter.await_capacity(pack[0]['chatgpt_model'], sum(
+        packing.estimate_pack_tokens(pack, expected_completion_tokens)))
+
+    serialized_models, response_format = get_pack_request(pack)
+
+    try:
+        generation = await retries.call_with_retries(generate, retry_policy, backend, serialized_models, pack[0]['prompt_data'],
+                                                     pack[0]['temperature'], seed, pack[0]['chatgpt_model'], stream=stream, response_format=response_format)
+    except (retries.RetriesExhausted, openai.error.OpenAIError) as error:
+        print(f"Failed pack of {len(pack)} testcases: {error}")
+
+        for testcase in pack:
+            retries.write_dead_letter(
+                dead_letter_path, testcase, seed, error)
+
+        budget.settle(estimated_cost, 0.0)
+        counts['failed'] += len(pack)
+        return
+
+    budget.settle(estimated_cost, generation[4])
+
+    counts['failed'] += save_pack_generation(pack, generation, seed,
+                                             dead_letter_path, completion_cache, store)
+
+
+async def generate_packs(backend, testcases, seed, packing_policy, concurrency, rate_limiter, expected_completion_tokens, retry_policy, dead_letter_path, completion_cache, store, budget, stream=False):
+    """
+    Generate the testcases with several small models per request, see
+    packing.iter_packs, with at most `concurrency` requests in flight.
+    Returns the processed and failed testcases and the number of pack
+    requests sent.
+    """
+    cached = {'count': 0}
+    counts = {'processed': 0, 'failed': 0, 'requests': 0}
+
+    packs = packing.iter_packs(iter_uncached_testcases(
+        testcases, seed, completion_cache, store, cached), packing_policy, expected_completion_tokens)
+
+    async def worker():
+        for pack in packs:
+            await generate_pack(backend, pack, seed, rate_limiter, expected_completion_tokens, retry_policy,
+                                dead_letter_path, completion_cache, store, budget, counts, stream)
+
+    await run_workers(backend, worker, concurrency)
+
+    return counts['processed'] + cached['count'], counts['failed'], counts['requests']
+
+
+def generate_in_batches(testcases, seed, dataset_name, dead_letter_path, completion_cache, store, poll_interval, expected_completion_tokens, budget):
+    """
+    Submit the testcases through the batch API and fan the completions back
+    out into the usual result directories.
+
+    Submitted batches are tracked in results/<dataset>/batch_state.json, so
+    an interrupted run resumes polling instead of submitting again, and only
+    submits the testcases no batch holds.
+    """
+    batch_dir = os.path.join("results", dataset_name)
+    state_path = os.path.join(batch_dir, 'batch_state.json')
+
+    os.makedirs(batch_dir, exist_ok=True)
+
+    processed = 0
+    failed = 0
+    testcases_by_hash = {}
+    reserved_costs = {}
+
+    state = batch.read_batch_state(state_path)
+
+    if state is None:
+        state = {"batches": []}
+    else:
+        print(f"Resuming {len(state['batches'])} submitted batches.")
+
+    submitted = set(custom_id for entry in state['batches']
+                    for custom_id in entry['custom_ids'])
+    unsubmitted = []
+
+    for testcase in testcases:
+        generation = lookup_cached_generation(
+            completion_cache, testcase, seed)
+
+        if generation is not None:
+            processed += 1
+            save_generation_result(store, testcase, seed, *generation, cached=True)
+            continue
+
+        # Batches already submitted were budgeted by the run that submitted them
+        if testcase['testcase_hash'] not in submitted:
+            estimated_cost = reserve_budget(
+                budget, testcase, expected_completion_tokens, batch.BATCH_PRICE_FACTOR)
+
+            if estimated_cost is None:
+                continue
+
+            reserved_costs[testcase['testcase_hash']] = estimated_cost
+            unsubmitted.append(testcase['testcase_hash'])
+
+        processed += 1
+
+        testcases_by_hash[testcase['testcase_hash']] = testcase
+
+    if len(submitted) > 0 and len(unsubmitted) > 0:
+        print(
+            f"Submitting {len(unsubmitted)} testcases missing from the submitted batches.")
+
+    # Testcases missing from a resumed state, e.g. left out by an interrupted
+    # submission, go to new batches next to the submitted ones
+    for start in range(0, len(unsubmitted), batch.BATCH_MAX_REQUESTS):
+        custom_ids = unsubmitted[start:start + batch.BATCH_MAX_REQUESTS]
+
+        batch_requests = []
+
+        for custom_id in custom_ids:
+            testcase = testcases_by_hash[custom_id]
+
+            batch_requests.append(batch.build_batch_request(
+                testcase, seed, build_messages(testcase['prompt_data'], testcase['serialized_model'])))
+
+        input_path = os.path.join(
+            batch_dir, f"batch_input_{len(state['batches'])}.jsonl")
+
+        batch.write_batch_input(input_path, batch_requests)
+
+        input_file_id = batch.upload_batch_input(input_path)
+        created_batch = batch.create_batch(input_file_id)
+
+        print(
+            f"Submitted batch {created_batch['id']} with {len(custom_ids)} requests.")
+
+        state['batches'].append({
+            "id": created_batch['id'],
+            "input_path": input_path,
+            "custom_ids": custom_ids,
+            "processed": False
+        })
+
+        batch.write_batch_state(state_path, state)
+
+    for entry in state['batches']:
+        if entry['processed']:
+            continue
+
+        finished_batch = batch.wait_for_batch(entry['id'], poll_interval)
+
+        print(f"Batch {entry['id']} finished as {finished_batch['status']}.")
+
+        results = batch.read_batch_results(finished_batch)
+
+        for custom_id in entry['custom_ids']:
+            # Completed by an earlier run
+            if custom_id not in testcases_by_hash:
+                continue
+
+            testcase = testcases_by_hash[custom_id]
+            result = results.get(custom_id)
+
+            if result is None:
+                error = batch.BatchRequestError(
+                    f"Batch {entry['id']} ended as {finished_batch['status']} without a result.")
+            elif result.get('response') is None or result['response']['status_code'] != 200:
+                error = batch.BatchRequestError(
+                    json.dumps(result.get('error') or result['response']['body']))
+            else:
+                error = None
+
+            if error is not None:
+                print(f"Failed testcase {testcase['model_id']}: {error}")
+                retries.write_dead_letter(
+                    dead_letter_path, testcase, seed, error)
+                budget.settle(reserved_costs.get(custom_id, 0.0), 0.0)
+                failed += 1
+                continue
+
+            completion = openai.util.convert_to_openai_object(
+                result['response']['body'])
+
+            description, prompt_tokens, completion_tokens, total_tokens, billed_estimate = parse_completion(
+                completion, testcase['chatgpt_model'])
+
+            billed_estimate = billed_estimate * batch.BATCH_PRICE_FACTOR
+
+            budget.settle(reserved_costs.get(custom_id, 0.0), billed_estimate)
+
+            store_cached_generation(completion_cache, testcase, seed, description,
+                                    prompt_tokens, completion_tokens, total_tokens, billed_estimate)
+
+            save_generation_result(store, testcase, seed, description, prompt_tokens,
+                                   completion_tokens, total_tokens, billed_estimate)
+
+        entry['processed'] = True
+
+        batch.write_batch_state(state_path, state)
+
+    if os.path.exists(state_path):
+        os.remove(state_path)
+
+    return processed, failed
+
+
+def iter_pending_testcases(testcases, seed, completed_hashes, skipped):
+    """
+    Attach the deterministic hash to each testcase, dropping those the run
+    manifest already lists as completed.
+    """
+    for testcase in testcases:
+        testcase['testcase_hash'] = manifest.testcase_hash(testcase, seed)
+
+        if testcase['testcase_hash'] in completed_hashes:
+            skipped['count'] += 1
+            continue
+
+        yield testcase
+
+
+def get_filters(metadata, args):
+    filters = dict(metadata.get('filters', {}))
+
+    if args.model_id:
+        filters['model_ids'] = args.model_id
+
+    if args.prompt:
+        filters['prompts'] = args.prompt
+
+    if args.chatgpt_model:
+        filters['chatgpt_models'] = args.chatgpt_model
+
+    if args.max_tokens is not None:
+        filters['max_tokens'] = args.max_tokens
+
+    return filters
+
+
+def get_backend_settings(metadata, args):
+    settings = dict(metadata.get('backend', {}))
+
+    if args.backend is not None:
+        settings['type'] = args.backend
+
+    if args.api_base is not None:
+        settings['api_base'] = args.api_base
+
+    if args.replay_path is not None:
+        settings['path'] = args.replay_path
+
+    if args.replay_latency is not None:
+        settings['latency'] = args.replay_latency
+
+    if args.replay_tokens_per_second is not None:
+        settings['tokens_per_second'] = args.replay_tokens_per_second
+
+    if args.record is not None:
+        settings['record'] = args.record
+
+    return settings
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Generation phase of the experiment.')
+
+    parser.add_argument('parameters_metadata_path', nargs='?',
+                        help='Path to the experiment parameters.json')
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help='Maximum number of in-flight requests (overrides "concurrency" in parameters.json)')
+    parser.add_argument('--api-base', default=None,
+                        help='Base URL of an OpenAI compatible endpoint, e.g. http://localhost:8000/v1')
+    parser.add_argument('--estimate-duration', action='store_true',
+                        help='Print the projected run duration under the configured rate limits and exit')
+    parser.add_argument('--replay-dead-letter', default=None,
+                        help='Only generate the testcases listed in this dead-letter JSONL')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Bypass the completion cache entirely')
+    parser.add_argument('--refresh', action='store_true',
+                        help='Ignore cached completions but store the fresh ones')
+    parser.add_argument('--batch', action='store_true',
+                        help='Submit the testcases through the batch API instead of synchronous calls')
+    parser.add_argument('--batch-poll-interval', type=float, default=batch.DEFAULT_POLL_INTERVAL,
+                        help='Seconds between batch status checks')
+    parser.add_argument('--model-id', action='append',
+                        help='Only generate testcases for this model_id (repeatable)')
+    parser.add_argument('--prompt', action='append',
+                        help='Only generate testcases for this prompt file name (repeatable)')
+    parser.add_argument('--chatgpt-model', action='append',
+                        help='Only generate testcases for this chatgpt_model (repeatable)')
+    parser.add_argument('--max-tokens', type=int, default=None,
+                        help='Skip models whose serialized form exceeds this many tokens')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Print the planned requests, tokens and cost without calling the API')
+    parser.add_argument('--budget', type=float, default=None,
+                        help='Stop issuing requests once this many USD would be spent')
+    parser.add_argument('--export-files', action='store_true',
+                        help='Also write the per-testcase directory layout and descriptions/ from the results store')
+    parser.add_argument('--stream', action='store_true',
+                        help='Use streaming responses to record time-to-first-token')
+    parser.add_argument('--backend', choices=['openai', 'replay'], default=None,
+                        help='Serve completions from the API or from recorded ones (overrides "backend" in parameters.json)')
+    parser.add_argument('--record', default=None,
+                        help='Append every completion to this JSONL file for later replay')
+    parser.add_argument('--replay-path', default=None,
+                        help='JSONL file of recorded completions served by the replay backend')
+    parser.add_argument('--replay-latency', type=float, default=None,
+                        help='Seconds the replay backend waits before the first token')
+    parser.add_argument('--replay-tokens-per-second', type=float, default=None,
+                        help='Output throughput simulated by the replay backend')
+    parser.add_argument('--chunk', action='store_true',
+                        help='Describe models exceeding the context window by pool, lane or subprocess and merge the parts, as configured by "chunking" in parameters.json')
+    parser.add_argument('--pack', action='store_true',
+                        help='Send several small models sharing prompt, temperature and chatgpt_model per request, as configured by "packing" in parameters.json')
+
+    tracing.add_arguments(parser)
+
+    return parser.parse_args()
+
+
+def iter_plan_estimates(testcases, expected_completion_tokens, chunking_policy=None, packing_policy=None):
+    """
+    Estimate the requests a run would send, as planner.plan_estimates takes
+    them: a request per chunk and merge with chunking, a request per pack
+    with packing. Testcases the run would drop are estimated as unsupported.
+    """
+    packable = []
+
+    for testcase in testcases:
+        chatgpt_model = testcase['chatgpt_model']
+
+        if chunking_policy is not None:
+            if not any(chunking.iter_planned_testcases([testcase], chunking_policy, expected_completion_tokens, {'count': 0})):
+                yield chatgpt_model, {"supported": False}
+                continue
+
+            yield chatgpt_model, chunking.estimate_chunked_testcase(testcase, expected_completion_tokens)
+            continue
+
+        estimate = planner.estimate_testcase(
+            testcase, expected_completion_tokens)
+
+        if packing_policy is not None and estimate['supported']:
+            packable.append(testcase)
+            continue
+
+        yield chatgpt_model, estimate
+
+    if packing_policy is not None:
+        for pack in packing.iter_packs(packable, packing_policy, expected_completion_tokens):
+            yield pack[0]['chatgpt_model'], packing.estimate_pack(pack, expected_completion_tokens)
+
+
 def main():
     print('Generation phase of the experiment.')
 
-    if len(sys.argv) < 2:
-        raise Exception('Parameters metadata not specified.')
+    args = parse_arguments()
 
     # Get dataset dir from command line
-    parameters_metadata_path = sys.argv[1]
+    parameters_metadata_path = args.parameters_metadata_path
 
     if parameters_metadata_path is None:
         raise Exception('Parameters metadata not specified.')
@@ -189,102 +1004,178 @@ def main():
     if not os.path.exists(parameters_metadata_path):
         raise Exception('Parameters metadata does not exist.')
 
-    testcases = read_experiment_parameters(parameters_metadata_path)
+    with open(parameters_metadata_path, 'r') as f:
+        metadata = json.load(f)
 
-    print(f"Generated {len(testcases)} testcases.")
+    concurrency = args.concurrency or metadata.get('concurrency', 1)
+    stream = args.stream or metadata.get('stream', False)
 
-    for testcase in testcases:
-        print(f"Generating testcase {testcase['model_id']}")
-        print(
-            f"Parameters: chatgpt_model={testcase['chatgpt_model']}, temperature={testcase['temperature']}")
+    if concurrency < 1:
+        raise Exception('Concurrency must be at least 1.')
 
-        serialized_model = testcase['serialized_model']
-        prompt_name = testcase['prompt_name']
-        prompt = testcase['prompt_data']
-        temperature = testcase['temperature']
-        chatgpt_model = testcase['chatgpt_model']
-        seed = 123
-
-        description, prompt_tokens, completion_tokens, total_tokens, billed_estimate = generate(
-            serialized_model, prompt, temperature, seed, chatgpt_model)
-
-        parameters = {
-            "model_id": testcase['model_id'],
-            "dataset_name": testcase['dataset_name'],
-            "prompt": prompt,
-            "temperature": temperature,
-            "chatgpt_model": chatgpt_model,
-            "seed": seed,
-            "prompt_name": prompt_name
-        }
+    backend_settings = get_backend_settings(metadata, args)
+
+    # The batch API is only reachable through the configured OpenAI endpoint
+    if args.batch and backend_settings.get('type', 'openai') != 'openai':
+        raise Exception('Batch mode requires the openai backend.')
+
+    if args.batch and args.pack:
+        raise Exception('Packing is not supported in batch mode.')
+
+    if args.chunk and (args.batch or args.pack):
+        raise Exception('Chunked generation is not supported in batch or packing mode.')
+
+    if backend_settings.get('api_base') is not None:
+        openai.api_base = backend_settings['api_base']
+
+    seed = metadata.get('seed', 123)
+
+    dataset_name = metadata['annotated_dataset_dir'].split('/')[-1]
+
+    dead_letter_path = os.path.join(
+        "results", dataset_name, 'dead_letter.jsonl')
+
+    testcases = iter_testcases(metadata, get_filters(metadata, args))
+
+    if args.replay_dead_letter is not None:
+        if not os.path.exists(args.replay_dead_letter):
+            raise Exception('Dead-letter file does not exist.')
+
+        dead_hashes = set(entry['testcase_hash']
+                          for entry in retries.read_dead_letters(args.replay_dead_letter))
+
+        testcases = (testcase for testcase in testcases if manifest.testcase_hash(
+            testcase, seed) in dead_hashes)
 
-        result = {}
+    completed_hashes = manifest.read_completed_hashes(
+        manifest.get_manifest_path(dataset_name))
 
-        result['generated_description'] = description
-        result['real_prompt_tokens'] = prompt_tokens
-        result['real_completion_tokens'] = completion_tokens
-        result['real_total_tokens'] = total_tokens
-        result['billed_estimate'] = billed_estimate
+    skipped = {'count': 0}
 
-        testcase_uid = str(uuid1()).split('-')[0]
+    testcases = iter_pending_testcases(
+        testcases, seed, completed_hashes, skipped)
 
-        parameters['uid'] = testcase_uid
+    rate_limits = metadata.get('rate_limits', {})
+    expected_completion_tokens = metadata.get(
+        'expected_completion_tokens', ratelimit.DEFAULT_EXPECTED_COMPLETION_TOKENS)
 
-        save_dir = os.path.join(
-            "results", testcase["dataset_name"], testcase_uid)
+    budget_usd = args.budget if args.budget is not None else metadata.get(
+        'budget_usd')
 
-        # Check folder exists
-        if not os.path.exists(save_dir):
-            os.makedirs(save_dir)
+    chunking_policy = chunking.ChunkingPolicy.from_metadata(metadata)
 
-        # Save results
-        save_path = os.path.join(save_dir, 'generation_result.json')
-        with open(save_path, 'w') as fp:
-            # With pretty printing
-            serialized_json = json.dumps(result, indent=4)
+    if args.dry_run:
+        price_factor = batch.BATCH_PRICE_FACTOR if args.batch else 1.0
 
-            fp.write(serialized_json)
+        estimates = iter_plan_estimates(testcases, expected_completion_tokens, chunking_policy if args.chunk else None,
+                                        packing.PackingPolicy.from_metadata(metadata) if args.pack else None)
 
-        print(f"Generated result in {save_path}")
+        planner.print_plan(planner.plan_estimates(
+            estimates, price_factor), budget_usd)
 
-        # Save description as txt
-        save_path = os.path.join(save_dir, 'generated_description.txt')
+        if skipped['count'] > 0:
+            print(f"Skipped {skipped['count']} testcases already completed.")
+        return
 
-        with open(save_path, 'w') as fp:
-            fp.write(description)
+    unsupported = {'count': 0}
 
-        # Also save the txt description in a folder within the dataset folder, name is the uid
-        alternative_save_path = os.path.join(
-            "results", testcase['dataset_name'], 'descriptions', f"desc_{testcase_uid}.txt")
+    if args.chunk:
+        testcases = chunking.iter_planned_testcases(
+            testcases, chunking_policy, expected_completion_tokens, unsupported)
+    else:
+        testcases = planner.iter_supported_testcases(
+            testcases, expected_completion_tokens, unsupported)
 
-        # Check folder exists
-        if not os.path.exists(os.path.dirname(alternative_save_path)):
-            os.makedirs(os.path.dirname(alternative_save_path))
+    if args.estimate_duration:
+        ratelimit.print_projected_duration(
+            testcases, rate_limits, expected_completion_tokens)
+        return
 
-        with open(alternative_save_path, 'w') as fp:
-            fp.write(description)
+    rate_limiter = ratelimit.RateLimiter(rate_limits)
+    budget = planner.Budget(budget_usd)
+    retry_policy = retries.RetryPolicy.from_metadata(metadata)
 
-        # Copy annotated model to results folder
-        annotated_model_path = os.path.join(
-            testcase['dir'], 'annotated_model.json')
+    if args.replay_dead_letter is not None:
+        # Keep the replayed entries aside, testcases failing again are written anew
+        os.replace(args.replay_dead_letter,
+                   args.replay_dead_letter + '.replayed')
 
-        save_path = os.path.join(save_dir, 'annotated_model.json')
+    os.makedirs(os.path.dirname(dead_letter_path), exist_ok=True)
 
-        with open(annotated_model_path, 'r') as fp:
-            annotated_model = json.load(fp)
+    completion_cache = None
 
-            with open(save_path, 'w') as fp:
-                serialized_json = json.dumps(annotated_model, indent=4)
+    if not args.no_cache:
+        completion_cache = cache.CompletionCache.from_metadata(
+            metadata, refresh=args.refresh)
 
-                fp.write(serialized_json)
+    results_dir = os.path.join("results", dataset_name)
 
-        # Save parameters in the testcase folder
-        save_path = os.path.join(save_dir, 'parameters.json')
+    store = results_store.ResultsStore.open(results_dir)
+    backend = backends.create_backend(backend_settings)
 
-        with open(save_path, 'w') as fp:
-            serialized_json = json.dumps(parameters, indent=4)
+    tracing.start('generate', args.trace, args.profile)
 
-            fp.write(serialized_json)
+    try:
+        start = time.perf_counter()
+
+        # Only set in pack mode, where a request serves several testcases
+        pack_requests = None
+
+        if args.batch:
+            processed, failed = generate_in_batches(testcases, seed, dataset_name, dead_letter_path,
+                                                    completion_cache, store, args.batch_poll_interval, expected_completion_tokens, budget)
+        else:
+            if concurrency > 1:
+                print(
+                    f"Generating with up to {concurrency} requests in flight.")
+
+            if args.pack:
+                processed, failed, pack_requests = asyncio.run(generate_packs(backend, testcases, seed, packing.PackingPolicy.from_metadata(metadata), concurrency,
+                                                                              rate_limiter, expected_completion_tokens, retry_policy, dead_letter_path, completion_cache, store, budget, stream))
+            else:
+                processed, failed = asyncio.run(generate_testcases(backend, testcases, seed, concurrency,
+                                                                   rate_limiter, expected_completion_tokens, retry_policy, dead_letter_path, completion_cache, store, budget, stream, chunking_policy))
+
+        elapsed = time.perf_counter() - start
+
+        backend.close()
+
+        if skipped['count'] > 0:
+            print(f"Skipped {skipped['count']} testcases already completed.")
+
+        if unsupported['count'] > 0:
+            print(
+                f"Skipped {unsupported['count']} testcases exceeding the context window of their chatgpt_model.")
+
+        if pack_requests is not None:
+            print(
+                f"Completed {processed} testcases with {pack_requests} pack requests in {elapsed:.2f}s ({pack_requests / elapsed:.2f} requests/sec).")
+        else:
+            print(
+                f"Completed {processed} requests in {elapsed:.2f}s ({processed / elapsed:.2f} requests/sec).")
+
+        if failed > 0:
+            print(
+                f"{failed} testcases failed and were written to {dead_letter_path}. Replay them with --replay-dead-letter {dead_letter_path}")
+
+        if completion_cache is not None:
+            completion_cache.print_statistics()
+            completion_cache.close()
+
+        if args.export_files:
+            with tracing.span('export_files'):
+                exported = results_store.export_directories(store, results_dir)
+                results_store.export_descriptions(store, results_dir)
+
+            print(f"Exported {exported} testcases to {results_dir}")
+
+        store.close()
+    finally:
+        tracing.stop()
+
+    if budget.over_budget > 0:
+        print(
+            f"Skipped {budget.over_budget} testcases over the ${budget.limit:.2f} budget after spending ${budget.spent:.2f}, rerun with a larger budget to generate them.")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,269 @@
+import re
+import os
+import json
+import argparse
+import hashlib
+import functools
+
+import bpmn_model
+import results_store
+
+# Bump whenever the coverage fields or how they are computed change, so
+# incremental runs re-score every description
+COVERAGE_SCHEMA_VERSION = 1
+
+# Share of the words of a label a description must mention for a fuzzy hit
+DEFAULT_FUZZY_THRESHOLD = 0.6
+
+ELEMENT_CATEGORIES = {
+    **{type: 'activity' for type in bpmn_model.ACTIVITY_TYPES},
+    **{type: 'event' for type in bpmn_model.EVENT_TYPES},
+    **{type: 'gateway' for type in bpmn_model.GATEWAY_TYPES}
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = set([
+    'a', 'an', 'the', 'of', 'to', 'for', 'and', 'or', 'in', 'on', 'at', 'by',
+    'with', 'from', 'is', 'are', 'be', 'it', 'its', 'this', 'that'
+])
+
+SUFFIXES = [('sses', 'ss'), ('ies', 'y'), ('ied', 'y'),
+            ('ing', ''), ('ed', ''), ('es', ''), ('s', ''), ('e', '')]
+
+
+def stem(token):
+    """
+    Light suffix stripping, so "approve", "approves" and "approved" match.
+    """
+    for suffix, replacement in SUFFIXES:
+        if suffix == 's' and token.endswith('ss'):
+            continue
+
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)] + replacement
+
+    return token
+
+
+def normalize(text):
+    """
+    Lowercased, stemmed content words of a label or description.
+    """
+    return [stem(token) for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def get_labelled_elements(root):
+    """
+    (id, category, label) of every labelled activity, event and gateway.
+    """
+    elements = []
+
+    for local_name, element in bpmn_model.iter_bpmn_elements(root):
+        category = ELEMENT_CATEGORIES.get(local_name)
+
+        if category is None:
+            continue
+
+        name = element.attrib.get('name')
+
+        if name is not None and name.strip():
+            elements.append(
+                (element.attrib.get('id'), category, ' '.join(name.split())))
+
+    return elements
+
+
+class LabelIndex:
+    """
+    Inverted index from normalized words to the labels containing them.
+
+    A description is scanned once: its words look up the labels they occur
+    in, and its n-grams, for the label lengths present in the index, detect
+    labels mentioned verbatim.
+    """
+
+    def __init__(self, elements, fuzzy_threshold=DEFAULT_FUZZY_THRESHOLD):
+        self.elements = elements
+        self.fuzzy_threshold = fuzzy_threshold
+
+        self.phrases = []
+        self.postings = {}
+
+        for index, (_, _, label) in enumerate(elements):
+            phrase = tuple(normalize(label))
+
+            self.phrases.append(phrase)
+
+            for token in set(phrase):
+                self.postings.setdefault(token, []).append(index)
+
+        self.phrase_lengths = set(len(phrase)
+                                  for phrase in self.phrases if phrase)
+
+    def match(self, description):
+        tokens = normalize(description)
+
+        ngrams = set()
+
+        for n in self.phrase_lengths:
+            for start in range(len(tokens) - n + 1):
+                ngrams.add(tuple(tokens[start:start + n]))
+
+        matched_tokens = [0] * len(self.elements)
+
+        for token in set(tokens):
+            for index in self.postings.get(token, []):
+                matched_tokens[index] += 1
+
+        hits = []
+
+        for index, (id, category, label) in enumerate(self.elements):
+            phrase = self.phrases[index]
+            unique_tokens = len(set(phrase))
+
+            score = matched_tokens[index] / \
+                unique_tokens if unique_tokens > 0 else 0.0
+
+            if phrase and phrase in ngrams:
+                match = 'exact'
+            elif score >= self.fuzzy_threshold:
+                match = 'fuzzy'
+            else:
+                match = None
+
+            hits.append({
+                "id": id,
+                "type": category,
+                "label": label,
+                "match": match,
+                "score": score
+            })
+
+        return hits
+
+
+@functools.lru_cache(maxsize=256)
+def get_index(elements, fuzzy_threshold):
+    # Built once per model in each worker
+    return LabelIndex(elements, fuzzy_threshold)
+
+
+def get_recall(hits, category=None):
+    selected = [hit for hit in hits if category is None or hit['type'] == category]
+
+    if len(selected) == 0:
+        return None
+
+    return len([hit for hit in selected if hit['match'] is not None]) / len(selected)
+
+
+def score_description(item):
+    uid, description, elements, fuzzy_threshold, input_hash = item
+
+    hits = get_index(elements, fuzzy_threshold).match(description)
+
+    return uid, {
+        "label_recall": get_recall(hits),
+        "activity_recall": get_recall(hits, 'activity'),
+        "event_recall": get_recall(hits, 'event'),
+        "gateway_recall": get_recall(hits, 'gateway'),
+        "labels_count": len(hits),
+        "exact_hits": len([hit for hit in hits if hit['match'] == 'exact']),
+        "fuzzy_hits": len([hit for hit in hits if hit['match'] == 'fuzzy']),
+        "hits": hits,
+        "input_hash": input_hash,
+        "coverage_schema_version": COVERAGE_SCHEMA_VERSION
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def get_model_elements(store, model_id, source_hash):
+    serialized_model = store.get_model(model_id, source_hash)[
+        'serialized_model']
+
+    return tuple(get_labelled_elements(bpmn_model.parse(serialized_model.encode('utf-8'))))
+
+
+def get_input_hash(description, elements, fuzzy_threshold):
+    serialized_input = json.dumps(
+        [description, elements, fuzzy_threshold], ensure_ascii=False)
+
+    return hashlib.sha256(serialized_input.encode('utf-8')).hexdigest()
+
+
+def iter_descriptions(store, fuzzy_threshold):
+    """
+    Yield the (uid, input hash, item) of every generated description, its
+    item holding the labelled elements of its model.
+    """
+    generation_results = dict(store.iter_records('generation_result'))
+
+    # Read the testcases up front, scores are written while iterating
+    testcases = list(store.iter_testcases())
+
+    for uid, model_id, source_hash, _ in testcases:
+        if uid not in generation_results:
+            continue
+
+        description = generation_results[uid]['generated_description']
+        elements = get_model_elements(store, model_id, source_hash)
+
+        input_hash = get_input_hash(description, elements, fuzzy_threshold)
+
+        yield uid, input_hash, (uid, description, elements, fuzzy_threshold, input_hash)
+
+
+def score_coverage(base_results_dir, workers=1, fuzzy_threshold=DEFAULT_FUZZY_THRESHOLD, force=False):
+    """
+    Score how many activity, event and gateway labels of its model each
+    generated description mentions, skipping unchanged descriptions.
+    """
+    store = results_store.ResultsStore.open_existing(base_results_dir)
+
+    skipped = {'count': 0}
+    items = results_store.iter_stale_items(store, 'coverage', 'coverage_schema_version', COVERAGE_SCHEMA_VERSION,
+                                           iter_descriptions(store, fuzzy_threshold), skipped, force)
+
+    scored = results_store.compute_records(
+        store, ['coverage'], score_description, items, workers)
+
+    print(
+        f"Scored label coverage of {scored} descriptions, skipped {skipped['count']} unchanged ones in {store.path}")
+
+    get_model_elements.cache_clear()
+    store.close()
+
+
+def main():
+    print('Label coverage phase of the experiment.')
+
+    parser = argparse.ArgumentParser(
+        description='Score the recall of model labels in the generated descriptions.')
+
+    parser.add_argument('results_dir', nargs='?',
+                        help='Results directory of a dataset, e.g. results/covid19')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes, 0 uses every core')
+    parser.add_argument('--fuzzy-threshold', type=float, default=DEFAULT_FUZZY_THRESHOLD,
+                        help='Share of the words of a label a description must mention to count as a fuzzy hit')
+    parser.add_argument('--force', action='store_true',
+                        help='Re-score every description, even unchanged ones')
+
+    args = parser.parse_args()
+
+    dataset_dir = args.results_dir
+
+    if dataset_dir is None:
+        raise Exception('directory not specified.')
+
+    if not os.path.exists(dataset_dir):
+        raise Exception('directory does not exist.')
+
+    workers = args.workers or os.cpu_count()
+
+    score_coverage(dataset_dir, workers, args.fuzzy_threshold, args.force)
+
+
+if __name__ == '__main__':
+    main()
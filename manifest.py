@@ -0,0 +1,67 @@
+import os
+import json
+import hashlib
+from datetime import datetime, timezone
+
+import results_store
+
+
+def get_manifest_path(dataset_name):
+    return os.path.join("results", dataset_name, 'manifest.jsonl')
+
+
+def testcase_hash(testcase, seed):
+    """
+    Deterministic identifier of a logical testcase. It doubles as the uid of
+    the result directory, so reruns map to the same folder. The source hash
+    of the annotated model tells apart models sharing a model_id, such as
+    the Definitions_1 of every Camunda export.
+    """
+    model_id, source_hash = results_store.get_model_key(testcase['model'])
+
+    key = [
+        model_id,
+        source_hash,
+        testcase['prompt_name'],
+        testcase['prompt_data'],
+        float(testcase['temperature']),
+        testcase['chatgpt_model'],
+        seed
+    ]
+
+    # Raw XML testcases keep the hashes they had before serializations existed
+    if testcase['serialization'] != 'raw':
+        key.append(testcase['serialization'])
+
+    serialized_key = json.dumps(key, ensure_ascii=False)
+
+    return hashlib.sha256(serialized_key.encode('utf-8')).hexdigest()[:16]
+
+
+def read_completed_hashes(manifest_path):
+    if not os.path.exists(manifest_path):
+        return set()
+
+    with open(manifest_path, 'r') as fp:
+        return set(json.loads(line)['hash'] for line in fp if line.strip())
+
+
+def record_completed(manifest_path, testcase, seed):
+    """
+    Append a testcase to the run manifest. Must only be called once all of
+    its result files have been written.
+    """
+    entry = {
+        "hash": testcase['testcase_hash'],
+        "model_id": testcase['model_id'],
+        "source_hash": testcase['model'].get('source_hash'),
+        "prompt_name": testcase['prompt_name'],
+        "temperature": testcase['temperature'],
+        "chatgpt_model": testcase['chatgpt_model'],
+        "serialization": testcase['serialization'],
+        "seed": seed,
+        "completed_at": datetime.now(timezone.utc).isoformat()
+    }
+
+    with open(manifest_path, 'a') as fp:
+        fp.write(json.dumps(entry) + '\n')
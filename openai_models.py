@@ -0,0 +1,66 @@
+# Context windows and prices of the chatgpt_models the experiments can use,
+# shared by every stage so estimates and billing agree.
+
+# as of 12/01/2024
+openai_token_limits = {
+    "gpt-4-1106-preview": 128000,
+    "gpt-4-vision-preview": 128000,
+    "gpt-4": 8192,
+    "gpt-3-32k": 32768,
+    "gpt-3.5-turbo-1106": 16385,
+    "gpt-3.5-turbo-instruct": 4096
+}
+
+# as of 12/01/2024, in USD
+openai_pricing_per_1k_input_tokens = {
+    "gpt-4-1106-preview": 0.01,
+    "gpt-4-vision-preview": 0.01,
+    "gpt-4": 0.03,
+    "gpt-3-32k": 0.06,
+    "gpt-3.5-turbo-1106": 0.001,
+    "gpt-3.5-turbo-instruct": 0.0015
+}
+
+# as of 12/01/2024, in USD
+openai_pricing_per_1k_output_tokens = {
+    "gpt-4-1106-preview": 0.03,
+    "gpt-4-vision-preview": 0.03,
+    "gpt-4": 0.06,
+    "gpt-3-32k": 0.12,
+    "gpt-3.5-turbo-1106": 0.0020,
+    "gpt-3.5-turbo-instruct": 0.0020
+}
+
+
+# as of 12/01/2024, chatgpt_models accepting response_format={"type": "json_object"}
+openai_json_mode_models = [
+    "gpt-4-1106-preview",
+    "gpt-3.5-turbo-1106"
+]
+
+
+def is_priced(chatgpt_model):
+    return chatgpt_model in openai_pricing_per_1k_input_tokens and chatgpt_model in openai_pricing_per_1k_output_tokens
+
+
+def supports_json_mode(chatgpt_model):
+    return chatgpt_model in openai_json_mode_models
+
+
+def estimate_billing(chatgpt_model, prompt_tokens, completion_tokens):
+    billed_prompt_tokens = prompt_tokens * \
+        openai_pricing_per_1k_input_tokens[chatgpt_model] / 1000
+    billed_completion_tokens = completion_tokens * \
+        openai_pricing_per_1k_output_tokens[chatgpt_model] / 1000
+
+    return billed_prompt_tokens + billed_completion_tokens
+
+
+def get_supported_chatgpt_models(tokens_count):
+    supported_chatgpt_models = []
+
+    for model in openai_token_limits:
+        if openai_token_limits[model] >= tokens_count:
+            supported_chatgpt_models.append(model)
+
+    return supported_chatgpt_models
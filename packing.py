@@ -0,0 +1,228 @@
+import json
+
+import openai_models
+import planner
+import tokens
+
+# Models per request, output limits cap a pack well before the context does
+DEFAULT_MAX_MODELS = 4
+
+# Fraction of the context window of the chatgpt_model a pack may fill,
+# expected completions included
+DEFAULT_MAX_CONTEXT_FRACTION = 0.5
+
+# Tokens of the begin and end lines around each model
+DELIMITER_TOKENS = 16
+
+PACK_INSTRUCTIONS = 'This message contains {count} BPMN models, each one between a "### BEGIN <key>" and a "### END <key>" line. Follow the instructions for each model on its own, without referring to the other models, and reply with a JSON object mapping every key to the description of its model.'
+
+RESPONSE_FORMAT = {"type": "json_object"}
+
+
+class PackingError(Exception):
+    pass
+
+
+class PackingPolicy:
+    """
+    How testcases are packed, as configured by the "packing" entry of
+    parameters.json.
+    """
+
+    def __init__(self, max_models=DEFAULT_MAX_MODELS, max_context_fraction=DEFAULT_MAX_CONTEXT_FRACTION):
+        self.max_models = max_models
+        self.max_context_fraction = max_context_fraction
+
+    @classmethod
+    def from_metadata(cls, metadata):
+        return cls(**metadata.get('packing', {}))
+
+    def get_capacity(self, chatgpt_model):
+        return int(openai_models.openai_token_limits.get(chatgpt_model, 0) * self.max_context_fraction)
+
+
+def get_pack_key(testcase):
+    # Only testcases sent with the same system prompt and sampling can share a request
+    return testcase['prompt_data'], testcase['temperature'], testcase['chatgpt_model']
+
+
+def get_model_key(index):
+    return f'model_{index + 1}'
+
+
+def estimate_pack_tokens(pack, expected_completion_tokens):
+    """
+    Estimated input and output tokens of a pack request.
+    """
+    chatgpt_model = pack[0]['chatgpt_model']
+
+    input_tokens = planner.count_prompt_tokens(pack[0]['prompt_data'], chatgpt_model) + \
+        tokens.count_tokens(PACK_INSTRUCTIONS, chatgpt_model) + \
+        sum(testcase['tokens_count'] + DELIMITER_TOKENS for testcase in pack)
+    output_tokens = expected_completion_tokens * len(pack)
+
+    return input_tokens, output_tokens
+
+
+def estimate_pack_cost(pack, expected_completion_tokens):
+    chatgpt_model = pack[0]['chatgpt_model']
+
+    if not openai_models.is_priced(chatgpt_model):
+        return 0.0
+
+    return openai_models.estimate_billing(chatgpt_model, *estimate_pack_tokens(pack, expected_completion_tokens))
+
+
+def estimate_pack(pack, expected_completion_tokens):
+    """
+    Estimate of a pack request shaped like planner.estimate_testcase. A pack
+    of one is sent as a plain testcase.
+    """
+    if len(pack) == 1:
+        return planner.estimate_testcase(pack[0], expected_completion_tokens)
+
+    input_tokens, output_tokens = estimate_pack_tokens(
+        pack, expected_completion_tokens)
+
+    cost = None
+
+    if openai_models.is_priced(pack[0]['chatgpt_model']):
+        cost = estimate_pack_cost(pack, expected_completion_tokens)
+
+    return {
+        "requests": 1,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "supported": True,
+        "cost": cost
+    }
+
+
+def iter_packs(testcases, policy, expected_completion_tokens):
+    """
+    Group the testcases sharing prompt, temperature and chatgpt_model into
+    packs of at most `max_models`, closing a pack before it would fill more
+    than `max_context_fraction` of the context window. Testcases too large
+    to share a request come out as packs of one.
+    """
+    open_packs = {}
+
+    for testcase in testcases:
+        key = get_pack_key(testcase)
+        pack = open_packs.get(key, [])
+
+        if len(pack) > 0:
+            input_tokens, output_tokens = estimate_pack_tokens(
+                pack + [testcase], expected_completion_tokens)
+
+            if len(pack) >= policy.max_models or input_tokens + output_tokens > policy.get_capacity(testcase['chatgpt_model']):
+                yield pack
+
+                pack = []
+
+        pack.append(testcase)
+        open_packs[key] = pack
+
+    for pack in open_packs.values():
+        yield pack
+
+
+def build_pack_message(pack):
+    """
+    The user message of a pack: the instructions, then every serialized
+    model between delimiter lines.
+    """
+    parts = [PACK_INSTRUCTIONS.format(count=len(pack))]
+
+    for index, testcase in enumerate(pack):
+        key = get_model_key(index)
+
+        parts.append(
+            f"### BEGIN {key}\n{testcase['serialized_model']}\n### END {key}")
+
+    return '\n\n'.join(parts)
+
+
+def get_response_format(chatgpt_model):
+    """
+    JSON mode for the chatgpt_models supporting it. The others reject the
+    parameter and only have PACK_INSTRUCTIONS asking for a JSON object.
+    """
+    if openai_models.supports_json_mode(chatgpt_model):
+        return RESPONSE_FORMAT
+
+    return None
+
+
+def parse_pack_response(description):
+    """
+    The JSON object of a pack response. Without JSON mode models may wrap it
+    in a code fence or a sentence, the outermost braces are tried then.
+    """
+    try:
+        return json.loads(description)
+    except json.JSONDecodeError as error:
+        start = description.find('{')
+        end = description.rfind('}')
+
+        if start == -1 or end < start:
+            raise PackingError(f'Pack response is not valid JSON: {error}')
+
+    try:
+        return json.loads(description[start:end + 1])
+    except json.JSONDecodeError as error:
+        raise PackingError(f'Pack response is not valid JSON: {error}')
+
+
+def apportion_tokens(pack, total_tokens):
+    """
+    Split the tokens of a pack request across its testcases by the size of
+    their serialized model, the last one taking the rounding remainder.
+    """
+    pack_size = sum(testcase['tokens_count'] for testcase in pack)
+
+    shares = [testcase['tokens_count'] / pack_size if pack_size > 0 else 1 / len(pack)
+              for testcase in pack]
+
+    apportioned = [int(total_tokens * share) for share in shares[:-1]]
+    apportioned.append(total_tokens - sum(apportioned))
+
+    return shares, apportioned
+
+
+def split_pack_generation(pack, generation):
+    """
+    Split the generation of a pack request into one generation per testcase
+    hash, with the usage and billing apportioned by input size. Testcases
+    missing from the response are left out.
+    """
+    description, prompt_tokens, completion_tokens, _, _, timings = generation
+
+    descriptions = parse_pack_response(description)
+
+    if not isinstance(descriptions, dict):
+        raise PackingError('Pack response is not a JSON object.')
+
+    chatgpt_model = pack[0]['chatgpt_model']
+
+    shares, testcase_prompt_tokens = apportion_tokens(pack, prompt_tokens)
+    _, testcase_completion_tokens = apportion_tokens(pack, completion_tokens)
+
+    generations = {}
+
+    for index, testcase in enumerate(pack):
+        testcase_description = descriptions.get(get_model_key(index))
+
+        if not isinstance(testcase_description, str) or len(testcase_description.strip()) == 0:
+            continue
+
+        testcase_prompt = testcase_prompt_tokens[index]
+        testcase_completion = testcase_completion_tokens[index]
+
+        billed_estimate = openai_models.estimate_billing(
+            chatgpt_model, testcase_prompt, testcase_completion)
+
+        generations[testcase['testcase_hash']] = (testcase_description.strip(), testcase_prompt, testcase_completion,
+                                                  testcase_prompt + testcase_completion, billed_estimate, timings)
+
+    return generations, shares
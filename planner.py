@@ -0,0 +1,173 @@
+import functools
+
+import openai_models
+import tokens
+
+
+@functools.lru_cache(maxsize=None)
+def count_prompt_tokens(prompt_data, chatgpt_model):
+    """
+    Tokens of a request besides the serialized model: the system prompt and
+    the chat format overhead. Memoized, as a sweep reuses a handful of prompts.
+    """
+    return tokens.count_chat_tokens([
+        {"role": "system", "content": prompt_data},
+        {"role": "user", "content": ""}
+    ], chatgpt_model)
+
+
+def estimate_testcase(testcase, expected_completion_tokens):
+    """
+    Estimate the input and output tokens of a testcase and whether its
+    chatgpt_model can take them. Cost is None for unpriced models.
+    """
+    chatgpt_model = testcase['chatgpt_model']
+
+    input_tokens = testcase['tokens_count'] + \
+        count_prompt_tokens(testcase['prompt_data'], chatgpt_model)
+    output_tokens = expected_completion_tokens
+
+    token_limit = openai_models.openai_token_limits.get(chatgpt_model)
+
+    supported = token_limit is not None and input_tokens + output_tokens <= token_limit
+
+    cost = None
+
+    if openai_models.is_priced(chatgpt_model):
+        cost = openai_models.estimate_billing(
+            chatgpt_model, input_tokens, output_tokens)
+
+    return {
+        "requests": 1,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "supported": supported,
+        "cost": cost
+    }
+
+
+def iter_supported_testcases(testcases, expected_completion_tokens, unsupported):
+    """
+    Drop testcases whose prompt and expected completion do not fit the
+    context window of their chatgpt_model, counting them in `unsupported`.
+    """
+    for testcase in testcases:
+        if not estimate_testcase(testcase, expected_completion_tokens)['supported']:
+            unsupported['count'] += 1
+            continue
+
+        yield testcase
+
+
+def plan(testcases, expected_completion_tokens, price_factor=1.0):
+    """
+    Expand the testcases into a per chatgpt_model estimate of requests,
+    tokens and cost. Unsupported testcases are counted but not priced.
+    """
+    return plan_estimates(((testcase['chatgpt_model'], estimate_testcase(testcase, expected_completion_tokens)) for testcase in testcases), price_factor)
+
+
+def plan_estimates(estimates, price_factor=1.0):
+    """
+    Sum (chatgpt_model, estimate) pairs shaped like those of
+    estimate_testcase into a per chatgpt_model plan. An estimate may cover
+    several requests, as for chunked testcases, or several testcases, as
+    for packs.
+    """
+    projections = {}
+
+    for chatgpt_model, estimate in estimates:
+        projection = projections.setdefault(chatgpt_model, {
+            "requests": 0,
+            "unsupported": 0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cost": 0.0 if openai_models.is_priced(chatgpt_model) else None
+        })
+
+        if not estimate['supported']:
+            projection['unsupported'] += 1
+            continue
+
+        projection['requests'] += estimate['requests']
+        projection['input_tokens'] += estimate['input_tokens']
+        projection['output_tokens'] += estimate['output_tokens']
+
+        if estimate['cost'] is not None:
+            projection['cost'] += estimate['cost'] * price_factor
+
+    return projections
+
+
+def print_plan(projections, budget_usd=None):
+    print('Planned run:')
+
+    total_requests = 0
+    total_unsupported = 0
+    total_cost = 0.0
+
+    for chatgpt_model, projection in projections.items():
+        if projection['cost'] is None:
+            cost = 'no pricing known'
+        else:
+            cost = f"${projection['cost']:.2f}"
+            total_cost += projection['cost']
+
+        print(
+            f"  {chatgpt_model}: {projection['requests']} requests, ~{projection['input_tokens']} input tokens, ~{projection['output_tokens']} output tokens, {cost}")
+
+        if projection['unsupported'] > 0:
+            print(
+                f"    {projection['unsupported']} testcases exceed the context window of {chatgpt_model} and are skipped")
+
+        total_requests += projection['requests']
+        total_unsupported += projection['unsupported']
+
+    print(
+        f"  total: {total_requests} requests, {total_unsupported} unsupported, ${total_cost:.2f}")
+
+    if budget_usd is not None and total_cost > budget_usd:
+        print(
+            f"  the estimate exceeds the budget of ${budget_usd:.2f}, testcases past it will be skipped")
+
+
+class Budget:
+    """
+    Hard cap on the dollars a run spends.
+
+    Requests reserve their estimated cost before being issued and settle
+    their billed cost once they complete, so concurrent requests cannot
+    overshoot the cap together. Testcases the remaining budget cannot cover
+    are skipped, and their hashes kept in `over_budget_hashes` when given.
+    Without a limit every reservation succeeds.
+    """
+
+    def __init__(self, limit_usd=None):
+        self.limit = limit_usd
+        self.spent = 0.0
+        self.reserved = 0.0
+        self.over_budget = 0
+        self.over_budget_hashes = set()
+
+    def reserve(self, cost, testcase_hash=None):
+        if self.limit is None:
+            return True
+
+        if self.spent + self.reserved + cost > self.limit:
+            self.over_budget += 1
+
+            if testcase_hash is not None:
+                self.over_budget_hashes.add(testcase_hash)
+
+            return False
+
+        self.reserved += cost
+
+        return True
+
+    def settle(self, reserved_cost, billed_cost):
+        if self.limit is None:
+            return
+
+        self.reserved -= reserved_cost
+        self.spent += billed_cost
@@ -1,143 +1,180 @@
-import sys
-import json
 import os
 import csv
+import argparse
+import functools
 
+import results_store
+import tracing
 
-def read_annonated_model(results_dir):
-    path = os.path.join(results_dir, 'annotated_model.json')
 
-    if not os.path.exists(path):
-        raise Exception('Annonated model file does not exist.')
+@functools.lru_cache(maxsize=None)
+def read_annonated_model(store, model_id, source_hash):
+    """
+    Resolve and flatten an annotated model once, every testcase of the model
+    shares the result.
+    """
+    data = store.get_model(model_id, source_hash)
 
-    with open(path, 'r') as f:
-        data = json.load(f)
+    # flatten "type_activities_count"
+    type_activities_count = data['type_activities_count']
 
-        # flatten "type_activities_count"
-        type_activities_count = data['type_activities_count']
+    for type, activities_count in type_activities_count.items():
+        data['type_activities_count_' + type] = activities_count
 
-        for type, activities_count in type_activities_count.items():
-            data['type_activities_count_' + type] = activities_count
+    # exclude "type_activities_count"
+    del data['type_activities_count']
 
-        # exclude "type_activities_count"
-        del data['type_activities_count']
+    # flatten type_events_count
+    type_events_count = data['type_events_count']
 
-        # flatten type_events_count
-        type_events_count = data['type_events_count']
+    for type, events_count in type_events_count.items():
+        data['type_events_count_' + type] = events_count
 
-        for type, events_count in type_events_count.items():
-            data['type_events_count_' + type] = events_count
+    # exclude "type_events_count"
+    del data['type_events_count']
 
-        # exclude "type_events_count"
-        del data['type_events_count']
+    # flatten type_gateways_count
+    type_gateways_count = data['type_gateways_count']
 
-        # flatten type_gateways_count
-        type_gateways_count = data['type_gateways_count']
+    for type, gateways_count in type_gateways_count.items():
+        data['type_gateways_count_' + type] = gateways_count
 
-        for type, gateways_count in type_gateways_count.items():
-            data['type_gateways_count_' + type] = gateways_count
+    # exclude "type_gateways_count"
+    del data['type_gateways_count']
 
-        # exclude "type_gateways_count"
-        del data['type_gateways_count']
+    # flatten token and character counts of each serialization form
+    for serialization, counts in data.get('serializations', {}).items():
+        data['tokens_count_' + serialization] = counts['tokens_count']
+        data['characters_count_' + serialization] = counts['characters_count']
 
-        return data
+    # exclude "serializations"
+    data.pop('serializations', None)
 
+    return data
 
-def read_basic_eval(results_dir):
-    path = os.path.join(results_dir, 'basic_eval.json')
 
-    if not os.path.exists(path):
-        raise Exception('Basic eval file does not exist.')
+# Stages every testcase must have been through, the others are optional
+STAGE_NAMES = {
+    "generation_result": 'Generation result',
+    "basic_eval": 'Basic eval',
+    "taasc_sca": 'TAASC SCA'
+}
 
-    with open(path, 'r') as f:
-        return json.load(f)
+# Fields stages keep to run incrementally, hidden from the final results
+BOOKKEEPING_KEYS = ['input_hash', 'eval_schema_version',
+                    'coverage_schema_version', 'taasc_schema_version']
 
 
-def read_parameters(results_dir):
-    path = os.path.join(results_dir, 'parameters.json')
+def prefixed(prefix, record, excluded=[]):
+    return {prefix + k: v for k, v in record.items() if k not in BOOKKEEPING_KEYS and k not in excluded}
 
-    if not os.path.exists(path):
-        raise Exception('Parameters file does not exist.')
 
-    with open(path, 'r') as f:
-        return json.load(f)
+def check_stage_records(records, uid):
+    for stage, stage_name in STAGE_NAMES.items():
+        if stage not in records:
+            raise Exception(f'{stage_name} results of {uid} do not exist.')
 
 
-def read_generation_result(results_dir):
-    path = os.path.join(results_dir, 'generation_result.json')
+def get_fieldnames(results):
+    """
+    Union of the keys of every row, in the order they first appear, so rows
+    written by different versions of the pipeline keep all their columns.
+    """
+    fieldnames = {}
 
-    if not os.path.exists(path):
-        raise Exception('Generation result file does not exist.')
+    for result in results:
+        fieldnames.update(dict.fromkeys(result))
 
-    with open(path, 'r') as f:
-        return json.load(f)
+    return list(fieldnames)
 
 
-def read_taasc_result(results_dir):
-    path = os.path.join(results_dir, 'taasc_results.json')
+def write_csv(results, fieldnames, csv_path):
+    with open(csv_path, 'w') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
 
-    if not os.path.exists(path):
-        raise Exception('TAASC results file does not exist.')
+        for result in results:
+            writer.writerow(result)
 
-    with open(path, 'r') as f:
-        return json.load(f)
 
+def write_parquet(results, fieldnames, parquet_path):
+    try:
+        import pandas as pd
+    except ImportError:
+        raise Exception('Parquet output requires pandas and pyarrow.')
 
-def read_taasc_sca_result(results_dir):
-    path = os.path.join(results_dir, 'taasc_results_sca.json')
+    pd.DataFrame(results, columns=fieldnames).to_parquet(
+        parquet_path, index=False)
 
-    if not os.path.exists(path):
-        raise Exception('TAASC SCA results file does not exist.')
 
-    with open(path, 'r') as f:
-        return json.load(f)
+def write_coverage_hits(coverage_hits, csv_path):
+    """
+    One row per model element and description, for per-element analysis.
+    """
+    with open(csv_path, 'w') as f:
+        writer = csv.DictWriter(
+            f, fieldnames=['uid', 'id', 'type', 'label', 'match', 'score'])
+        writer.writeheader()
 
+        for uid, hits in coverage_hits.items():
+            for hit in hits:
+                writer.writerow({'uid': uid, **hit})
 
-def read_taasc_components_result(results_dir):
-    path = os.path.join(results_dir, 'taasc_results_components.json')
 
-    if not os.path.exists(path):
-        raise Exception('TAASC Components results file does not exist.')
+def write_generation_chunks(generation_chunks, csv_path):
+    """
+    One row per chunk and merge request of the chunked testcases.
+    """
+    with open(csv_path, 'w') as f:
+        writer = csv.DictWriter(f, fieldnames=[
+                                'uid', 'kind', 'label', 'level', 'prompt_tokens', 'completion_tokens', 'billed_estimate', 'latency'])
+        writer.writeheader()
 
-    with open(path, 'r') as f:
-        return json.load(f)
+        for uid, calls in generation_chunks.items():
+            for call in calls:
+                writer.writerow({'uid': uid, **call})
 
 
-def postprocess(base_results_dir):
+def postprocess(base_results_dir, parquet=False):
 
-    # read all folders
-    folders = [f for f in os.listdir(base_results_dir) if os.path.isdir(
-        os.path.join(base_results_dir, f))]
+    store = results_store.ResultsStore.open_existing(base_results_dir)
 
-    # exclude "descriptiosn"
-    folders = [f for f in folders if f != 'descriptions']
+    # read generation, evaluation and taasc results of every testcase at once
+    with tracing.span('read_records'):
+        all_records = store.get_all_records()
 
     results = []
+    coverage_hits = {}
+    generation_chunks = {}
 
-    for uid in folders:
-        results_dir = os.path.join(base_results_dir, uid)
-        print(results_dir)
-
+    for uid, model_id, source_hash, parameters in store.iter_testcases():
         # read annonated model
-        annonated_model = read_annonated_model(results_dir)
+        with tracing.span('read_model'):
+            annonated_model = read_annonated_model(store, model_id, source_hash)
+
+        records = all_records.get(uid, {})
 
-        # read parameters
-        parameters = read_parameters(results_dir)
+        check_stage_records(records, uid)
 
-        # read generation result
-        generation_result = read_generation_result(results_dir)
+        generation_result = records['generation_result']
+        basic_eval = records['basic_eval']
+        taasc_sca_result = records['taasc_sca']
 
-        # read taasc result
-        taasc_result = read_taasc_result(results_dir)
+        # only imported TAASC runs have these, native runs store their
+        # lexical measures apart
+        taasc_result = records.get('taasc', {})
+        taasc_components_result = records.get('taasc_components', {})
+        lexical_result = records.get('lexical', {})
 
-        # read taasc sca result
-        taasc_sca_result = read_taasc_sca_result(results_dir)
+        # chunked generations keep their requests in their own csv
+        if 'chunks' in generation_result:
+            generation_chunks[uid] = generation_result['chunks']
 
-        # read taasc components result
-        taasc_components_result = read_taasc_components_result(results_dir)
+        # label coverage is optional, its per-element hits go to their own csv
+        coverage = records.get('coverage', {})
 
-        # read basic eval
-        basic_eval = read_basic_eval(results_dir)
+        if 'hits' in coverage:
+            coverage_hits[uid] = coverage['hits']
 
         # flatten out
         result = {
@@ -147,56 +184,95 @@ def postprocess(base_results_dir):
             "chatgpt_model": parameters['chatgpt_model'],
             "temperature": parameters['temperature'],
             "prompt_name": parameters['prompt_name'],
+            "serialization": parameters.get('serialization', 'raw'),
             "seed": parameters['seed'],
 
             # flatten basic eval
-            **basic_eval,
+            **prefixed('', basic_eval),
 
             # flatten annonated model, excluding "model_id", and "serialized_model"
-            **{"md_" + k: v for k, v in annonated_model.items() if k != 'model_id' and k != 'serialized_model' and k != 'supported_chatgpt_models' and k != 'chatgpt_model_pricings_usd'},
+            **{"md_" + k: v for k, v in annonated_model.items() if k != 'model_id' and k != 'serialized_model' and k != 'supported_chatgpt_models' and k != 'chatgpt_model_pricings_usd' and k != 'source_hash' and k != 'metrics_schema_version'},
 
-            # flatten generation result with a prefix, hiding "generated_description"
-            **{'genres_' + k: v for k, v in generation_result.items() if k != 'generated_description'},
+            # flatten generation result with a prefix, hiding "generated_description" and "chunks"
+            **{'genres_' + k: v for k, v in generation_result.items() if k != 'generated_description' and k != 'chunks'},
 
             # flatten taasc result with a prefix
-            **{'taasc_' + k: v for k, v in taasc_result.items()},
+            **prefixed('taasc_', taasc_result),
 
             # flatten taasc sca result with a prefix
-            **{'taasc_sca_' + k: v for k, v in taasc_sca_result.items()},
+            **prefixed('taasc_sca_', taasc_sca_result),
 
             # flatten taasc components result with a prefix
-            **{'taasc_components_' + k: v for k, v in taasc_components_result.items()}
+            **prefixed('taasc_components_', taasc_components_result),
+
+            # flatten the native lexical measures with a prefix
+            **prefixed('lexical_', lexical_result),
+
+            # flatten label coverage with a prefix, hiding its hits
+            **prefixed('coverage_', coverage, ['hits'])
         }
 
         results.append(result)
 
+    read_annonated_model.cache_clear()
+    store.close()
+
+    fieldnames = get_fieldnames(results)
+
     # write to csv
     csv_path = os.path.join(base_results_dir, 'final_results.csv')
 
-    with open(csv_path, 'w') as f:
-        writer = csv.DictWriter(f, fieldnames=results[0].keys())
-        writer.writeheader()
+    with tracing.span('write_csv', rows=len(results)):
+        write_csv(results, fieldnames, csv_path)
 
-        for result in results:
-            writer.writerow(result)
+    print(f"Aggregated {len(results)} results in {csv_path}")
+
+    if len(coverage_hits) > 0:
+        hits_path = os.path.join(base_results_dir, 'coverage_hits.csv')
+
+        write_coverage_hits(coverage_hits, hits_path)
+
+        print(f"Wrote label coverage hits of {len(coverage_hits)} results in {hits_path}")
+
+    if len(generation_chunks) > 0:
+        chunks_path = os.path.join(base_results_dir, 'generation_chunks.csv')
+
+        write_generation_chunks(generation_chunks, chunks_path)
+
+        print(f"Wrote the chunk requests of {len(generation_chunks)} results in {chunks_path}")
+
+    if parquet:
+        parquet_path = os.path.join(base_results_dir, 'final_results.parquet')
+
+        with tracing.span('write_parquet', rows=len(results)):
+            write_parquet(results, fieldnames, parquet_path)
+
+        print(f"Aggregated {len(results)} results in {parquet_path}")
 
 
 def main():
     print('Pre-processing phase of the experiment.')
 
-    if len(sys.argv) < 2:
-        raise Exception('Results directory not specified.')
+    parser = argparse.ArgumentParser(
+        description='Aggregate the results store of a dataset into final_results.csv.')
+
+    parser.add_argument('results_dir', help='Results directory of a dataset, e.g. results/covid19')
+    parser.add_argument('--parquet', action='store_true',
+                        help='Also write final_results.parquet (requires pandas and pyarrow)')
 
-    # Get dataset dir from command line
-    dataset_dir = sys.argv[1]
+    tracing.add_arguments(parser)
 
-    if dataset_dir is None:
-        raise Exception('Results directory not specified.')
+    args = parser.parse_args()
 
-    if not os.path.exists(dataset_dir):
+    if not os.path.exists(args.results_dir):
         raise Exception('Results directory does not exist.')
 
-    postprocess(dataset_dir)
+    tracing.start('postprocess', args.trace, args.profile)
+
+    try:
+        postprocess(args.results_dir, args.parquet)
+    finally:
+        tracing.stop()
 
 
 if __name__ == '__main__':
@@ -1,173 +1,207 @@
 import os
 import json
-import sys
+import hashlib
+import argparse
+import functools
 
-import bpmn_python.bpmn_diagram_metrics as metrics
-import bpmn_python.bpmn_diagram_rep as diagram
+from concurrent.futures import ProcessPoolExecutor
 
-from xml.etree import ElementTree as ET
+import bpmn_model
+import openai_models
+import serializers
+import tokens as tokenizer
+import tracing
 
-from transformers import GPT2Tokenizer
+# Bump whenever the annotated_model.json fields or how they are computed change,
+# so incremental runs re-annotate every model
+METRICS_SCHEMA_VERSION = 5
 
-# as of 12/01/2024
-openai_token_limits = {
-    "gpt-4-1106-preview": 128000,
-    "gpt-4-vision-preview": 128000,
-    "gpt-4": 8192,
-    "gpt-3-32k": 32768,
-    "gpt-3.5-turbo-1106": 16385,
-    "gpt-3.5-turbo-instruct": 4096
-}
 
-# as of 12/01/2024, in USD
-openai_pricing_per_1k_input_tokens = {
-    "gpt-4-1106-preview": 0.01,
-    "gpt-4-vision-preview": 0.01,
-    "gpt-4": 0.03,
-    "gpt-3-32k": 0.006,
-    "gpt-3.5-turbo-1106": 0.001,
-    "gpt-3.5-turbo-instruct": 0.0015
-}
+def tokenize(serialized_model):
+    return tokenizer.encode(serialized_model)
 
 
-def tokenize(serialized_model):
-    tokenizer = GPT2Tokenizer.from_pretrained('gpt2')
+def get_token_count(tokens):
+    return len(tokens)
 
-    tokens = tokenizer.encode(serialized_model)
 
-    return tokens
+def get_serialization_counts(serialized_model):
+    """
+    Token and character counts of the model in every serialization form that
+    generation can send.
+    """
+    counts = {}
 
+    for serialization in serializers.SERIALIZERS:
+        with tracing.span('serialize', serialization=serialization):
+            serialized_form = serializers.serialize(
+                serialized_model, serialization)
 
-def get_token_count(tokens):
-    return len(tokens)
+        with tracing.span('tokenize', serialization=serialization):
+            tokens_count = get_token_count(tokenize(serialized_form))
 
+        counts[serialization] = {
+            "tokens_count": tokens_count,
+            "characters_count": len(serialized_form),
+            "supported_chatgpt_models": openai_models.get_supported_chatgpt_models(tokens_count)
+        }
 
-def get_extra_metrics(serialized_model):
+    return counts
 
-    # Parse as XML
-    root = ET.fromstring(serialized_model)
 
-    namespaces = {'bpmn': 'http://www.omg.org/spec/BPMN/20100524/MODEL'}
+def is_annotation_current(annotated_model_path: str, source_hash: str):
+    if not os.path.exists(annotated_model_path):
+        return False
 
-    # Get all bpmn:collaboration elements
-    collaborations = root.findall(
-        './/bpmn:participant', namespaces)
+    try:
+        with open(annotated_model_path, 'r') as f:
+            annotated_model = json.load(f)
+    except ValueError:
+        return False
 
-    num_pools = len(collaborations)
+    return annotated_model.get('source_hash') == source_hash and annotated_model.get('metrics_schema_version') == METRICS_SCHEMA_VERSION
 
-    # Get all bpmn:laneSet elements
-    lanes = root.findall(
-        './/bpmn:lane', namespaces)
 
-    num_lanes = len(lanes)
+def annotate_model_dir(test_path: str, force: bool = False):
+    """
+    Annotate the model in `test_path`, returning "skipped" when its
+    annotated_model.json already matches the source file and metrics schema,
+    and "updated" otherwise.
+    """
+    # Get the only file with bpmn format using regex
+    bpmn_files = [file for file in os.listdir(
+        test_path) if file.endswith('.bpmn')]
 
-    model_id = root.attrib['id']
+    if len(bpmn_files) > 1 or len(bpmn_files) == 0:
+        raise Exception(
+            'Malformed dataset. Each test should have exactly one bpmn file.')
 
-    return num_pools, num_lanes, model_id
+    bpmn_file = bpmn_files[0]
 
+    with tracing.span('read_file'), open(os.path.join(test_path, bpmn_file), 'rb') as f:
+        source = f.read()
 
-def annotate_dataset_dir(dataset_dir: str):
-    # Get a list of directories within dataset_dir
+    source_hash = hashlib.sha256(source).hexdigest()
 
-    dirs = os.listdir(dataset_dir)
+    annotated_model_path = os.path.join(test_path, 'annotated_model.json')
 
-    total = len(dirs)  # M
+    if not force and is_annotation_current(annotated_model_path, source_hash):
+        return 'skipped'
 
-    annotated_dataset = []
+    serialized_model = source.decode('utf-8')
 
-    for dir in dirs:
-        test_path = os.path.join(dataset_dir, dir)
-        # Get the only file with bpmn format using regex
-        bpmn_files = [file for file in os.listdir(
-            test_path) if file.endswith('.bpmn')]
+    print(bpmn_file)
 
-        if len(bpmn_files) > 1 or len(bpmn_files) == 0:
-            raise Exception(
-                'Malformed dataset. Each test should have exactly one bpmn file.')
+    # A, E, G, TA, TE, TG, CNC, D, N, F, P, L from a single parse
+    with tracing.span('parse'):
+        root = bpmn_model.parse(source)
 
-        bpmn_file = bpmn_files[0]
+    with tracing.span('compute_metrics'):
+        model_metrics = bpmn_model.compute_metrics(root)
 
-        serialized_model = open(os.path.join(test_path, bpmn_file), 'r').read()
+    serializations = get_serialization_counts(serialized_model)
 
-        print(bpmn_file)
+    tokens_count = serializations['raw']['tokens_count']
 
-        bpmn_graph = diagram.BpmnDiagramGraph()
-        bpmn_graph.load_diagram_from_xml_file(
-            os.path.join(test_path, bpmn_file))
+    characters_count = len(serialized_model)
 
-        activities_count = metrics.all_activities_count(bpmn_graph)         # A
-        events_count = metrics.all_events_count(bpmn_graph)                 # E
-        gateways_count = metrics.all_gateways_count(bpmn_graph)             # G
-        type_activities_count = metrics.get_activities_counts(
-            bpmn_graph)                                                     # TA
-        type_events_count = metrics.get_events_counts(
-            bpmn_graph)                                                     # TE
-        type_gateways_count = metrics.get_gateway_counts(
-            bpmn_graph)                                                     # TG
-        cnc = metrics.CoefficientOfNetworkComplexity_metric(
-            bpmn_graph)                                                     # CNC
-        durfee = metrics.DurfeeSquare_metric(bpmn_graph)                    # D
+    supported_chatgpt_models = serializations['raw']['supported_chatgpt_models']
 
-        nodes_count = activities_count + events_count + gateways_count      # N
+    chatgpt_model_pricings_usd = {
+        model: openai_models.openai_pricing_per_1k_input_tokens[model] * tokens_count / 1000 for model in supported_chatgpt_models
+    }
 
-        sequence_flows_count = metrics.all_control_flow_elements_count(
-            bpmn_graph)  # F
+    testcase = {
+        "model_id": model_metrics['model_id'],
+        "serialized_model": serialized_model,
+        "activities_count": model_metrics['activities_count'],
+        "events_count": model_metrics['events_count'],
+        "gateways_count": model_metrics['gateways_count'],
+        "type_activities_count": model_metrics['type_activities_count'],
+        "type_events_count": model_metrics['type_events_count'],
+        "type_gateways_count": model_metrics['type_gateways_count'],
+        "cnc": model_metrics['cnc'],
+        "durfee": model_metrics['durfee'],
+        "nodes_count": model_metrics['nodes_count'],
+        "sequence_flows_count": model_metrics['sequence_flows_count'],
+        "pools_count": model_metrics['pools_count'],
+        "lanes_count": model_metrics['lanes_count'],
+        "tokens_count": tokens_count,
+        "characters_count": characters_count,
+        "supported_chatgpt_models": supported_chatgpt_models,
+        "chatgpt_model_pricings_usd": chatgpt_model_pricings_usd,
+        "serializations": serializations,
+        "dir": test_path,
+        "source_hash": source_hash,
+        "metrics_schema_version": METRICS_SCHEMA_VERSION
+    }
 
-        # number of different symbols
-        # ns = type_activities_count + type_events_count + type_gateways_count  # NS
+    # Save as testcase.json in the same directory
+    with tracing.span('write_json'), open(annotated_model_path, 'w') as f:
+        # With pretty printing
+        serialized_json = json.dumps(testcase, indent=4)
 
-        # P, L
-        pools_count, lanes_count, model_id = get_extra_metrics(
-            serialized_model)
+        f.write(serialized_json)
 
-        tokens = tokenize(serialized_model)
-        tokens_count = get_token_count(tokens)
+    return 'updated'
 
-        characters_count = len(serialized_model)
 
-        supported_chatgpt_models = []
+def annotate_model_dir_safely(test_path: str, force: bool = False):
+    """
+    Annotate one model directory, reporting failures instead of raising so a
+    single malformed model does not abort the whole dataset.
+    """
+    try:
+        return test_path, annotate_model_dir(test_path, force), None
+    except Exception as error:
+        return test_path, 'failed', f'{error.__class__.__name__}: {error}'
 
-        for model in openai_token_limits:
-            if openai_token_limits[model] >= tokens_count:
-                supported_chatgpt_models.append(model)
 
-        chatgpt_model_pricings_usd = {
-            model: openai_pricing_per_1k_input_tokens[model] * tokens_count / 1000 for model in supported_chatgpt_models
-        }
+def init_worker():
+    # Load the tokenizer once per worker process
+    tokenizer.get_encoding()
+
+    tracing.init_worker()
 
-        testcase = {
-            "model_id": model_id,
-            "serialized_model": serialized_model,
-            "activities_count": activities_count,
-            "events_count": events_count,
-            "gateways_count": gateways_count,
-            "type_activities_count": type_activities_count,
-            "type_events_count": type_events_count,
-            "type_gateways_count": type_gateways_count,
-            "cnc": cnc,
-            "durfee": durfee,
-            "nodes_count": nodes_count,
-            "sequence_flows_count": sequence_flows_count,
-            "pools_count": pools_count,
-            "lanes_count": lanes_count,
-            "tokens_count": tokens_count,
-            "characters_count": characters_count,
-            "supported_chatgpt_models": supported_chatgpt_models,
-            "chatgpt_model_pricings_usd": chatgpt_model_pricings_usd,
-            "dir": test_path
-        }
 
-        annotated_dataset.append(testcase)
+def annotate_dataset_dir(dataset_dir: str, workers: int = 1, force: bool = False):
+    # Get a list of directories within dataset_dir, sorted so runs are deterministic
 
-        # Save as testcase.json in the same directory
-        with open(os.path.join(test_path, 'annotated_model.json'), 'w') as f:
-            # With pretty printing
-            serialized_json = json.dumps(testcase, indent=4)
+    dirs = sorted(os.listdir(dataset_dir))
 
-            f.write(serialized_json)
+    total = len(dirs)  # M
+
+    test_paths = [os.path.join(dataset_dir, dir) for dir in dirs]
+
+    annotate = functools.partial(annotate_model_dir_safely, force=force)
+
+    failures = []
+    counts = {'updated': 0, 'skipped': 0, 'failed': 0}
+
+    if workers > 1:
+        chunksize = max(1, total // (workers * 4))
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            outcomes = list(executor.map(
+                annotate, test_paths, chunksize=chunksize))
+    else:
+        outcomes = map(annotate, test_paths)
+
+    for test_path, status, error in outcomes:
+        counts[status] += 1
+
+        if error is not None:
+            print(f"Failed to annotate {test_path}: {error}")
+
+            failures.append((test_path, error))
+
+    print(
+        f"Annotated {total} models: {counts['updated']} updated, {counts['skipped']} skipped, {counts['failed']} failed.")
 
+    return failures
 
-def preprocess(dataset_dir: str):
+
+def preprocess(dataset_dir: str, workers: int = 1, force: bool = False):
     """
     Pre-processing phase of the experiment.
 
@@ -176,21 +210,39 @@ def preprocess(dataset_dir: str):
       - Tokenize the serialized model.
       - Calculate number of tokens.
       - Calculate number of flow objects, connecting objects and data objects.
+
+    With more than one worker the models are annotated in a process pool.
+    Models whose annotation matches their source file are skipped unless
+    `force` is set.
     """
 
     print(f"Using dataset directory: {dataset_dir}")
 
-    annotate_dataset_dir(dataset_dir)
+    failures = annotate_dataset_dir(dataset_dir, workers, force)
+
+    if len(failures) > 0:
+        raise Exception(f'{len(failures)} models could not be annotated.')
 
 
 def main():
     print('Pre-processing phase of the experiment.')
 
-    if len(sys.argv) < 2:
-        raise Exception('Dataset directory not specified.')
+    parser = argparse.ArgumentParser(
+        description='Pre-processing phase of the experiment.')
+
+    parser.add_argument('dataset_dir', nargs='?',
+                        help='Directory with one folder per BPMN model')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes, 0 uses every core')
+    parser.add_argument('--force', action='store_true',
+                        help='Re-annotate every model, even unchanged ones')
+
+    tracing.add_arguments(parser)
+
+    args = parser.parse_args()
 
     # Get dataset dir from command line
-    dataset_dir = sys.argv[1]
+    dataset_dir = args.dataset_dir
 
     if dataset_dir is None:
         raise Exception('Dataset directory not specified.')
@@ -198,7 +250,14 @@ def main():
     if not os.path.exists(dataset_dir):
         raise Exception('Dataset directory does not exist.')
 
-    preprocess(dataset_dir)
+    workers = args.workers or os.cpu_count()
+
+    tracing.start('preprocess', args.trace, args.profile)
+
+    try:
+        preprocess(dataset_dir, workers, args.force)
+    finally:
+        tracing.stop()
 
 
 if __name__ == '__main__':
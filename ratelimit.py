@@ -0,0 +1,162 @@
+import time
+import asyncio
+import threading
+
+# Fraction of the provider limits we actually schedule against
+DEFAULT_HEADROOM = 0.9
+
+# How many seconds worth of budget may be spent in a single burst
+DEFAULT_BURST_SECONDS = 5
+
+DEFAULT_EXPECTED_COMPLETION_TOKENS = 700
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `per_minute` units per minute.
+
+    Reservations are allowed to drive the bucket negative; the returned delay
+    is how long the caller must wait before its reservation is covered, so
+    concurrent callers queue up behind each other instead of racing.
+    """
+
+    def __init__(self, per_minute, headroom=DEFAULT_HEADROOM, burst_seconds=DEFAULT_BURST_SECONDS):
+        self.rate = per_minute * headroom / 60
+        self.capacity = self.rate * burst_seconds
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount, now=None):
+        with self.lock:
+            if now is None:
+                now = time.monotonic()
+
+            self.tokens = min(self.capacity, self.tokens +
+                              (now - self.updated) * self.rate)
+            self.updated = now
+
+            self.tokens -= amount
+
+            if self.tokens >= 0:
+                return 0.0
+
+            return -self.tokens / self.rate
+
+
+class RateLimiter:
+    """
+    Per chatgpt_model requests-per-minute and tokens-per-minute limiter.
+
+    `rate_limits` maps a chatgpt_model to {"rpm": ..., "tpm": ...}, as in the
+    "rate_limits" entry of parameters.json. Models without limits are not
+    throttled.
+    """
+
+    def __init__(self, rate_limits, headroom=DEFAULT_HEADROOM):
+        self.buckets = {}
+
+        for chatgpt_model, limits in rate_limits.items():
+            request_bucket = None
+            token_bucket = None
+
+            if limits.get('rpm'):
+                request_bucket = TokenBucket(limits['rpm'], headroom)
+
+            if limits.get('tpm'):
+                token_bucket = TokenBucket(limits['tpm'], headroom)
+
+            self.buckets[chatgpt_model] = (request_bucket, token_bucket)
+
+    def reserve(self, chatgpt_model, tokens):
+        if chatgpt_model not in self.buckets:
+            return 0.0
+
+        request_bucket, token_bucket = self.buckets[chatgpt_model]
+
+        delay = 0.0
+
+        if request_bucket is not None:
+            delay = max(delay, request_bucket.reserve(1))
+
+        if token_bucket is not None:
+            delay = max(delay, token_bucket.reserve(tokens))
+
+        return delay
+
+    def wait(self, chatgpt_model, tokens):
+        delay = self.reserve(chatgpt_model, tokens)
+
+        if delay > 0:
+            time.sleep(delay)
+
+    async def await_capacity(self, chatgpt_model, tokens):
+        delay = self.reserve(chatgpt_model, tokens)
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def estimate_request_tokens(testcase, expected_completion_tokens=DEFAULT_EXPECTED_COMPLETION_TOKENS):
+    return testcase['tokens_count'] + expected_completion_tokens
+
+
+def project_duration(testcases, rate_limits, expected_completion_tokens=DEFAULT_EXPECTED_COMPLETION_TOKENS, headroom=DEFAULT_HEADROOM):
+    """
+    Project how long the testcases take when every chatgpt_model runs at its
+    rate limit. Returns the per model projections (in seconds, None when the
+    model is not limited) and the overall projection.
+    """
+    totals = {}
+
+    for testcase in testcases:
+        chatgpt_model = testcase['chatgpt_model']
+
+        requests, tokens = totals.get(chatgpt_model, (0, 0))
+
+        totals[chatgpt_model] = (
+            requests + 1, tokens + estimate_request_tokens(testcase, expected_completion_tokens))
+
+    projections = {}
+
+    for chatgpt_model, (requests, tokens) in totals.items():
+        limits = rate_limits.get(chatgpt_model, {})
+
+        minutes = []
+
+        if limits.get('rpm'):
+            minutes.append(requests / (limits['rpm'] * headroom))
+
+        if limits.get('tpm'):
+            minutes.append(tokens / (limits['tpm'] * headroom))
+
+        projections[chatgpt_model] = {
+            "requests": requests,
+            "tokens": tokens,
+            "seconds": max(minutes) * 60 if minutes else None
+        }
+
+    # Models are throttled independently, so they run side by side
+    limited = [p['seconds']
+               for p in projections.values() if p['seconds'] is not None]
+
+    return projections, max(limited) if limited else None
+
+
+def print_projected_duration(testcases, rate_limits, expected_completion_tokens=DEFAULT_EXPECTED_COMPLETION_TOKENS, headroom=DEFAULT_HEADROOM):
+    projections, total_seconds = project_duration(
+        testcases, rate_limits, expected_completion_tokens, headroom)
+
+    print('Projected run duration:')
+
+    for chatgpt_model, projection in projections.items():
+        if projection['seconds'] is None:
+            duration = 'no rate limit configured'
+        else:
+            duration = f"{projection['seconds'] / 60:.1f} min"
+
+        print(
+            f"  {chatgpt_model}: {projection['requests']} requests, ~{projection['tokens']} tokens, {duration}")
+
+    if total_seconds is not None:
+        print(f"  total: {total_seconds / 60:.1f} min")
@@ -0,0 +1,434 @@
+import os
+import json
+import sqlite3
+import functools
+import argparse
+
+from concurrent.futures import ProcessPoolExecutor
+
+import tracing
+
+STORE_FILENAME = 'results.sqlite'
+
+# Items an incremental stage computes between two writes to the store
+WRITE_BATCH_SIZE = 1000
+
+# Stages that attach a record to a testcase, and the file each one is
+# exported to in the per-directory layout
+RECORD_FILES = {
+    "generation_result": 'generation_result.json',
+    "basic_eval": 'basic_eval.json',
+    "taasc": 'taasc_results.json',
+    "taasc_sca": 'taasc_results_sca.json',
+    "taasc_components": 'taasc_results_components.json',
+    "lexical": 'lexical_results.json',
+    "coverage": 'coverage.json'
+}
+
+
+def get_journal_mode(shared_filesystem=False):
+    """
+    WAL needs memory shared by every process opening the database, i.e. one
+    host. Databases on NFS or SMB shares used from several hosts keep the
+    rollback journal, whose file locks those filesystems support.
+    """
+    return 'DELETE' if shared_filesystem else 'WAL'
+
+
+def get_store_path(base_results_dir):
+    return os.path.join(base_results_dir, STORE_FILENAME)
+
+
+def get_model_key(annotated_model):
+    # Models annotated before source hashes existed share an empty hash
+    return annotated_model['model_id'], annotated_model.get('source_hash', '')
+
+
+def get_model_path(base_results_dir, model_id, source_hash):
+    """
+    Path of an annotated model in the per-dataset model store of the
+    directory layout, shared by every testcase of the model.
+    """
+    filename = f'{model_id}_{source_hash[:16]}.json' if source_hash else f'{model_id}.json'
+
+    return os.path.join(base_results_dir, 'models', filename)
+
+
+class ResultsStore:
+    """
+    Every result of a dataset in one SQLite file.
+
+    Annotated models are stored once and referenced by model_id and source
+    hash, testcases hold their parameters and each stage (generation,
+    evaluation, TAASC) attaches one JSON record per testcase.
+    """
+
+    def __init__(self, path, shared_filesystem=False):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        self.path = path
+        self.stored_models = set()
+
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute(
+            f'PRAGMA journal_mode={get_journal_mode(shared_filesystem)}')
+        self.connection.execute(
+            f"PRAGMA synchronous={'FULL' if shared_filesystem else 'NORMAL'}")
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS models (
+                model_id TEXT NOT NULL,
+                source_hash TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (model_id, source_hash)
+            );
+            CREATE TABLE IF NOT EXISTS testcases (
+                uid TEXT PRIMARY KEY,
+                model_id TEXT NOT NULL,
+                source_hash TEXT NOT NULL,
+                parameters TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS records (
+                uid TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (uid, stage)
+            );
+        ''')
+        self.connection.commit()
+
+    @classmethod
+    def open(cls, base_results_dir, shared_filesystem=False):
+        return cls(get_store_path(base_results_dir), shared_filesystem)
+
+    @classmethod
+    def open_existing(cls, base_results_dir):
+        path = get_store_path(base_results_dir)
+
+        if not os.path.exists(path):
+            raise Exception(f'Results store {path} does not exist.')
+
+        return cls(path)
+
+    def put_model(self, annotated_model):
+        model_key = get_model_key(annotated_model)
+
+        # A sweep references each model many times, only send it once
+        if model_key in self.stored_models:
+            return
+
+        self.connection.execute('INSERT OR REPLACE INTO models VALUES (?, ?, ?)',
+                                (*model_key, json.dumps(annotated_model)))
+        self.connection.commit()
+
+        self.stored_models.add(model_key)
+
+    def put_generation(self, uid, annotated_model, parameters, generation_result):
+        """
+        Store a testcase and its generation result in one transaction.
+        """
+        self.put_model(annotated_model)
+
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO testcases VALUES (?, ?, ?, ?)',
+                                    (uid, *get_model_key(annotated_model), json.dumps(parameters)))
+            self.connection.execute('INSERT OR REPLACE INTO records VALUES (?, ?, ?)',
+                                    (uid, 'generation_result', json.dumps(generation_result)))
+
+    def put_records(self, stage, records):
+        """
+        Attach the record of a stage to many testcases at once. `records`
+        maps uids to their record.
+        """
+        self.put_stage_records({stage: records})
+
+    def put_stage_records(self, stage_records):
+        """
+        Attach the records of several stages in one transaction.
+        `stage_records` maps stages to uids to their record.
+        """
+        with self.connection:
+            for stage, records in stage_records.items():
+                self.connection.executemany('INSERT OR REPLACE INTO records VALUES (?, ?, ?)',
+                                            [(uid, stage, json.dumps(record)) for uid, record in records.items()])
+
+    def delete_records(self, stage, uids):
+        with self.connection:
+            self.connection.executemany('DELETE FROM records WHERE uid = ? AND stage = ?',
+                                        [(uid, stage) for uid in uids])
+
+    def has_testcase(self, uid):
+        return self.connection.execute('SELECT 1 FROM testcases WHERE uid = ?', (uid,)).fetchone() is not None
+
+    def get_model(self, model_id, source_hash):
+        row = self.connection.execute(
+            'SELECT data FROM models WHERE model_id = ? AND source_hash = ?', (model_id, source_hash)).fetchone()
+
+        if row is None:
+            raise Exception(
+                f'Annotated model {model_id} ({source_hash}) is not in the results store.')
+
+        return json.loads(row[0])
+
+    def iter_testcases(self):
+        """
+        Yield (uid, model_id, source_hash, parameters) ordered by uid.
+        """
+        for uid, model_id, source_hash, parameters in self.connection.execute(
+                'SELECT uid, model_id, source_hash, parameters FROM testcases ORDER BY uid'):
+            yield uid, model_id, source_hash, json.loads(parameters)
+
+    def iter_records(self, stage):
+        for uid, data in self.connection.execute(
+                'SELECT uid, data FROM records WHERE stage = ? ORDER BY uid', (stage,)):
+            yield uid, json.loads(data)
+
+    def get_all_records(self):
+        """
+        Every stage record of every testcase in one query, keyed by uid and
+        then by stage.
+        """
+        records = {}
+
+        for uid, stage, data in self.connection.execute('SELECT uid, stage, data FROM records'):
+            records.setdefault(uid, {})[stage] = json.loads(data)
+
+        return records
+
+    def get_records(self, uid):
+        """
+        Every stage record of a testcase, keyed by stage.
+        """
+        return {stage: json.loads(data) for stage, data in self.connection.execute(
+            'SELECT stage, data FROM records WHERE uid = ?', (uid,))}
+
+    def close(self):
+        self.connection.close()
+
+
+def is_record_current(record, input_hash, version_field, schema_version):
+    return record is not None and record.get('input_hash') == input_hash and record.get(version_field) == schema_version
+
+
+def iter_stale_items(store, stage, version_field, schema_version, items, skipped, force=False):
+    """
+    Filter (uid, input hash, item) triples down to the items whose `stage`
+    record is missing, or was computed from another input or by another
+    schema version, counting the others in `skipped`.
+    """
+    records = dict(store.iter_records(stage))
+
+    for uid, input_hash, item in items:
+        if not force and is_record_current(records.get(uid), input_hash, version_field, schema_version):
+            skipped['count'] += 1
+            continue
+
+        yield item
+
+
+def compute_records(store, stages, compute, items, workers=1, initializer=None, initargs=(), chunksize=64):
+    """
+    Map `compute` over the items of an incremental stage, in a pool of
+    `workers` processes when more than one, and store what it returns: the
+    uid, then a record for each of `stages`. Returns the number of items
+    computed.
+    """
+    if workers > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=initializer, initargs=initargs)
+        outcomes = executor.map(compute, items, chunksize=chunksize)
+    else:
+        executor = None
+        outcomes = map(compute, items)
+
+    computed = 0
+    stage_records = {stage: {} for stage in stages}
+
+    def write():
+        nonlocal computed, stage_records
+
+        batch_size = len(stage_records[stages[0]])
+
+        with tracing.span('store_write', records=batch_size):
+            store.put_stage_records(stage_records)
+
+        computed += batch_size
+        stage_records = {stage: {} for stage in stages}
+
+    try:
+        for uid, *records in outcomes:
+            for stage, record in zip(stages, records):
+                stage_records[stage][uid] = record
+
+            if len(stage_records[stages[0]]) >= WRITE_BATCH_SIZE:
+                write()
+
+        write()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return computed
+
+
+def write_json(path, data):
+    with open(path, 'w') as fp:
+        serialized_json = json.dumps(data, indent=4)
+
+        fp.write(serialized_json)
+
+
+def export_descriptions(store, base_results_dir):
+    """
+    Write descriptions/desc_<uid>.txt for every generated description, the
+    input layout of the TAASC tool.
+    """
+    descriptions_dir = os.path.join(base_results_dir, 'descriptions')
+
+    os.makedirs(descriptions_dir, exist_ok=True)
+
+    count = 0
+
+    for uid, generation_result in store.iter_records('generation_result'):
+        with open(os.path.join(descriptions_dir, f'desc_{uid}.txt'), 'w') as fp:
+            fp.write(generation_result['generated_description'])
+
+        count += 1
+
+    return count
+
+
+def export_directories(store, base_results_dir):
+    """
+    Write the per-testcase directory layout: parameters, generated
+    description and one JSON file per stage record. Annotated models are
+    written once to models/ and referenced by the parameters through their
+    model_id and source_hash.
+    """
+    count = 0
+    exported_models = set()
+
+    for uid, model_id, source_hash, parameters in store.iter_testcases():
+        save_dir = os.path.join(base_results_dir, uid)
+
+        os.makedirs(save_dir, exist_ok=True)
+
+        if (model_id, source_hash) not in exported_models:
+            model_path = get_model_path(
+                base_results_dir, model_id, source_hash)
+
+            os.makedirs(os.path.dirname(model_path), exist_ok=True)
+            write_json(model_path, store.get_model(model_id, source_hash))
+
+            exported_models.add((model_id, source_hash))
+
+        write_json(os.path.join(save_dir, 'parameters.json'),
+                   {**parameters, "source_hash": source_hash})
+
+        for stage, record in store.get_records(uid).items():
+            write_json(os.path.join(save_dir, RECORD_FILES[stage]), record)
+
+            if stage == 'generation_result':
+                with open(os.path.join(save_dir, 'generated_description.txt'), 'w') as fp:
+                    fp.write(record['generated_description'])
+
+        count += 1
+
+    return count
+
+
+def read_json_if_exists(path):
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+@functools.lru_cache(maxsize=None)
+def read_model(path):
+    return read_json_if_exists(path)
+
+
+def import_directories(store, base_results_dir):
+    """
+    Load results written in the per-directory layout into the store.
+    """
+    folders = sorted(f for f in os.listdir(base_results_dir) if os.path.isdir(
+        os.path.join(base_results_dir, f)) and f not in ['descriptions', 'models'])
+
+    count = 0
+
+    for uid in folders:
+        results_dir = os.path.join(base_results_dir, uid)
+
+        parameters = read_json_if_exists(
+            os.path.join(results_dir, 'parameters.json'))
+
+        if parameters is None:
+            print(f"Skipping {results_dir}, it is not a complete testcase.")
+            continue
+
+        if 'source_hash' in parameters:
+            annotated_model = read_model(get_model_path(
+                base_results_dir, parameters['model_id'], parameters['source_hash']))
+        else:
+            # Older layouts kept a copy of the annotated model per testcase
+            annotated_model = read_json_if_exists(
+                os.path.join(results_dir, 'annotated_model.json'))
+
+        generation_result = read_json_if_exists(
+            os.path.join(results_dir, 'generation_result.json'))
+
+        if annotated_model is None or generation_result is None:
+            print(f"Skipping {results_dir}, it is not a complete testcase.")
+            continue
+
+        store.put_generation(uid, annotated_model,
+                             parameters, generation_result)
+
+        for stage, filename in RECORD_FILES.items():
+            record = read_json_if_exists(os.path.join(results_dir, filename))
+
+            if stage != 'generation_result' and record is not None:
+                store.put_records(stage, {uid: record})
+
+        count += 1
+
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Export the results store of a dataset to the per-directory layout, or import that layout into the store.')
+
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('results_dir', help='Results directory of a dataset, e.g. results/covid19')
+    parser.add_argument('--descriptions-only', action='store_true',
+                        help='Only export descriptions/desc_<uid>.txt for the TAASC tool')
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.results_dir):
+        raise Exception('Results directory does not exist.')
+
+    if args.command == 'import':
+        store = ResultsStore.open(args.results_dir)
+        count = import_directories(store, args.results_dir)
+
+        print(f"Imported {count} testcases into {store.path}")
+    else:
+        store = ResultsStore.open_existing(args.results_dir)
+
+        if args.descriptions_only:
+            count = export_descriptions(store, args.results_dir)
+        else:
+            count = export_directories(store, args.results_dir)
+            export_descriptions(store, args.results_dir)
+
+        print(f"Exported {count} testcases from {store.path}")
+
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
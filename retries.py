@@ -0,0 +1,129 @@
+import time
+import json
+import random
+import asyncio
+from datetime import datetime, timezone
+
+import openai
+
+
+class RetriesExhausted(Exception):
+    def __init__(self, error, attempts):
+        super().__init__(
+            f'Giving up after {attempts} attempts: {error.__class__.__name__}: {error}')
+
+        self.error = error
+        self.attempts = attempts
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter, as configured by the "retry" entry
+    of parameters.json.
+    """
+
+    def __init__(self, max_attempts=6, base_delay=1.0, max_delay=60.0, timeout=120.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+
+    @classmethod
+    def from_metadata(cls, metadata):
+        return cls(**metadata.get('retry', {}))
+
+    def delay(self, attempt, error=None):
+        delay = random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+        # Honor the provider's hint when it asks for more
+        retry_after = get_retry_after(error)
+
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+
+        return delay
+
+
+def classify_error(error):
+    """
+    Return the kind of transient error, or None when retrying won't help.
+    """
+    if isinstance(error, openai.error.RateLimitError):
+        return 'rate_limit'
+
+    if isinstance(error, (openai.error.Timeout, asyncio.TimeoutError)):
+        return 'timeout'
+
+    if isinstance(error, (openai.error.ServiceUnavailableError, openai.error.APIConnectionError, openai.error.TryAgain)):
+        return 'server_error'
+
+    if isinstance(error, openai.error.APIError) and error.http_status is not None and error.http_status >= 500:
+        return 'server_error'
+
+    return None
+
+
+def get_retry_after(error):
+    headers = getattr(error, 'headers', None)
+
+    if not headers:
+        return None
+
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+async def call_with_retries(function, policy, *args, **kwargs):
+    for attempt in range(policy.max_attempts):
+        try:
+            return await function(*args, request_timeout=policy.timeout, **kwargs)
+        except Exception as error:
+            kind = classify_error(error)
+
+            if kind is None:
+                raise
+
+            if attempt + 1 == policy.max_attempts:
+                raise RetriesExhausted(error, attempt + 1) from error
+
+            delay = policy.delay(attempt, error)
+
+            print(
+                f"Retrying after {kind} ({error.__class__.__name__}), attempt {attempt + 1}/{policy.max_attempts}, sleeping {delay:.1f}s")
+
+            await asyncio.sleep(delay)
+
+
+def write_dead_letter(path, testcase, seed, error):
+    """
+    Append a testcase that could not be generated to the dead-letter JSONL.
+    """
+    cause = error.error if isinstance(error, RetriesExhausted) else error
+
+    entry = {
+        "testcase_hash": testcase['testcase_hash'],
+        "model_id": testcase['model_id'],
+        "dataset_name": testcase['dataset_name'],
+        "dir": testcase['dir'],
+        "prompt_name": testcase['prompt_name'],
+        "temperature": testcase['temperature'],
+        "chatgpt_model": testcase['chatgpt_model'],
+        "serialization": testcase['serialization'],
+        "seed": seed,
+        "error_class": cause.__class__.__name__,
+        "error": str(cause),
+        "retryable": classify_error(cause) is not None,
+        "attempts": error.attempts if isinstance(error, RetriesExhausted) else 1,
+        "failed_at": datetime.now(timezone.utc).isoformat()
+    }
+
+    with open(path, 'a') as fp:
+        fp.write(json.dumps(entry) + '\n')
+
+
+def read_dead_letters(path):
+    with open(path, 'r') as fp:
+        return [json.loads(line) for line in fp if line.strip()]
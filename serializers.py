@@ -0,0 +1,208 @@
+import bpmn_model
+
+from bpmn_model import etree, BPMN_NAMESPACE
+
+# Namespaces that only carry diagram layout
+DIAGRAM_NAMESPACES = [
+    'http://www.omg.org/spec/BPMN/20100524/DI',
+    'http://www.omg.org/spec/DD/20100524/DC',
+    'http://www.omg.org/spec/DD/20100524/DI'
+]
+
+FLOW_NODE_TYPES = bpmn_model.ACTIVITY_TYPES + \
+    bpmn_model.EVENT_TYPES + bpmn_model.GATEWAY_TYPES
+
+SUBPROCESS_TYPES = ['subProcess', 'adHocSubProcess', 'transaction']
+
+etree.register_namespace('bpmn', BPMN_NAMESPACE)
+
+
+def serialize_raw(serialized_model):
+    return serialized_model
+
+
+def is_stripped(element):
+    namespace, local_name = bpmn_model.split_tag(element)
+
+    if local_name is None:
+        return True
+
+    if namespace in DIAGRAM_NAMESPACES:
+        return True
+
+    # Vendor extensions: camunda, signavio, zeebe...
+    if namespace is not None and namespace != BPMN_NAMESPACE:
+        return True
+
+    return local_name == 'extensionElements'
+
+
+def serialize_stripped(serialized_model):
+    """
+    The model XML without diagram interchange (BPMNDI) elements, extension
+    elements, vendor attributes and indentation.
+    """
+    root = bpmn_model.parse(serialized_model.encode('utf-8'))
+
+    for parent in list(root.iter()):
+        for child in list(parent):
+            if is_stripped(child):
+                parent.remove(child)
+
+    for element in root.iter():
+        for attribute in list(element.attrib):
+            if attribute.startswith('{'):
+                del element.attrib[attribute]
+
+        if element.text is not None and element.text.strip() == '':
+            element.text = None
+
+        if element.tail is not None and element.tail.strip() == '':
+            element.tail = None
+
+    return etree.tostring(root, encoding='unicode')
+
+
+def get_label(element):
+    name = element.attrib.get('name')
+
+    if name is None:
+        return None
+
+    return ' '.join(name.split())
+
+
+def get_event_kind(element):
+    for child in element:
+        _, local_name = bpmn_model.split_tag(child)
+
+        if local_name is not None and local_name.endswith('EventDefinition'):
+            return local_name[:-len('EventDefinition')]
+
+    return None
+
+
+class CompactSerializer:
+    """
+    Text graph form of a model: pools, lanes, labelled nodes and flows, with
+    element ids replaced by short aliases.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.aliases = {}
+        self.lines = []
+
+    def alias(self, id):
+        if id not in self.aliases:
+            self.aliases[id] = f'n{len(self.aliases) + 1}'
+
+        return self.aliases[id]
+
+    def describe_node(self, element, local_name):
+        node_type = local_name
+
+        event_kind = get_event_kind(element)
+
+        if event_kind is not None:
+            node_type = f'{local_name}({event_kind})'
+
+        label = get_label(element)
+
+        description = f"{self.alias(element.attrib['id'])} {node_type}"
+
+        if label:
+            description += f' "{label}"'
+
+        return description
+
+    def serialize_container(self, container, depth):
+        indent = '  ' * depth
+
+        for element in container:
+            namespace, local_name = bpmn_model.split_tag(element)
+
+            if namespace != BPMN_NAMESPACE:
+                continue
+
+            if local_name == 'laneSet':
+                for lane in element.iter(f'{{{BPMN_NAMESPACE}}}lane'):
+                    refs = [self.alias(ref.text.strip()) for ref in lane.iter(
+                        f'{{{BPMN_NAMESPACE}}}flowNodeRef') if ref.text]
+
+                    self.lines.append(
+                        f'{indent}lane "{get_label(lane) or ""}": {", ".join(refs)}')
+
+            elif local_name in FLOW_NODE_TYPES:
+                description = self.describe_node(element, local_name)
+
+                attached_to = element.attrib.get('attachedToRef')
+
+                if attached_to is not None:
+                    description += f' on {self.alias(attached_to)}'
+
+                self.lines.append(f'{indent}{description}')
+
+                if local_name in SUBPROCESS_TYPES:
+                    self.serialize_container(element, depth + 1)
+
+            elif local_name == 'sequenceFlow':
+                self.lines.append(indent + self.describe_flow(element, '->'))
+
+    def describe_flow(self, element, arrow):
+        description = f"{self.alias(element.attrib['sourceRef'])} {arrow} {self.alias(element.attrib['targetRef'])}"
+
+        label = get_label(element)
+
+        if label:
+            description += f' "{label}"'
+
+        return description
+
+    def serialize(self):
+        processes = {process.attrib.get('id'): process for process in self.root.iter(
+            f'{{{BPMN_NAMESPACE}}}process')}
+
+        serialized_processes = set()
+
+        for participant in self.root.iter(f'{{{BPMN_NAMESPACE}}}participant'):
+            process_ref = participant.attrib.get('processRef')
+
+            self.lines.append(f'pool "{get_label(participant) or ""}"')
+
+            if process_ref in processes:
+                self.serialize_container(processes[process_ref], 1)
+                serialized_processes.add(process_ref)
+
+        for process_id, process in processes.items():
+            if process_id in serialized_processes:
+                continue
+
+            label = get_label(process)
+
+            self.lines.append(f'process "{label}"' if label else 'process')
+            self.serialize_container(process, 1)
+
+        for message_flow in self.root.iter(f'{{{BPMN_NAMESPACE}}}messageFlow'):
+            self.lines.append(
+                'message ' + self.describe_flow(message_flow, '~>'))
+
+        return '\n'.join(self.lines)
+
+
+def serialize_compact(serialized_model):
+    return CompactSerializer(bpmn_model.parse(serialized_model.encode('utf-8'))).serialize()
+
+
+SERIALIZERS = {
+    "raw": serialize_raw,
+    "stripped": serialize_stripped,
+    "compact": serialize_compact
+}
+
+
+def serialize(serialized_model, serialization):
+    if serialization not in SERIALIZERS:
+        raise Exception(f'Unknown serialization {serialization}.')
+
+    return SERIALIZERS[serialization](serialized_model)
@@ -0,0 +1,362 @@
+import sys
+import re
+import json
+import time
+import random
+import argparse
+import threading
+
+from email.parser import BytesParser
+from email.policy import default as default_policy
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai_models
+
+
+def estimate_tokens(text):
+    # Rough estimate, good enough for a stub
+    return max(1, len(text) // 4)
+
+
+PACKED_MODEL_PATTERN = re.compile(r'^### BEGIN (\S+)$', re.MULTILINE)
+
+
+def is_json_mode(request_body):
+    return (request_body.get('response_format') or {}).get('type') == 'json_object'
+
+
+def build_chat_completion(request_body):
+    chatgpt_model = request_body.get('model', 'stub')
+    messages = request_body.get('messages', [])
+
+    prompt = ''.join(message.get('content', '') for message in messages)
+
+    description = f"Stub description generated by {chatgpt_model} at temperature {request_body.get('temperature')}."
+
+    # Packed requests ask for a JSON object with one description per model
+    keys = PACKED_MODEL_PATTERN.findall(messages[-1].get('content', ''))
+
+    if len(keys) > 0:
+        description = json.dumps(
+            {key: f"{description} Model {key}." for key in keys})
+
+        # Without JSON mode models tend to fence the object
+        if not is_json_mode(request_body):
+            description = f"Here are the descriptions:\n```json\n{description}\n```"
+
+    prompt_tokens = estimate_tokens(prompt)
+    completion_tokens = estimate_tokens(description)
+
+    return {
+        "id": f"chatcmpl-stub-{time.time_ns()}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": chatgpt_model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": description
+                },
+                "finish_reason": "stop"
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    }
+
+
+def build_chat_completion_chunks(chat_completion):
+    """
+    Split a chat completion into the chunks of a streamed response, one per
+    word. Streamed chunks carry no usage.
+    """
+    chunk = {
+        "id": chat_completion['id'],
+        "object": "chat.completion.chunk",
+        "created": chat_completion['created'],
+        "model": chat_completion['model']
+    }
+
+    content = chat_completion['choices'][0]['message']['content']
+
+    yield {**chunk, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]}
+
+    for index, word in enumerate(content.split(' ')):
+        delta = word if index == 0 else ' ' + word
+
+        yield {**chunk, "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]}
+
+    yield {**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+
+
+def parse_multipart(content_type, body):
+    message = BytesParser(policy=default_policy).parsebytes(
+        f'Content-Type: {content_type}\r\n\r\n'.encode('utf-8') + body)
+
+    fields = {}
+
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+
+        fields[name] = part.get_payload(decode=True)
+
+    return fields
+
+
+def run_batch(input_content):
+    output_lines = []
+
+    for line in input_content.decode('utf-8').splitlines():
+        if not line.strip():
+            continue
+
+        batch_request = json.loads(line)
+
+        output_lines.append(json.dumps({
+            "id": f"batch_req_{time.time_ns()}",
+            "custom_id": batch_request['custom_id'],
+            "response": {
+                "status_code": 200,
+                "request_id": f"req_{time.time_ns()}",
+                "body": build_chat_completion(batch_request['body'])
+            },
+            "error": None
+        }))
+
+    return '\n'.join(output_lines).encode('utf-8'), len(output_lines)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Minimal stand-in for the OpenAI chat completions, files and batches
+    endpoints. Batches complete `batch_delay` seconds after being created.
+    The first chat completion requests are answered with the statuses of
+    `errors`, in order, before any random error.
+    """
+
+    latency = 0.0
+    chunk_latency = 0.0
+    error_rate = 0.0
+    errors = []
+    batch_delay = 2.0
+
+    files = {}
+    batches = {}
+    lock = threading.Lock()
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+
+        if length == 0:
+            return {}
+
+        return json.loads(self.rfile.read(length))
+
+    def do_GET(self):
+        path = self.path.rstrip('/')
+
+        if '/files/' in path and path.endswith('/content'):
+            file_id = path.split('/')[-2]
+
+            if file_id not in self.files:
+                self.send_json(404, {"error": {"message": "File not found."}})
+                return
+
+            body = self.files[file_id]
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/jsonl')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if '/batches/' in path:
+            batch_id = path.split('/')[-1]
+
+            if batch_id not in self.batches:
+                self.send_json(404, {"error": {"message": "Batch not found."}})
+                return
+
+            self.send_json(200, self.get_batch(batch_id))
+            return
+
+        self.send_json(404, {"error": {"message": "Not found."}})
+
+    def get_batch(self, batch_id):
+        with self.lock:
+            batch = self.batches[batch_id]
+
+            if batch['status'] == 'in_progress' and time.time() >= batch['ready_at']:
+                output, count = run_batch(self.files[batch['input_file_id']])
+
+                output_file_id = f"file-{time.time_ns()}"
+                self.files[output_file_id] = output
+
+                batch['status'] = 'completed'
+                batch['output_file_id'] = output_file_id
+                batch['request_counts']['completed'] = count
+
+            return {key: value for key, value in batch.items() if key != 'ready_at'}
+
+    def create_file(self):
+        length = int(self.headers.get('Content-Length', 0))
+        fields = parse_multipart(
+            self.headers['Content-Type'], self.rfile.read(length))
+
+        file_id = f"file-{time.time_ns()}"
+
+        with self.lock:
+            self.files[file_id] = fields['file']
+
+        self.send_json(200, {"id": file_id, "object": "file",
+                       "bytes": len(fields['file']), "purpose": fields['purpose'].decode('utf-8')})
+
+    def create_batch(self):
+        request_body = self.read_json()
+
+        input_file_id = request_body['input_file_id']
+
+        if input_file_id not in self.files:
+            self.send_json(404, {"error": {"message": "File not found."}})
+            return
+
+        batch_id = f"batch_{time.time_ns()}"
+        total = len(
+            [line for line in self.files[input_file_id].splitlines() if line.strip()])
+
+        with self.lock:
+            self.batches[batch_id] = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": request_body['endpoint'],
+                "input_file_id": input_file_id,
+                "completion_window": request_body['completion_window'],
+                "status": "in_progress",
+                "output_file_id": None,
+                "error_file_id": None,
+                "request_counts": {"total": total, "completed": 0, "failed": 0},
+                "ready_at": time.time() + self.batch_delay
+            }
+
+        self.send_json(200, self.get_batch(batch_id))
+
+    def do_POST(self):
+        path = self.path.rstrip('/')
+
+        if path.endswith('/files'):
+            self.create_file()
+            return
+
+        if path.endswith('/batches'):
+            self.create_batch()
+            return
+
+        if not path.endswith('/chat/completions'):
+            self.send_json(404, {"error": {"message": "Not found."}})
+            return
+
+        request_body = self.read_json()
+
+        time.sleep(self.latency)
+
+        # Like the API, models without JSON mode reject the parameter
+        if is_json_mode(request_body) and not openai_models.supports_json_mode(request_body.get('model')):
+            self.send_json(400, {"error": {"message": "Invalid parameter: 'response_format' of type 'json_object' is not supported with this model.",
+                           "type": "invalid_request_error", "param": "response_format"}})
+            return
+
+        with self.lock:
+            status = self.errors.pop(0) if self.errors else None
+
+        if status is None and random.random() < self.error_rate:
+            status = random.choice([429, 500, 503])
+
+        if status is not None:
+            self.send_json(
+                status, {"error": {"message": f"Injected stub error {status}."}})
+            return
+
+        if request_body.get('stream'):
+            self.send_stream(build_chat_completion(request_body))
+            return
+
+        self.send_json(200, build_chat_completion(request_body))
+
+    def send_stream(self, chat_completion):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        for chunk in build_chat_completion_chunks(chat_completion):
+            self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+            self.wfile.flush()
+
+            time.sleep(self.chunk_latency)
+
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.wfile.flush()
+
+        # Without a Content-Length the client reads until the connection closes
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Local stub server for the OpenAI chat completions and batch APIs. Point generate.py at it with --api-base http://127.0.0.1:8000/v1')
+
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.5,
+                        help='Seconds to wait before answering each request')
+    parser.add_argument('--chunk-latency', type=float, default=0.02,
+                        help='Seconds between the chunks of a streamed response')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests answered with a 429 or 5xx error')
+    parser.add_argument('--errors', default='',
+                        help='Comma-separated statuses answered, in order, to the first chat completion requests, e.g. 429,500')
+    parser.add_argument('--batch-delay', type=float, default=2.0,
+                        help='Seconds until a submitted batch completes')
+
+    args = parser.parse_args()
+
+    StubHandler.latency = args.latency
+    StubHandler.chunk_latency = args.chunk_latency
+    StubHandler.error_rate = args.error_rate
+    StubHandler.errors = [int(status)
+                          for status in args.errors.split(',') if status]
+    StubHandler.batch_delay = args.batch_delay
+
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+
+    print(
+        f"Stub server listening on http://{args.host}:{args.port}/v1 (latency={args.latency}s)")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
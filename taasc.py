@@ -1,17 +1,46 @@
-import sys
 import re
-import json
 import os
 import csv
+import argparse
+import hashlib
 
+from nltk.tag import pos_tag
+from nltk.tokenize import sent_tokenize, word_tokenize
 
-def process_taasc_results(results_dir):
-    print("Processing TAASC results in directory: " + results_dir)
+import evaluate
+import results_store
+
+# Bump whenever the native measures or how they are computed change, so
+# incremental runs re-analyze every description
+TAASC_SCHEMA_VERSION = 2
+
+# Window of the moving-average type/token ratio
+MATTR_WINDOW = 50
+
+FINITE_VERB_TAGS = set(['VBD', 'VBZ', 'VBP', 'MD'])
+VERB_TAGS = FINITE_VERB_TAGS | set(['VB', 'VBG', 'VBN'])
+ADVERB_TAGS = set(['RB', 'RBR', 'RBS'])
+NOUN_TAGS = set(['NN', 'NNS', 'NNP', 'NNPS'])
+ADJECTIVE_TAGS = set(['JJ', 'JJR', 'JJS'])
+WH_TAGS = set(['WDT', 'WP', 'WP$', 'WRB'])
+NOMINAL_TAGS = NOUN_TAGS | ADJECTIVE_TAGS | set(['DT', 'PRP$', 'POS', 'CD'])
+
+SUBORDINATORS = set([
+    'because', 'if', 'when', 'while', 'although', 'though', 'after', 'before',
+    'since', 'unless', 'until', 'whereas', 'once', 'whether', 'that'
+])
 
-    # Read the taasc results csv
-    base_path = os.path.join(results_dir, 'descriptions')
-    csv_path = os.path.join(base_path, 'taasc_results.csv')
 
+def get_uid_from_filename(filename):
+    return filename.split('.')[0].split('_')[1]
+
+
+def get_uid_from_path(filename):
+    # UID Regex: C:\Users\Fernando\AppData\Local\Temp\_MEI13~1\sca_parsed_files\desc_0202680c.txt
+    return re.search(r'desc_(\w+)\.txt', filename).group(1)
+
+
+def read_taasc_csv(csv_path, get_uid):
     if not os.path.exists(csv_path):
         raise Exception('TAASC results csv does not exist.')
 
@@ -21,8 +50,7 @@ def process_taasc_results(results_dir):
         reader = csv.DictReader(f)
 
         for row in reader:
-            filename = row['filename']
-            testcase_uid = filename.split('.')[0].split('_')[1]
+            testcase_uid = get_uid(row['filename'])
 
             if testcase_uid not in results_dict:
                 results_dict[testcase_uid] = {}
@@ -32,94 +60,327 @@ def process_taasc_results(results_dir):
                 if key != 'filename':
                     results_dict[testcase_uid][key] = float(row[key])
 
-            # Save the results in the testcase folder
-            testcase_path = os.path.join(results_dir, testcase_uid)
-            testcase_json_path = os.path.join(
-                testcase_path, 'taasc_results.json')
+    return results_dict
 
-            with open(testcase_json_path, 'w') as f:
-                serialized_json = json.dumps(
-                    results_dict[testcase_uid], indent=4)
-                f.write(serialized_json)
 
-    csv_path = os.path.join(base_path, 'taasc_results_sca.csv')
+def import_taasc_results(results_dir):
+    """
+    Ingest the CSVs the external TAASC tool wrote next to the exported
+    descriptions.
+    """
+    print("Processing TAASC results in directory: " + results_dir)
 
-    if not os.path.exists(csv_path):
-        raise Exception('TAASC results csv does not exist.')
+    store = results_store.ResultsStore.open_existing(results_dir)
 
-    sca_results_dict = {}
+    # Read the taasc results csvs written next to the exported descriptions
+    base_path = os.path.join(results_dir, 'descriptions')
 
-    with open(csv_path, 'r') as f:
-        reader = csv.DictReader(f)
+    csv_files = [
+        ('taasc', 'taasc_results.csv', get_uid_from_filename),
+        ('taasc_sca', 'taasc_results_sca.csv', get_uid_from_path),
+        ('taasc_components', 'taasc_results_components.csv', get_uid_from_path)
+    ]
 
-        for row in reader:
-            filename = row['filename']
+    for stage, csv_filename, get_uid in csv_files:
+        results_dict = read_taasc_csv(
+            os.path.join(base_path, csv_filename), get_uid)
 
-            # UID Regex: C:\Users\Fernando\AppData\Local\Temp\_MEI13~1\sca_parsed_files\desc_0202680c.txt
-            testcase_uid = re.search(r'desc_(\w+)\.txt', filename).group(1)
+        # Save the results of every testcase at once
+        store.put_records(stage, results_dict)
 
-            if testcase_uid not in sca_results_dict:
-                sca_results_dict[testcase_uid] = {}
+        print(f"Stored {len(results_dict)} {stage} results")
 
-            # put all other keys
-            for key in row.keys():
-                if key != 'filename':
-                    sca_results_dict[testcase_uid][key] = float(row[key])
+    store.close()
 
-            # Save the results in the testcase folder
-            testcase_path = os.path.join(results_dir, testcase_uid)
-            testcase_json_path = os.path.join(
-                testcase_path, 'taasc_results_sca.json')
 
-            with open(testcase_json_path, 'w') as f:
-                serialized_json = json.dumps(
-                    sca_results_dict[testcase_uid], indent=4)
-                f.write(serialized_json)
+def get_tag_class(tag):
+    for tag_class, tags in [('noun', NOUN_TAGS), ('adjective', ADJECTIVE_TAGS), ('adverb', ADVERB_TAGS), ('verb', VERB_TAGS)]:
+        if tag in tags:
+            return tag_class
 
-    csv_path = os.path.join(base_path, 'taasc_results_components.csv')
+    return None
 
-    if not os.path.exists(csv_path):
-        raise Exception('TAASC results csv does not exist.')
 
-    components_results_dict = {}
+def count_sentence_units(tagged):
+    """
+    Approximate the syntactic units of a POS tagged sentence: verb phrases,
+    clauses (finite verb groups), dependent clauses (clauses opened by a
+    subordinator or wh-word), coordinate phrases and complex nominals.
+    """
+    verb_phrases = 0
+    clauses = 0
+    dependent_clauses = 0
+    coordinate_phrases = 0
+    complex_nominals = 0
 
-    with open(csv_path, 'r') as f:
-        reader = csv.DictReader(f)
+    in_verb_group = False
+    finite_group = False
+    pending_subordinator = False
 
-        for row in reader:
-            filename = row['filename']
+    # A conjunction not followed by a subject yet, and whether it was
+    # already counted as coordinating two words of the same class
+    after_conjunction = False
+    conjunction_counted = False
 
-            # UID Regex: C:\Users\Fernando\AppData\Local\Temp\_MEI13~1\sca_parsed_files\desc_0202680c.txt
-            testcase_uid = re.search(r'desc_(\w+)\.txt', filename).group(1)
+    nominal = []
 
-            if testcase_uid not in components_results_dict:
-                components_results_dict[testcase_uid] = {}
+    for index, (word, tag) in enumerate(tagged):
+        if tag in VERB_TAGS:
+            if not in_verb_group:
+                verb_phrases += 1
+                in_verb_group = True
+                finite_group = False
 
-            # put all other keys
-            for key in row.keys():
-                if key != 'filename':
-                    components_results_dict[testcase_uid][key] = float(
-                        row[key])
+            if tag in FINITE_VERB_TAGS and not finite_group:
+                finite_group = True
+
+                # "checks and approves the order" or "checks the order and
+                # then approves it" coordinate two predicates of one clause
+                if after_conjunction and clauses > 0:
+                    if not conjunction_counted:
+                        coordinate_phrases += 1
+                else:
+                    clauses += 1
+
+                    if pending_subordinator:
+                        dependent_clauses += 1
+                        pending_subordinator = False
+
+                after_conjunction = False
+        elif tag in ADVERB_TAGS and in_verb_group:
+            # "is not approved" stays one verb group
+            pass
+        else:
+            in_verb_group = False
+
+            if tag in WH_TAGS or (tag == 'IN' and word.lower() in SUBORDINATORS):
+                pending_subordinator = True
+
+            # "and then approves" still coordinates predicates
+            if tag not in ADVERB_TAGS:
+                after_conjunction = False
+
+        if tag == 'CC':
+            after_conjunction = True
+            conjunction_counted = False
+
+            if 0 < index < len(tagged) - 1:
+                previous_class = get_tag_class(tagged[index - 1][1])
+
+                if previous_class is not None and previous_class == get_tag_class(tagged[index + 1][1]):
+                    coordinate_phrases += 1
+                    conjunction_counted = True
+
+        if tag in NOMINAL_TAGS:
+            nominal.append(tag)
+            continue
+
+        if is_complex_nominal(nominal, tag):
+            complex_nominals += 1
+
+        nominal = []
+
+    if is_complex_nominal(nominal, None):
+        complex_nominals += 1
+
+    return verb_phrases, clauses, dependent_clauses, coordinate_phrases, complex_nominals
 
-            # Save the results in the testcase folder
-            testcase_path = os.path.join(results_dir, testcase_uid)
-            testcase_json_path = os.path.join(
-                testcase_path, 'taasc_results_components.json')
 
-            with open(testcase_json_path, 'w') as f:
-                serialized_json = json.dumps(
-                    components_results_dict[testcase_uid], indent=4)
-                f.write(serialized_json)
+def is_complex_nominal(nominal, next_tag):
+    """
+    A noun phrase is complex when its head noun has an adjective, possessive
+    or noun modifier, or is followed by a prepositional phrase.
+    """
+    if len(nominal) == 0 or nominal[-1] not in NOUN_TAGS:
+        return False
+
+    nouns = len([tag for tag in nominal if tag in NOUN_TAGS])
+    modified = any(
+        tag in ADJECTIVE_TAGS or tag == 'POS' for tag in nominal) or nouns > 1
+
+    return modified or next_tag == 'IN'
+
+
+def ratio(numerator, denominator):
+    return numerator / denominator if denominator > 0 else 0.0
+
+
+def get_mattr(words, window=MATTR_WINDOW):
+    if len(words) == 0:
+        return 0.0
+
+    if len(words) <= window:
+        return len(set(words)) / len(words)
+
+    ratios = [len(set(words[start:start + window])) /
+              window for start in range(len(words) - window + 1)]
+
+    return sum(ratios) / len(ratios)
+
+
+def analyze_description(item):
+    """
+    Syntactic complexity measures with the keys of the TAASC SCA output, and
+    simple lexical measures of our own, of one description.
+    """
+    uid, description, input_hash = item
+
+    words_count = 0
+    sentences_count = 0
+    verb_phrases = 0
+    clauses = 0
+    dependent_clauses = 0
+    t_units = 0
+    complex_t_units = 0
+    coordinate_phrases = 0
+    complex_nominals = 0
+
+    lexical_words = []
+    content_words = 0
+
+    for sentence in sent_tokenize(description):
+        tagged = pos_tag(word_tokenize(sentence))
+        tagged_words = [(word, tag)
+                        for word, tag in tagged if any(c.isalnum() for c in word)]
+
+        if len(tagged_words) == 0:
+            continue
+
+        sentences_count += 1
+        words_count += len(tagged_words)
+
+        sentence_verb_phrases, sentence_clauses, sentence_dependent_clauses, sentence_coordinate_phrases, sentence_complex_nominals = count_sentence_units(
+            tagged)
+
+        # A T-unit is a main clause with its dependents, fragments count as one
+        sentence_t_units = max(1, sentence_clauses -
+                               sentence_dependent_clauses)
+
+        verb_phrases += sentence_verb_phrases
+        clauses += sentence_clauses
+        dependent_clauses += sentence_dependent_clauses
+        t_units += sentence_t_units
+        complex_t_units += min(sentence_t_units, sentence_dependent_clauses)
+        coordinate_phrases += sentence_coordinate_phrases
+        complex_nominals += sentence_complex_nominals
+
+        for word, tag in tagged_words:
+            lexical_words.append(word.lower())
+
+            if get_tag_class(tag) is not None and tag != 'MD':
+                content_words += 1
+
+    sca = {
+        'MLS': ratio(words_count, sentences_count),
+        'MLT': ratio(words_count, t_units),
+        'MLC': ratio(words_count, clauses),
+        'C_S': ratio(clauses, sentences_count),
+        'VP_T': ratio(verb_phrases, t_units),
+        'C_T': ratio(clauses, t_units),
+        'DC_C': ratio(dependent_clauses, clauses),
+        'DC_T': ratio(dependent_clauses, t_units),
+        'T_S': ratio(t_units, sentences_count),
+        'CT_T': ratio(complex_t_units, t_units),
+        'CP_T': ratio(coordinate_phrases, t_units),
+        'CP_C': ratio(coordinate_phrases, clauses),
+        'CN_T': ratio(complex_nominals, t_units),
+        'CN_C': ratio(complex_nominals, clauses),
+        'input_hash': input_hash,
+        'taasc_schema_version': TAASC_SCHEMA_VERSION
+    }
+
+    lexical = {
+        'lexical_density': ratio(content_words, len(lexical_words)),
+        'mean_word_length': ratio(sum(len(word) for word in lexical_words), len(lexical_words)),
+        'long_words_ratio': ratio(len([word for word in lexical_words if len(word) >= 7]), len(lexical_words)),
+        'mattr': get_mattr(lexical_words)
+    }
+
+    return uid, sca, lexical
+
+
+def load_taasc_resources(nltk_data_dir=None):
+    evaluate.load_nltk_resources(nltk_data_dir)
+
+    try:
+        pos_tag(['Load', 'the', 'tagger'])
+    except LookupError:
+        raise Exception(
+            'NLTK POS tagger not found. Download it once with `python -m nltk.downloader -d <dir> averaged_perceptron_tagger averaged_perceptron_tagger_eng` and pass --nltk-data <dir>.')
+
+
+def get_input_hash(description):
+    return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+
+def iter_descriptions(store):
+    # Read the descriptions up front, measures are written while iterating
+    generation_results = list(store.iter_records('generation_result'))
+
+    for uid, generation_result in generation_results:
+        description = generation_result['generated_description']
+        input_hash = get_input_hash(description)
+
+        yield uid, input_hash, (uid, description, input_hash)
+
+
+def remove_native_taasc_records(store):
+    # Before schema version 2 the lexical measures were stored as the taasc
+    # record, where they would pass for the output of the TAASC tool
+    native = [uid for uid, record in store.iter_records(
+        'taasc') if 'mattr' in record]
+
+    store.delete_records('taasc', native)
+
+
+def analyze_descriptions(results_dir, workers=1, nltk_data_dir=None, force=False):
+    """
+    Compute the TAASC SCA measures of every generated description in
+    process, storing them as the taasc_sca record of each testcase. The
+    lexical measures are not TAASC's and go to the lexical record, the
+    taasc and taasc_components records only come from --import-csv.
+    Unchanged descriptions are skipped.
+    """
+    load_taasc_resources(nltk_data_dir)
+
+    store = results_store.ResultsStore.open_existing(results_dir)
+
+    remove_native_taasc_records(store)
+
+    skipped = {'count': 0}
+    items = results_store.iter_stale_items(store, 'taasc_sca', 'taasc_schema_version', TAASC_SCHEMA_VERSION,
+                                           iter_descriptions(store), skipped, force)
+
+    analyzed = results_store.compute_records(store, ['taasc_sca', 'lexical'], analyze_description, items, workers,
+                                             load_taasc_resources, (nltk_data_dir,), chunksize=32)
+
+    print(
+        f"Analyzed {analyzed} descriptions, skipped {skipped['count']} unchanged ones in {store.path}")
+
+    store.close()
 
 
 def main():
-    print('Pre-processing phase of the experiment.')
+    print('TAASC phase of the experiment.')
 
-    if len(sys.argv) < 2:
-        raise Exception('Results directory not specified.')
+    parser = argparse.ArgumentParser(
+        description='Compute TAASC syntactic complexity measures of the generated descriptions.')
+
+    parser.add_argument('results_dir', nargs='?',
+                        help='Results directory of a dataset, e.g. results/covid19')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes, 0 uses every core')
+    parser.add_argument('--nltk-data', default=None,
+                        help='Local directory with the NLTK punkt tokenizer and POS tagger')
+    parser.add_argument('--force', action='store_true',
+                        help='Re-analyze every description, even unchanged ones')
+    parser.add_argument('--import-csv', action='store_true',
+                        help='Ingest the CSVs of the external TAASC tool from descriptions/ instead')
+
+    args = parser.parse_args()
 
     # Get dataset dir from command line
-    dataset_dir = sys.argv[1]
+    dataset_dir = args.results_dir
 
     if dataset_dir is None:
         raise Exception('Results directory not specified.')
@@ -127,7 +388,13 @@ def main():
     if not os.path.exists(dataset_dir):
         raise Exception('Results directory does not exist.')
 
-    process_taasc_results(dataset_dir)
+    if args.import_csv:
+        import_taasc_results(dataset_dir)
+        return
+
+    workers = args.workers or os.cpu_count()
+
+    analyze_descriptions(dataset_dir, workers, args.nltk_data, args.force)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,54 @@
+import os
+import json
+
+import pytest
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+@pytest.fixture
+def generate():
+    pytest.importorskip('dotenv')
+    pytest.importorskip('openai')
+
+    import generate
+
+    return generate
+
+
+@pytest.fixture
+def metadata(tmp_path):
+    with open(os.path.join(FIXTURES_DIR, 'metrics.bpmn'), 'r') as fp:
+        serialized_model = fp.read()
+
+    dataset_dir = tmp_path / 'datasets' / 'shared_ids'
+
+    # Two different models exported with the same default id, and a third one
+    for dir, model_id, source_hash in [('m1', 'Definitions_1', 'a' * 64),
+                                       ('m2', 'Definitions_1', 'b' * 64),
+                                       ('m3', 'Process_3', 'c' * 64)]:
+        model_dir = dataset_dir / dir
+        model_dir.mkdir(parents=True)
+
+        (model_dir / 'annotated_model.json').write_text(json.dumps({
+            "model_id": model_id,
+            "dir": str(model_dir),
+            "source_hash": source_hash,
+            "serialized_model": serialized_model,
+            "tokens_count": 1000,
+            "supported_chatgpt_models": ['gpt-4', 'gpt-3.5-turbo-1106']
+        }))
+
+    prompts_dir = tmp_path / 'prompts'
+    prompts_dir.mkdir()
+
+    (prompts_dir / 'describe.txt').write_text('Describe the process.')
+    (prompts_dir / 'summarize.txt').write_text('Summarize the process.')
+
+    return {
+        "chatgpt_models": ['gpt-4', 'gpt-3.5-turbo-1106'],
+        "temperatures": [0, 1],
+        "annotated_dataset_dir": str(dataset_dir),
+        "prompts_dir": str(prompts_dir),
+        "serializations": ['raw', 'compact']
+    }
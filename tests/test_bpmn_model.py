@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+import bpmn_model
+
+FIXTURE_PATH = os.path.join(os.path.dirname(
+    __file__), 'fixtures', 'metrics.bpmn')
+
+# Computed with bpmn_python 0.0.18 over the fixture, the way earlier
+# annotations were
+EXPECTED_METRICS = {
+    "model_id": "Definitions_metrics",
+    "activities_count": 4,
+    "events_count": 5,
+    "gateways_count": 2,
+    "type_activities_count": {"task": 3, "subProcess": 1},
+    "type_events_count": {"startEvent": 2, "endEvent": 2, "intermediateCatchEvent": 0, "intermediateThrowEvent": 1},
+    "type_gateways_count": {"inclusiveGateway": 0, "exclusiveGateway": 2, "parallelGateway": 0, "eventBasedGateway": 0, "complexGateway": 0},
+    "cnc": 0.9375,
+    "durfee": 2,
+    "nodes_count": 11,
+    "sequence_flows_count": 7,
+    "pools_count": 2,
+    "lanes_count": 2
+}
+
+
+def read_fixture():
+    with open(FIXTURE_PATH, 'rb') as f:
+        return f.read()
+
+
+def test_compute_metrics_matches_bpmn_python_values():
+    assert bpmn_model.compute_metrics(
+        bpmn_model.parse(read_fixture())) == EXPECTED_METRICS
+
+
+def test_compute_metrics_matches_bpmn_python():
+    metrics = pytest.importorskip('bpmn_python.bpmn_diagram_metrics')
+    diagram = pytest.importorskip('bpmn_python.bpmn_diagram_rep')
+
+    bpmn_graph = diagram.BpmnDiagramGraph()
+    bpmn_graph.load_diagram_from_xml_file(FIXTURE_PATH)
+
+    model_metrics = bpmn_model.compute_metrics(
+        bpmn_model.parse(read_fixture()))
+
+    assert model_metrics['activities_count'] == metrics.all_activities_count(
+        bpmn_graph)
+    assert model_metrics['events_count'] == metrics.all_events_count(
+        bpmn_graph)
+    assert model_metrics['gateways_count'] == metrics.all_gateways_count(
+        bpmn_graph)
+    assert model_metrics['type_activities_count'] == metrics.get_activities_counts(
+        bpmn_graph)
+    assert model_metrics['type_events_count'] == metrics.get_events_counts(
+        bpmn_graph)
+    assert model_metrics['type_gateways_count'] == metrics.get_gateway_counts(
+        bpmn_graph)
+    assert model_metrics['cnc'] == metrics.CoefficientOfNetworkComplexity_metric(
+        bpmn_graph)
+    assert model_metrics['durfee'] == metrics.DurfeeSquare_metric(bpmn_graph)
+    assert model_metrics['sequence_flows_count'] == metrics.all_control_flow_elements_count(
+        bpmn_graph)
+
+
+def test_durfee_square():
+    assert bpmn_model.get_durfee_square({}) == 0
+    assert bpmn_model.get_durfee_square({'task': 1}) == 1
+    assert bpmn_model.get_durfee_square(
+        {'task': 5, 'startEvent': 3, 'endEvent': 2, 'exclusiveGateway': 1}) == 2
@@ -0,0 +1,143 @@
+import os
+import sys
+import json
+import threading
+
+import pytest
+
+from http.server import ThreadingHTTPServer
+
+import results_store
+import stub_server
+
+TESTCASES_COUNT = 48
+
+
+@pytest.fixture
+def api_base(monkeypatch):
+    """
+    Serve stub_server on an ephemeral port for the duration of a test.
+    """
+    monkeypatch.setattr(stub_server.StubHandler, 'latency', 0.0)
+    monkeypatch.setattr(stub_server.StubHandler, 'error_rate', 0.0)
+    monkeypatch.setattr(stub_server.StubHandler, 'errors', [])
+    monkeypatch.setattr(stub_server.StubHandler, 'batch_delay', 0.2)
+    monkeypatch.setattr(stub_server.StubHandler, 'files', {})
+    monkeypatch.setattr(stub_server.StubHandler, 'batches', {})
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), stub_server.StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield f'http://127.0.0.1:{server.server_address[1]}/v1'
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def run_generate(generate, metadata, api_base, tmp_path, monkeypatch):
+    import openai
+
+    # main points the openai module at the stub, restore it afterwards
+    monkeypatch.setattr(openai, 'api_base', openai.api_base)
+    monkeypatch.setattr(openai, 'api_key', 'sk-stub')
+    monkeypatch.chdir(tmp_path)
+
+    def run(*args, retry=None):
+        parameters = {**metadata, "retry": {"base_delay": 0.01,
+                                            "max_delay": 0.05, "timeout": 10.0, **(retry or {})}}
+
+        parameters_path = tmp_path / 'parameters.json'
+        parameters_path.write_text(json.dumps(parameters))
+
+        monkeypatch.setattr(sys, 'argv', [
+                            'generate.py', str(parameters_path), '--no-cache', '--api-base', api_base, *args])
+
+        generate.main()
+
+        return os.path.join('results', 'shared_ids')
+
+    return run
+
+
+def get_generation_results(results_dir):
+    store = results_store.ResultsStore.open_existing(results_dir)
+
+    try:
+        return dict(store.iter_records('generation_result'))
+    finally:
+        store.close()
+
+
+def read_dead_letters(results_dir):
+    dead_letter_path = os.path.join(results_dir, 'dead_letter.jsonl')
+
+    if not os.path.exists(dead_letter_path):
+        return []
+
+    with open(dead_letter_path, 'r') as fp:
+        return [json.loads(line) for line in fp if line.strip()]
+
+
+def test_concurrent_mode_stores_one_result_per_testcase(run_generate):
+    results_dir = run_generate('--concurrency', '4')
+
+    assert len(get_generation_results(results_dir)) == TESTCASES_COUNT
+    assert read_dead_letters(results_dir) == []
+
+
+def test_concurrent_mode_retries_transient_errors(run_generate):
+    stub_server.StubHandler.errors = [429, 500, 503]
+
+    results_dir = run_generate('--concurrency', '4')
+
+    assert stub_server.StubHandler.errors == []
+    assert len(get_generation_results(results_dir)) == TESTCASES_COUNT
+    assert read_dead_letters(results_dir) == []
+
+
+def test_exhausted_retries_are_dead_lettered(run_generate):
+    stub_server.StubHandler.errors = [500, 429]
+
+    results_dir = run_generate(retry={"max_attempts": 2})
+
+    dead_letters = read_dead_letters(results_dir)
+
+    assert len(dead_letters) == 1
+    assert len(get_generation_results(results_dir)) == TESTCASES_COUNT - 1
+    assert dead_letters[0]['testcase_hash'] not in get_generation_results(
+        results_dir)
+
+
+def test_batch_mode_submits_polls_and_ingests_results(run_generate):
+    results_dir = run_generate('--batch', '--batch-poll-interval', '0.05')
+
+    [submitted] = stub_server.StubHandler.batches.values()
+
+    assert submitted['status'] == 'completed'
+    assert submitted['request_counts']['completed'] == TESTCASES_COUNT
+    assert len(get_generation_results(results_dir)) == TESTCASES_COUNT
+    assert not os.path.exists(os.path.join(results_dir, 'batch_state.json'))
+
+
+def test_resumed_batch_run_submits_the_testcases_left_out(run_generate, monkeypatch):
+    import batch
+
+    def interrupt(batch_id, poll_interval):
+        raise KeyboardInterrupt
+
+    # The first run submits the gpt-4 testcases and stops before polling
+    with monkeypatch.context() as patch:
+        patch.setattr(batch, 'wait_for_batch', interrupt)
+
+        with pytest.raises(KeyboardInterrupt):
+            run_generate('--batch', '--chatgpt-model', 'gpt-4')
+
+    results_dir = run_generate('--batch', '--batch-poll-interval', '0.05')
+
+    submitted = sorted(entry['request_counts']['total']
+                       for entry in stub_server.StubHandler.batches.values())
+
+    assert submitted == [TESTCASES_COUNT // 2, TESTCASES_COUNT // 2]
+    assert len(get_generation_results(results_dir)) == TESTCASES_COUNT
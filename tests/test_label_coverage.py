@@ -0,0 +1,25 @@
+import label_coverage
+
+
+ELEMENTS = (('t1', 'activity', 'Approve order'),
+            ('t2', 'activity', 'Ship goods to customer'),
+            ('e1', 'event', 'Order received'))
+
+
+def test_stemmed_labels_match_inflected_mentions():
+    hits = label_coverage.LabelIndex(ELEMENTS).match(
+        'Once the order is received, the clerk approves the order.')
+
+    matches = {hit['id']: hit['match'] for hit in hits}
+
+    assert matches == {'t1': 'exact', 't2': None, 'e1': 'exact'}
+    assert label_coverage.get_recall(hits, 'activity') == 0.5
+    assert label_coverage.get_recall(hits, 'gateway') is None
+
+
+def test_partial_mentions_are_fuzzy_hits():
+    hits = label_coverage.LabelIndex(ELEMENTS).match(
+        'The goods are sent to the customer.')
+
+    assert hits[1]['match'] == 'fuzzy'
+    assert hits[1]['score'] == 2 / 3
@@ -0,0 +1,64 @@
+import manifest
+
+
+def make_testcase(model, **parameters):
+    testcase = {
+        "model": model,
+        "model_id": model['model_id'],
+        "prompt_name": 'describe.txt',
+        "prompt_data": 'Describe the process.',
+        "temperature": 0,
+        "chatgpt_model": 'gpt-4',
+        "serialization": 'raw'
+    }
+
+    testcase.update(parameters)
+
+    return testcase
+
+
+def test_models_sharing_a_model_id_get_different_hashes():
+    first = {"model_id": 'Definitions_1', "source_hash": 'a' * 64}
+    second = {"model_id": 'Definitions_1', "source_hash": 'b' * 64}
+
+    assert manifest.testcase_hash(make_testcase(first), 0) != \
+        manifest.testcase_hash(make_testcase(second), 0)
+
+
+def get_hashes(generate, metadata, seed=123):
+    return [manifest.testcase_hash(testcase, seed) for testcase in generate.iter_testcases(metadata)]
+
+
+def test_hashes_are_stable_and_unique(generate, metadata):
+    hashes = get_hashes(generate, metadata)
+
+    # 3 models x 2 serializations x 2 prompts x 2 temperatures x 2 chatgpt_models
+    assert len(hashes) == 48
+    assert len(set(hashes)) == len(hashes)
+    assert get_hashes(generate, metadata) == hashes
+    assert set(get_hashes(generate, metadata, seed=7)).isdisjoint(hashes)
+
+
+def test_second_run_skips_exactly_the_manifest_entries(generate, metadata, tmp_path):
+    manifest_path = str(tmp_path / 'manifest.jsonl')
+    seed = 123
+
+    skipped = {'count': 0}
+    first_run = list(generate.iter_pending_testcases(generate.iter_testcases(
+        metadata), seed, manifest.read_completed_hashes(manifest_path), skipped))
+
+    assert skipped['count'] == 0
+
+    # The first run completes every other testcase before being interrupted
+    completed = first_run[::2]
+
+    for testcase in completed:
+        manifest.record_completed(manifest_path, testcase, seed)
+
+    skipped = {'count': 0}
+    second_run = list(generate.iter_pending_testcases(generate.iter_testcases(
+        metadata), seed, manifest.read_completed_hashes(manifest_path), skipped))
+
+    assert skipped['count'] == len(completed)
+    assert [testcase['testcase_hash'] for testcase in second_run] == \
+        [testcase['testcase_hash'] for testcase in first_run[1::2]]
@@ -0,0 +1,24 @@
+import pytest
+
+pytest.importorskip('tiktoken')
+
+import packing  # noqa: E402
+
+
+def test_json_mode_is_only_requested_from_models_supporting_it():
+    assert packing.get_response_format(
+        'gpt-3.5-turbo-1106') == packing.RESPONSE_FORMAT
+    assert packing.get_response_format('gpt-4') is None
+    assert packing.get_response_format('gpt-3-32k') is None
+
+
+def test_fenced_pack_responses_are_parsed():
+    description = 'Here are the descriptions:\n```json\n{"model_1": "First.", "model_2": "Second."}\n```'
+
+    assert packing.parse_pack_response(description) == {
+        "model_1": 'First.', "model_2": 'Second.'}
+
+
+def test_pack_responses_without_an_object_are_rejected():
+    with pytest.raises(packing.PackingError):
+        packing.parse_pack_response('I cannot describe these models.')
@@ -0,0 +1,47 @@
+import pytest
+
+pytest.importorskip('nltk')
+
+import taasc  # noqa: E402
+
+
+def tag(sentence):
+    return [tuple(token.rsplit('/', 1)) for token in sentence.split()]
+
+
+def test_coordinated_verbs_are_one_clause_and_one_coordinate_phrase():
+    tagged = tag('The/DT clerk/NN checks/VBZ and/CC approves/VBZ the/DT order/NN ./.')
+
+    verb_phrases, clauses, dependent_clauses, coordinate_phrases, _ = taasc.count_sentence_units(
+        tagged)
+
+    assert verb_phrases == 2
+    assert clauses == 1
+    assert dependent_clauses == 0
+    assert coordinate_phrases == 1
+
+
+def test_coordinated_predicates_are_one_clause():
+    for sentence in ['The/DT clerk/NN checks/VBZ the/DT order/NN and/CC approves/VBZ it/PRP ./.',
+                     'The/DT clerk/NN checks/VBZ the/DT order/NN and/CC then/RB approves/VBZ it/PRP ./.']:
+        _, clauses, _, coordinate_phrases, _ = taasc.count_sentence_units(
+            tag(sentence))
+
+        assert clauses == 1
+        assert coordinate_phrases == 1
+
+
+def test_coordinated_clauses_are_two_clauses():
+    _, clauses, _, coordinate_phrases, _ = taasc.count_sentence_units(tag(
+        'The/DT clerk/NN checks/VBZ the/DT order/NN and/CC the/DT manager/NN approves/VBZ it/PRP ./.'))
+
+    assert clauses == 2
+    assert coordinate_phrases == 0
+
+
+def test_dependent_clause():
+    _, clauses, dependent_clauses, _, _ = taasc.count_sentence_units(tag(
+        'If/IN the/DT order/NN is/VBZ valid/JJ ,/, the/DT clerk/NN approves/VBZ it/PRP ./.'))
+
+    assert clauses == 2
+    assert dependent_clauses == 1
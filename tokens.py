@@ -1,30 +1,84 @@
-from transformers import GPT2Tokenizer
 import sys
+import functools
+
+import tiktoken
+
+# Encoding used for chatgpt_models tiktoken does not know about, shared by
+# every gpt-4 and gpt-3.5 model we price
+DEFAULT_ENCODING = 'cl100k_base'
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(chatgpt_model=None):
+    """
+    Load the BPE encoding for a chatgpt_model once per process.
+    """
+    if chatgpt_model is None:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+    try:
+        return tiktoken.encoding_for_model(chatgpt_model)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+def encode(text: str, chatgpt_model: str = None) -> list:
+    return get_encoding(chatgpt_model).encode(text, disallowed_special=())
+
+
+def count_tokens(text: str, chatgpt_model: str = None) -> int:
+    return len(encode(text, chatgpt_model))
+
+
+def count_tokens_batch(texts: list, chatgpt_model: str = None) -> list:
+    """
+    Count the tokens of many texts at once, encoding them in parallel.
+    """
+    encoded = get_encoding(chatgpt_model).encode_batch(
+        texts, disallowed_special=())
+
+    return [len(tokens) for tokens in encoded]
+
+
+def count_chat_tokens(messages: list, chatgpt_model: str = None) -> int:
+    """
+    Prompt tokens of a chat request, following the per-message overhead
+    documented for the gpt-3.5 and gpt-4 chat format.
+    """
+    tokens_count = 3  # every reply is primed with <|start|>assistant<|message|>
+
+    for message in messages:
+        tokens_count += 3
+
+        for value in message.values():
+            tokens_count += count_tokens(value, chatgpt_model)
+
+    return tokens_count
 
 
 def get_token_estimate(serialized_model: str) -> int:
     """
     Get the token estimate for a serialized model.
     """
-    tokenizer = GPT2Tokenizer.from_pretrained('gpt2')
-    tokens = tokenizer.encode(serialized_model)
-    count = len(tokens)
-
-    return count
+    return count_tokens(serialized_model)
 
 
 def main():
     if len(sys.argv) < 2:
         raise Exception('Model path not specified.')
 
-    model_path = sys.argv[1]
+    model_paths = sys.argv[1:]
+
+    serialized_models = []
 
-    with open(model_path, 'r') as f:
-        serialized_model = f.read()
+    for model_path in model_paths:
+        with open(model_path, 'r') as f:
+            serialized_models.append(f.read())
 
-        token_estimate = get_token_estimate(serialized_model)
+    token_estimates = count_tokens_batch(serialized_models)
 
-        print(f"Number of tokens in the BPMN model: {token_estimate}")
+    for model_path, token_estimate in zip(model_paths, token_estimates):
+        print(f"Number of tokens in the BPMN model {model_path}: {token_estimate}")
 
 
 if __name__ == '__main__':
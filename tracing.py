@@ -0,0 +1,261 @@
+import os
+import json
+import glob
+import time
+import threading
+import multiprocessing.util
+
+# Trace path and stage handed down to worker processes, forked or spawned
+TRACE_ENV = 'BPMN2TEXT_TRACE'
+STAGE_ENV = 'BPMN2TEXT_TRACE_STAGE'
+
+PROFILERS = ['cprofile', 'pyinstrument']
+
+enabled = False
+trace_path = None
+stage = None
+events = []
+
+# Process that started tracing and merges the parts of its workers
+owner_pid = None
+
+profiler = None
+profiler_name = None
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter_ns()
+
+        event = {
+            "name": self.name,
+            "cat": stage,
+            "ph": "X",
+            "ts": self.start / 1000,
+            "dur": (end - self.start) / 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_ident()
+        }
+
+        if self.args:
+            event['args'] = self.args
+
+        events.append(event)
+
+        return False
+
+
+def span(name, **args):
+    """
+    Time the enclosed block as a trace event. A shared no-op context when
+    tracing is off, so spans can stay in hot loops.
+    """
+    if not enabled:
+        return NULL_SPAN
+
+    return Span(name, args)
+
+
+def start(stage_name, path=None, profile=None):
+    """
+    Start tracing the spans of a stage to a Chrome trace-event file at
+    `path`, and optionally profile it with cProfile or pyinstrument.
+    """
+    global enabled, trace_path, stage, owner_pid, profiler, profiler_name
+
+    stage = stage_name
+
+    if path is not None:
+        enabled = True
+        trace_path = path
+        owner_pid = os.getpid()
+
+        os.environ[TRACE_ENV] = path
+        os.environ[STAGE_ENV] = stage_name
+
+        # Parts left over by the workers of an earlier run
+        for part_path in glob.glob(f'{glob.escape(path)}.*.part'):
+            os.remove(part_path)
+
+    if profile is not None:
+        profiler_name = profile
+        profiler = start_profiler(profile)
+
+
+def start_profiler(profile):
+    if profile == 'cprofile':
+        import cProfile
+
+        started = cProfile.Profile()
+        started.enable()
+
+        return started
+
+    if profile == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise Exception('Profiling with pyinstrument requires the pyinstrument package.')
+
+        started = Profiler()
+        started.start()
+
+        return started
+
+    raise Exception(f'Unknown profiler {profile}.')
+
+
+def init_worker():
+    """
+    Trace the spans of a pool worker process too, written to a part file
+    the parent merges when it stops.
+    """
+    global enabled, trace_path, stage, events
+
+    path = os.environ.get(TRACE_ENV)
+
+    # Initializers shared with the parent process leave its trace alone
+    if path is None or os.getpid() == owner_pid:
+        return
+
+    enabled = True
+    trace_path = path
+    stage = os.environ.get(STAGE_ENV)
+
+    # Forked workers inherit the events of their parent
+    events = []
+
+    multiprocessing.util.Finalize(None, write_part, exitpriority=10)
+
+
+def write_part():
+    with open(f'{trace_path}.{os.getpid()}.part', 'w') as fp:
+        json.dump(events, fp)
+
+
+def read_parts(path):
+    part_events = []
+
+    for part_path in sorted(glob.glob(f'{glob.escape(path)}.*.part')):
+        with open(part_path, 'r') as fp:
+            part_events += json.load(fp)
+
+        os.remove(part_path)
+
+    return part_events
+
+
+def summarize(trace_events):
+    """
+    Count, total, mean and max duration in milliseconds of every span name,
+    longest total first.
+    """
+    summary = {}
+
+    for event in trace_events:
+        durations = summary.setdefault((event['cat'], event['name']), [])
+        durations.append(event['dur'] / 1000)
+
+    rows = [{
+        "stage": stage_name,
+        "span": name,
+        "count": len(durations),
+        "total_ms": sum(durations),
+        "mean_ms": sum(durations) / len(durations),
+        "max_ms": max(durations)
+    } for (stage_name, name), durations in summary.items()]
+
+    return sorted(rows, key=lambda row: row['total_ms'], reverse=True)
+
+
+def print_summary(rows):
+    print('Trace summary:')
+    print(f"  {'stage':<12} {'span':<32} {'count':>8} {'total ms':>12} {'mean ms':>10} {'max ms':>10}")
+
+    for row in rows:
+        print(
+            f"  {row['stage'] or '':<12} {row['span']:<32} {row['count']:>8} {row['total_ms']:>12.1f} {row['mean_ms']:>10.3f} {row['max_ms']:>10.3f}")
+
+
+def stop_profiler():
+    global profiler
+
+    base_path = trace_path or 'profile'
+
+    if profiler_name == 'cprofile':
+        import pstats
+
+        profiler.disable()
+
+        stats_path = f'{base_path}.{stage}.prof'
+        profiler.dump_stats(stats_path)
+
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+
+        print(f"Wrote cProfile stats to {stats_path}")
+    else:
+        profiler.stop()
+
+        profile_path = f'{base_path}.{stage}.html'
+
+        with open(profile_path, 'w') as fp:
+            fp.write(profiler.output_html())
+
+        print(profiler.output_text())
+        print(f"Wrote pyinstrument profile to {profile_path}")
+
+    profiler = None
+
+
+def stop():
+    """
+    Write the trace of the stage, worker spans included, and print its
+    per-span summary.
+    """
+    global enabled
+
+    if profiler is not None:
+        stop_profiler()
+
+    if not enabled:
+        return
+
+    enabled = False
+    os.environ.pop(TRACE_ENV, None)
+    os.environ.pop(STAGE_ENV, None)
+
+    trace_events = events + read_parts(trace_path)
+
+    with open(trace_path, 'w') as fp:
+        json.dump({"traceEvents": trace_events,
+                  "displayTimeUnit": "ms"}, fp)
+
+    print_summary(summarize(trace_events))
+
+    print(f"Wrote {len(trace_events)} trace events to {trace_path}")
+
+
+def add_arguments(parser):
+    parser.add_argument('--trace', default=None,
+                        help='Write a Chrome trace-event JSON of the stage to this path and print a per-span summary')
+    parser.add_argument('--profile', choices=PROFILERS, default=None,
+                        help='Profile the stage with cProfile or pyinstrument')
@@ -0,0 +1,538 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import asyncio
+import hashlib
+import argparse
+import threading
+import multiprocessing
+
+import backends
+import cache
+import chunking
+import generate
+import manifest
+import planner
+import ratelimit
+import results_store
+import retries
+
+DEFAULT_LEASE_SECONDS = 600
+
+# Claims of a testcase before it is given up as crashing its workers
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Seconds an idle worker waits for leases of other workers to expire
+DEFAULT_POLL_INTERVAL = 5.0
+
+
+class WorkQueue:
+    """
+    Durable queue of the testcases of one or more sweeps, in one SQLite file.
+
+    A coordinator enqueues the testcases of each parameters.json. Workers
+    claim a few at a time under a lease, renew it while generating and
+    complete or fail them. Testcases whose lease expires, because their
+    worker crashed, are claimed again until `max_attempts`.
+
+    Workers on other hosts can share the queue through an NFS or SMB share
+    with working locks, if the queue is created with `shared_filesystem`:
+    the queue and the results stores of its sweeps then keep the rollback
+    journal, as WAL only works on one host. The setting is stored in the
+    queue, every worker opening it follows it.
+    """
+
+    def __init__(self, path, shared_filesystem=None):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        self.path = path
+
+        # Transactions are opened explicitly, claims need BEGIN IMMEDIATE.
+        # New databases start with the rollback journal, the settings are
+        # read before switching to WAL.
+        self.connection = sqlite3.connect(
+            path, timeout=60, isolation_level=None)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS settings (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS sweeps (
+                sweep_id TEXT PRIMARY KEY,
+                metadata TEXT NOT NULL,
+                options TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS tasks (
+                sweep_id TEXT NOT NULL,
+                testcase_hash TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                lease_owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (sweep_id, testcase_hash)
+            );
+            CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, lease_expires);
+        ''')
+
+        if shared_filesystem is not None:
+            self.connection.execute("INSERT OR REPLACE INTO settings VALUES ('shared_filesystem', ?)",
+                                    (json.dumps(shared_filesystem),))
+
+        setting = self.connection.execute(
+            "SELECT value FROM settings WHERE name = 'shared_filesystem'").fetchone()
+
+        self.shared_filesystem = json.loads(
+            setting[0]) if setting is not None else False
+
+        self.connection.execute(
+            f'PRAGMA journal_mode={results_store.get_journal_mode(self.shared_filesystem)}')
+
+    def add_sweep(self, metadata, options):
+        serialized_sweep = json.dumps([metadata, options], sort_keys=True)
+        sweep_id = hashlib.sha256(
+            serialized_sweep.encode('utf-8')).hexdigest()[:16]
+
+        self.connection.execute('INSERT OR IGNORE INTO sweeps VALUES (?, ?, ?)',
+                                (sweep_id, json.dumps(metadata), json.dumps(options)))
+
+        return sweep_id
+
+    def get_sweep(self, sweep_id):
+        metadata, options = self.connection.execute(
+            'SELECT metadata, options FROM sweeps WHERE sweep_id = ?', (sweep_id,)).fetchone()
+
+        return json.loads(metadata), json.loads(options)
+
+    def enqueue(self, sweep_id, testcase_hashes):
+        """
+        Add testcases to a sweep, leaving those already queued as they are.
+        Returns how many were added.
+        """
+        now = time.time()
+
+        with self.transaction():
+            before = self.connection.total_changes
+
+            self.connection.executemany("INSERT OR IGNORE INTO tasks (sweep_id, testcase_hash, updated_at) VALUES (?, ?, ?)",
+                                        [(sweep_id, testcase_hash, now) for testcase_hash in testcase_hashes])
+
+            return self.connection.total_changes - before
+
+    def transaction(self):
+        return Transaction(self.connection)
+
+    def claim(self, worker_id, count, lease_seconds, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        Lease up to `count` pending or expired testcases to a worker,
+        returning their (sweep_id, testcase_hash). Expired testcases out of
+        attempts are failed instead.
+        """
+        now = time.time()
+
+        with self.transaction():
+            self.connection.execute("UPDATE tasks SET status = 'failed', error = 'lease expired too many times', updated_at = ? WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                                    (now, now, max_attempts))
+
+            claimed = self.connection.execute("SELECT sweep_id, testcase_hash FROM tasks WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?) ORDER BY sweep_id, testcase_hash LIMIT ?",
+                                              (now, count)).fetchall()
+
+            self.connection.executemany("UPDATE tasks SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? WHERE sweep_id = ? AND testcase_hash = ?",
+                                        [(worker_id, now + lease_seconds, now, *task) for task in claimed])
+
+        return claimed
+
+    def renew(self, worker_id, lease_seconds):
+        now = time.time()
+
+        with self.transaction():
+            self.connection.execute("UPDATE tasks SET lease_expires = ?, updated_at = ? WHERE status = 'leased' AND lease_owner = ?",
+                                    (now + lease_seconds, now, worker_id))
+
+    def complete(self, worker_id, tasks):
+        self.finish(worker_id, tasks, 'done', None)
+
+    def fail(self, worker_id, tasks, error):
+        self.finish(worker_id, tasks, 'failed', error)
+
+    def skip_over_budget(self, worker_id, tasks):
+        self.finish(worker_id, tasks, 'skipped_budget',
+                    'over the budget share of its worker')
+
+    def finish(self, worker_id, tasks, status, error):
+        # A worker whose lease expired no longer owns its testcases
+        with self.transaction():
+            self.connection.executemany("UPDATE tasks SET status = ?, error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ? WHERE sweep_id = ? AND testcase_hash = ? AND lease_owner = ?",
+                                        [(status, error, time.time(), *task, worker_id) for task in tasks])
+
+    def requeue(self, statuses):
+        """
+        Queue the failed or budget-skipped testcases again, returning how
+        many of each status were requeued.
+        """
+        requeued = {}
+
+        with self.transaction():
+            for status in statuses:
+                requeued[status] = self.connection.execute("UPDATE tasks SET status = 'pending', attempts = 0, error = NULL, updated_at = ? WHERE status = ?",
+                                                           (time.time(), status)).rowcount
+
+        return requeued
+
+    def get_counts(self):
+        return dict(self.connection.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status').fetchall())
+
+    def is_drained(self):
+        counts = self.get_counts()
+
+        return counts.get('pending', 0) == 0 and counts.get('leased', 0) == 0
+
+    def close(self):
+        self.connection.close()
+
+
+class Transaction:
+    """
+    BEGIN IMMEDIATE transaction, taking the write lock up front so two
+    workers cannot claim the same testcases.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+class LeaseKeeper(threading.Thread):
+    """
+    Renews the leases of a worker while it generates, from a connection of
+    its own.
+    """
+
+    def __init__(self, queue_path, worker_id, lease_seconds):
+        super().__init__(daemon=True)
+
+        self.queue_path = queue_path
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+
+    def run(self):
+        queue = WorkQueue(self.queue_path)
+
+        while not self.stopped.wait(self.lease_seconds / 3):
+            queue.renew(self.worker_id, self.lease_seconds)
+
+        queue.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def get_worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def get_supported_testcases(metadata, options, unsupported):
+    testcases = generate.iter_testcases(metadata, metadata.get('filters'))
+
+    expected_completion_tokens = metadata.get(
+        'expected_completion_tokens', ratelimit.DEFAULT_EXPECTED_COMPLETION_TOKENS)
+
+    if options.get('chunk'):
+        return chunking.iter_planned_testcases(testcases, chunking.ChunkingPolicy.from_metadata(metadata), expected_completion_tokens, unsupported)
+
+    return planner.iter_supported_testcases(testcases, expected_completion_tokens, unsupported)
+
+
+def enqueue_parameters(queue, parameters_metadata_path, options):
+    """
+    Queue the supported testcases of a parameters.json that its run
+    manifest does not list as completed.
+    """
+    with open(parameters_metadata_path, 'r') as f:
+        metadata = json.load(f)
+
+    seed = metadata.get('seed', 123)
+    dataset_name = metadata['annotated_dataset_dir'].split('/')[-1]
+
+    sweep_id = queue.add_sweep(metadata, options)
+
+    completed_hashes = manifest.read_completed_hashes(
+        manifest.get_manifest_path(dataset_name))
+
+    skipped = {'count': 0}
+    unsupported = {'count': 0}
+
+    testcases = generate.iter_pending_testcases(get_supported_testcases(
+        metadata, options, unsupported), seed, completed_hashes, skipped)
+
+    added = queue.enqueue(
+        sweep_id, [testcase['testcase_hash'] for testcase in testcases])
+
+    print(
+        f"Queued {added} testcases of {parameters_metadata_path} as sweep {sweep_id}, skipped {skipped['count']} completed and {unsupported['count']} unsupported ones.")
+
+    return sweep_id
+
+
+class SweepRunner:
+    """
+    Generates the claimed testcases of one sweep in a worker, with the
+    backend, limits, cache and results store of its parameters. `share` is
+    the fraction of the rate limits and budget this worker may use.
+    """
+
+    def __init__(self, metadata, options, share=1.0, shared_filesystem=False):
+        self.metadata = metadata
+        self.options = options
+        self.share = share
+
+        self.seed = metadata.get('seed', 123)
+        self.concurrency = metadata.get('concurrency', 1)
+        self.stream = options.get('stream', metadata.get('stream', False))
+        self.expected_completion_tokens = metadata.get(
+            'expected_completion_tokens', ratelimit.DEFAULT_EXPECTED_COMPLETION_TOKENS)
+
+        dataset_name = metadata['annotated_dataset_dir'].split('/')[-1]
+
+        self.results_dir = os.path.join("results", dataset_name)
+        self.dead_letter_path = os.path.join(
+            self.results_dir, 'dead_letter.jsonl')
+
+        os.makedirs(self.results_dir, exist_ok=True)
+
+        budget_usd = metadata.get('budget_usd')
+
+        self.backend = backends.create_backend(metadata.get('backend', {}))
+        self.rate_limiter = ratelimit.RateLimiter(metadata.get(
+            'rate_limits', {}), ratelimit.DEFAULT_HEADROOM * share)
+        self.retry_policy = retries.RetryPolicy.from_metadata(metadata)
+        self.completion_cache = cache.CompletionCache.from_metadata(metadata)
+        self.budget = planner.Budget(
+            budget_usd * share if budget_usd is not None else None)
+        self.chunking_policy = chunking.ChunkingPolicy.from_metadata(metadata)
+        self.store = results_store.ResultsStore.open(
+            self.results_dir, shared_filesystem)
+
+        self.testcases = None
+
+    def get_testcases(self, testcase_hashes):
+        # Expand the sweep once per worker, testcases share their models
+        if self.testcases is None:
+            self.testcases = {}
+
+            for testcase in generate.iter_testcases(self.metadata, self.metadata.get('filters')):
+                testcase['testcase_hash'] = manifest.testcase_hash(
+                    testcase, self.seed)
+
+                self.testcases[testcase['testcase_hash']] = testcase
+
+        return [self.testcases[testcase_hash] for testcase_hash in testcase_hashes if testcase_hash in self.testcases]
+
+    def run(self, testcase_hashes):
+        """
+        Generate the testcases not stored yet. Returns the hashes of those
+        now in the results store and of those the budget share skipped.
+        """
+        testcases = [testcase for testcase in self.get_testcases(
+            testcase_hashes) if not self.store.has_testcase(testcase['testcase_hash'])]
+
+        unsupported = {'count': 0}
+
+        if self.options.get('chunk'):
+            testcases = chunking.iter_planned_testcases(
+                testcases, self.chunking_policy, self.expected_completion_tokens, unsupported)
+
+        asyncio.run(generate.generate_testcases(self.backend, testcases, self.seed, self.concurrency, self.rate_limiter, self.expected_completion_tokens,
+                                                self.retry_policy, self.dead_letter_path, self.completion_cache, self.store, self.budget, self.stream, self.chunking_policy))
+
+        stored = set(testcase_hash for testcase_hash in testcase_hashes if self.store.has_testcase(testcase_hash))
+
+        return stored, self.budget.over_budget_hashes.intersection(testcase_hashes) - stored
+
+    def close(self):
+        self.backend.close()
+        self.completion_cache.close()
+        self.store.close()
+
+
+def work(queue_path, lease_seconds=DEFAULT_LEASE_SECONDS, claim_size=None, share=1.0, max_attempts=DEFAULT_MAX_ATTEMPTS, poll_interval=DEFAULT_POLL_INTERVAL):
+    """
+    Claim, generate and complete testcases until the queue is drained.
+    """
+    queue = WorkQueue(queue_path)
+    worker_id = get_worker_id()
+
+    runners = {}
+    completed = 0
+    failed = 0
+    over_budget = 0
+
+    while True:
+        claimed = queue.claim(worker_id, claim_size or 1,
+                              lease_seconds, max_attempts)
+
+        if len(claimed) == 0:
+            if queue.is_drained():
+                break
+
+            time.sleep(poll_interval)
+            continue
+
+        by_sweep = {}
+
+        for sweep_id, testcase_hash in claimed:
+            by_sweep.setdefault(sweep_id, []).append(testcase_hash)
+
+        lease_keeper = LeaseKeeper(queue_path, worker_id, lease_seconds)
+        lease_keeper.start()
+
+        try:
+            for sweep_id, testcase_hashes in by_sweep.items():
+                if sweep_id not in runners:
+                    metadata, options = queue.get_sweep(sweep_id)
+
+                    runners[sweep_id] = SweepRunner(
+                        metadata, options, share, queue.shared_filesystem)
+
+                    # Claim as many testcases as the sweep has requests in flight
+                    claim_size = claim_size or runners[sweep_id].concurrency
+
+                stored, skipped = runners[sweep_id].run(testcase_hashes)
+
+                tasks = [(sweep_id, testcase_hash)
+                         for testcase_hash in testcase_hashes]
+
+                queue.complete(
+                    worker_id, [task for task in tasks if task[1] in stored])
+                queue.skip_over_budget(
+                    worker_id, [task for task in tasks if task[1] in skipped])
+                queue.fail(worker_id, [task for task in tasks if task[1] not in stored and task[1] not in skipped],
+                           'not generated, see the dead-letter file of the dataset')
+
+                completed += len(stored)
+                over_budget += len(skipped)
+                failed += len(tasks) - len(stored) - len(skipped)
+        finally:
+            lease_keeper.stop()
+
+    for runner in runners.values():
+        runner.close()
+
+    queue.close()
+
+    print(
+        f"Worker {worker_id} completed {completed} testcases, {failed} failed, {over_budget} skipped over its budget share.")
+
+
+def print_status(queue):
+    counts = queue.get_counts()
+
+    print(
+        f"Queue {queue.path} ({'shared filesystem, rollback journal' if queue.shared_filesystem else 'single host, WAL'}):")
+
+    for status in ['pending', 'leased', 'done', 'failed', 'skipped_budget']:
+        print(f"  {status}: {counts.get(status, 0)}")
+
+
+def run_local_workers(queue_path, workers, lease_seconds, claim_size, max_attempts):
+    """
+    Drain the queue with worker processes on this machine, each one using
+    an equal share of the rate limits and budget.
+    """
+    processes = [multiprocessing.Process(target=work, args=(
+        queue_path, lease_seconds, claim_size, 1 / workers, max_attempts)) for _ in range(workers)]
+
+    for process in processes:
+        process.start()
+
+    for process in processes:
+        process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run the generation of one or more sweeps through a durable work queue, with workers on any number of processes or hosts.')
+
+    parser.add_argument('command', choices=[
+                        'enqueue', 'work', 'run', 'status', 'requeue'])
+    parser.add_argument('queue_path', help='SQLite queue file, e.g. results/queue.sqlite')
+    parser.add_argument('parameters', nargs='*',
+                        help='Experiment parameters.json files to enqueue (enqueue and run)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Local worker processes (run), 0 uses every core')
+    parser.add_argument('--share', type=float, default=1.0,
+                        help='Fraction of the rate limits and budget this worker may use (work)')
+    parser.add_argument('--lease', type=float, default=DEFAULT_LEASE_SECONDS,
+                        help='Seconds a claimed testcase stays leased without renewal')
+    parser.add_argument('--claim-size', type=int, default=None,
+                        help='Testcases claimed at once, defaults to the sweep concurrency')
+    parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help='Claims of a testcase before it is failed')
+    parser.add_argument('--chunk', action='store_true',
+                        help='Generate models exceeding the context window in chunks (enqueue and run)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Use streaming responses (enqueue and run)')
+    parser.add_argument('--over-budget', action='store_true',
+                        help='Only requeue the testcases skipped over the budget, not the failed ones (requeue)')
+    parser.add_argument('--shared-filesystem', action='store_true', default=None,
+                        help='The queue and results are on an NFS or SMB share used by workers on several hosts, keep the rollback journal instead of WAL (enqueue and run)')
+
+    args = parser.parse_args()
+
+    options = {"chunk": args.chunk, "stream": args.stream}
+
+    if args.command in ['enqueue', 'run']:
+        if len(args.parameters) == 0:
+            raise Exception('Parameters metadata not specified.')
+
+        for parameters_metadata_path in args.parameters:
+            if not os.path.exists(parameters_metadata_path):
+                raise Exception(
+                    f'Parameters metadata {parameters_metadata_path} does not exist.')
+
+        queue = WorkQueue(args.queue_path, args.shared_filesystem)
+
+        for parameters_metadata_path in args.parameters:
+            enqueue_parameters(queue, parameters_metadata_path, options)
+
+        queue.close()
+
+    if args.command == 'work':
+        work(args.queue_path, args.lease, args.claim_size,
+             args.share, args.max_attempts)
+
+    if args.command == 'run':
+        run_local_workers(args.queue_path, args.workers or os.cpu_count(),
+                          args.lease, args.claim_size, args.max_attempts)
+
+    if args.command == 'requeue':
+        queue = WorkQueue(args.queue_path)
+
+        requeued = queue.requeue(
+            ['skipped_budget'] if args.over_budget else ['failed', 'skipped_budget'])
+
+        print(
+            f"Requeued {requeued.get('failed', 0)} failed and {requeued['skipped_budget']} budget-skipped testcases.")
+
+        queue.close()
+
+    if args.command in ['run', 'status', 'requeue']:
+        queue = WorkQueue(args.queue_path)
+
+        print_status(queue)
+
+        queue.close()
+
+
+if __name__ == '__main__':
+    main()